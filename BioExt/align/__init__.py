@@ -4,54 +4,349 @@ from __future__ import division, print_function
 import sys
 
 from collections import defaultdict
+from hashlib import sha1
+from math import ceil, sqrt
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from os import getpid
+from threading import local
+from time import time
 
 import numpy as np
 
-from Bio.Seq import Seq, translate as _translate
+from Bio.Seq import Seq, reverse_complement as _reverse_complement, translate as _translate
 from Bio.SeqRecord import SeqRecord
 
-from BioExt.align._align import _align, _compute_codon_matrices
+from BioExt.align._align import _align, _align_score, _compute_codon_matrices
+from BioExt.align._cache import _CACHE_VERSION, _digest, AlignCache, SharedArrays, cached_arrays
+from BioExt.align._pairwise import PackedTriangle, pairwise
+from BioExt.align._stats import AlignStats
 from BioExt.misc import gapless
 from BioExt.scorematrices import ProteinScoreMatrix as _ProteinScoreMatrix
 from BioExt.scorematrices import DNAScoreMatrix as _DNAScoreMatrix
 from BioExt.scorematrices.CodonMatrix import getEmpiricalCodonMatrix, getCodonMatrixAsArray
 
-__all__ = ['Aligner']
+__all__ = [
+    'AlignCache',
+    'Aligner',
+    'AlignStats',
+    'PackedTriangle',
+    'PreparedPanel',
+    'PreparedReference',
+    'pairwise'
+    ]
+
+
+# PreparedReference.orientation calls a strand only when the query shares
+# at least _ORIENTATION_RATIO times as many k-mers with the reference on it as
+# on the other strand, and at least _ORIENTATION_MARGIN more
+_ORIENTATION_K = 12
+_ORIENTATION_RATIO = 2
+_ORIENTATION_MARGIN = 3
+
+# PreparedReference.seed looks up every _SEED_STEP-th k-mer of the query,
+# ignoring those that occur more than _SEED_MAX_HITS times in the reference,
+# and chains the hits whose diagonals differ by at most _SEED_MAX_GAP:
+# the window is the span of the best chain of at least _SEED_MIN_HITS hits,
+# extended to cover the rest of the query, plus _SEED_MARGIN either side
+_SEED_K = 12
+_SEED_STEP = 6
+_SEED_MAX_HITS = 16
+_SEED_MAX_GAP = 32
+_SEED_MIN_HITS = 2
+_SEED_MARGIN = 32
+
+# PreparedPanel.screen counts the k-mers a query shares with each reference
+# of the panel, and picks the _PANEL_HITS references sharing the most
+_PANEL_K = 12
+_PANEL_HITS = 2
+
+# the dtype of the matrices for each precision: i32-scaled multiplies
+# every score and penalty by the smallest power of two up to _SCALE_MAX
+# which makes them all integral, and falls back to f64 if there is none,
+# or if the scores of an alignment could grow beyond _SCALE_BOUND.
+# f32 only gives the scores of f64 when every score and penalty is exact
+# in a float (a multiple of a power of two, as in DNA80 and BLOSUM62 at 2.5):
+# otherwise, as in the empirical codon matrix, the scores round differently,
+# by a few parts in 10^7, and of alignments that close, f32 may pick the other,
+# so reads that close to the expected identity may be kept or discarded otherwise
+_PRECISIONS = {
+    'f64': np.float64,
+    'f32': np.float32,
+    'i32-scaled': np.int32,
+    }
+_SCALE_MAX = 1024
+_SCALE_BOUND = 2 ** 29
+
+
+def _tostr(seq):
+    if isinstance(seq, SeqRecord):
+        return str(seq.seq)
+    elif isinstance(seq, Seq):
+        return str(seq)
+    else:
+        return seq
+
+
+def _aligned(ref_, query_, cigar, position):
+    # the aligned strings of the alignment of query_ to ref_ at position,
+    # as the backtrack builds them: the reference outside the alignment,
+    # the reference opposite deletions and the query opposite insertions
+    # are lowercase, and the query is padded with gaps to the length of the reference
+    ref_aligned = [ref_[:position].lower()]
+    query_aligned = ['-' * position]
+    i, j = position, 0
+    for op, num in cigar:
+        if op == 0:
+            ref_aligned.append(ref_[i:i + num])
+            query_aligned.append(query_[j:j + num])
+            i += num
+            j += num
+        elif op == 1:
+            ref_aligned.append('-' * num)
+            query_aligned.append(query_[j:j + num].lower())
+            j += num
+        else:
+            ref_aligned.append(ref_[i:i + num].lower())
+            query_aligned.append('-' * num)
+            i += num
+    ref_aligned.append(ref_[i:].lower())
+    query_aligned.append('-' * (len(ref_) - i))
+    return ''.join(ref_aligned), ''.join(query_aligned)
+
+
+def _orientation(forward, reverse):
+    # 1 if forward k-mer hits clearly outnumber reverse ones,
+    # -1 if reverse ones clearly outnumber forward ones, and 0 otherwise
+    if forward >= _ORIENTATION_RATIO * reverse and forward >= reverse + _ORIENTATION_MARGIN:
+        return 1
+    elif reverse >= _ORIENTATION_RATIO * forward and reverse >= forward + _ORIENTATION_MARGIN:
+        return -1
+    return 0
+
+
+def _integral_scale(values):
+    # the smallest power of two up to _SCALE_MAX which makes each of values integral,
+    # or None if there is no such power
+    values = np.concatenate([np.ravel(np.asarray(v, dtype=float)) for v in values])
+    scale = 1
+    while scale <= _SCALE_MAX:
+        scaled = values * scale
+        if np.all(scaled == np.floor(scaled)):
+            return scale
+        scale *= 2
+    return None
+
 
 def _protein_to_codon(protein_matrix, non_identity_penalty=None):
-    np.set_printoptions(threshold=np.nan)
     from BioExt.scorematrices._scorematrix import dletters
-    codon_matrix = np.ones((64, 64), dtype=float) * -1e4
     pletters = protein_matrix.letters
-    mapping = defaultdict(list)
-    stops = set()
-    for i in range(4):
-        for j in range(4):
-            for k in range(4):
-                cdn = ''.join(dletters[l] for l in (i, j, k)) #goes through codons in alphabetical order
-                aa = _translate(cdn)
-                idx = pletters.index(aa)
-                if aa == '*':
-                    stops.add(idx)
-                mapping[idx].append(16 * i + 4 * j + k)
+    # the amino acid of each codon, with the codons in alphabetical order (16 * i + 4 * j + k)
+    aas = np.array([
+        pletters.index(_translate(dletters[i] + dletters[j] + dletters[k]))
+        for i in range(4)
+        for j in range(4)
+        for k in range(4)
+        ], dtype=int)
+    stops = aas == pletters.index('*')
     protein_matrix_ = protein_matrix.tondarray()
-    M, N = protein_matrix_.shape
-    for i in range(M):
-        for k in mapping[i]:
-            for j in range(N):
-                for l in mapping[j]:
-                    # penalize transitions to stop codons
-                    if i != j and (i in stops or j in stops):
-                        pass
-                    else:
-                        codon_matrix[k, l] = protein_matrix_[i, j]
-                        if k != l and non_identity_penalty:
-                            codon_matrix[k, l] -= non_identity_penalty
-    print(protein_matrix_)
+    codon_matrix = protein_matrix_[aas[:, None], aas[None, :]]
+    if non_identity_penalty:
+        codon_matrix -= non_identity_penalty * (1 - np.eye(64))
+    # penalize transitions to stop codons
+    codon_matrix[(aas[:, None] != aas[None, :]) & (stops[:, None] | stops[None, :])] = -1e4
     return dletters, codon_matrix
 
 
+class PreparedReference:
+    # a reference encoded once by Aligner.prepare_reference,
+    # to be aligned against many queries:
+    # ref is the gapless reference, seq its uppercase string,
+    # and codes the reference through the character map
+    # (or its codon indices, which select its rows of the codon score matrix)
+    __slots__ = (
+        'ref',
+        'seq',
+        'encoded',
+        'codes',
+        'do_codon',
+        '__kmers',
+        '__digest',
+        )
+
+    def __init__(self, ref, seq, codes, do_codon):
+        self.ref = ref
+        self.seq = seq
+        self.encoded = seq.encode('utf-8')
+        self.codes = codes
+        self.do_codon = do_codon
+        self.__kmers = {}
+        self.__digest = None
+
+    def __len__(self):
+        return len(self.seq)
+
+    def digest(self):
+        # the digest of the reference the cache of an Aligner keys on, computed once
+        if self.__digest is None:
+            self.__digest = sha1(self.encoded).hexdigest()
+        return self.__digest
+
+    def kmers(self, k):
+        # the positions of each k-mer of the reference,
+        # indexed on first use for each k
+        index = self.__kmers.get(k)
+        if index is None:
+            index = defaultdict(list)
+            seq = self.seq
+            for i in range(len(seq) - k + 1):
+                index[seq[i:i + k]].append(i)
+            index = dict(index)
+            self.__kmers[k] = index
+        return index
+
+    def orientation(self, query, k=_ORIENTATION_K):
+        # 1 if query is clearly on the strand of the reference,
+        # -1 if its reverse complement clearly is, and 0 if the k-mers
+        # the query shares with either strand can't tell them apart
+        index = self.kmers(k)
+        query = _tostr(gapless(query)).upper()
+        rquery = _reverse_complement(query)
+        forward = sum(1 for i in range(len(query) - k + 1) if query[i:i + k] in index)
+        reverse = sum(1 for i in range(len(rquery) - k + 1) if rquery[i:i + k] in index)
+        return _orientation(forward, reverse)
+
+    def __chain(self, query, k):
+        # the (reference, query) positions of the k-mer hits of the best chain
+        # of query, in order, or None if it has no such chain
+        index = self.kmers(k)
+
+        hits = []
+        for i in range(0, len(query) - k + 1, _SEED_STEP):
+            positions = index.get(query[i:i + k])
+            if positions is not None and len(positions) <= _SEED_MAX_HITS:
+                hits.extend((j, i) for j in positions)
+        if len(hits) < _SEED_MIN_HITS:
+            return None
+        hits.sort()
+
+        # the longest chain of hits increasing in both the reference and the query,
+        # where each hit stays near the diagonal of the one before it
+        lengths = [1] * len(hits)
+        previous = [-1] * len(hits)
+        for a, (j, i) in enumerate(hits):
+            for b in range(a - 1, -1, -1):
+                j_, i_ = hits[b]
+                if j - j_ > len(query) + _SEED_MAX_GAP:
+                    break
+                if j_ < j and i_ < i and abs((j - i) - (j_ - i_)) <= _SEED_MAX_GAP and lengths[b] >= lengths[a]:
+                    lengths[a] = lengths[b] + 1
+                    previous[a] = b
+        last = max(range(len(hits)), key=lengths.__getitem__)
+        if lengths[last] < _SEED_MIN_HITS:
+            return None
+        chain = [hits[last]]
+        while previous[last] >= 0:
+            last = previous[last]
+            chain.append(hits[last])
+        chain.reverse()
+        return chain
+
+    def seed(self, query, k=_SEED_K, margin=_SEED_MARGIN):
+        # the (start, end) of the window of the reference the best chain
+        # of k-mer hits places query in, or None if it has no such chain
+        query = _tostr(gapless(query)).upper()
+        chain = self.__chain(query, k)
+        if chain is None:
+            return None
+
+        start = max(0, chain[0][0] - chain[0][1] - margin)
+        end = min(len(self.seq), chain[-1][0] + len(query) - chain[-1][1] + margin)
+        if self.do_codon:
+            # keep the window in frame
+            start -= start % 3
+            end += -end % 3
+        return start, end
+
+    def diagonals(self, query, k=_SEED_K):
+        # the (lowest, highest) offsets in the reference of the start of query
+        # along the diagonals of the best chain of k-mer hits,
+        # or None if it has no such chain
+        chain = self.__chain(_tostr(gapless(query)).upper(), k)
+        if chain is None:
+            return None
+        diagonals = [j - i for j, i in chain]
+        return min(diagonals), max(diagonals)
+
+    def window(self, start, end):
+        # the reference between start and end, prepared as this one is
+        # (start and end must be multiples of 3 if do_codon)
+        if self.do_codon:
+            codes = self.codes[start // 3:end // 3]
+        else:
+            codes = self.codes[start:end]
+        return PreparedReference(self.ref[start:end], self.seq[start:end], codes, self.do_codon)
+
+
+class PreparedPanel:
+    # references each encoded once by Aligner.prepare_panel, as PreparedReferences,
+    # and the references each k-mer occurs in, to screen a query
+    # for the few references worth aligning it to
+    __slots__ = (
+        'references',
+        '__k',
+        '__index',
+        )
+
+    def __init__(self, references, k=_PANEL_K):
+        self.references = list(references)
+        self.__k = k
+        index = defaultdict(list)
+        for i, ref in enumerate(self.references):
+            for kmer in ref.kmers(k):
+                index[kmer].append(i)
+        self.__index = dict(index)
+
+    def __len__(self):
+        return len(self.references)
+
+    def __getitem__(self, key):
+        return self.references[key]
+
+    def __shared(self, query):
+        # the number of k-mers of query each reference shares
+        k = self.__k
+        index = self.__index
+        shared = [0] * len(self.references)
+        for i in range(len(query) - k + 1):
+            for j in index.get(query[i:i + k], ()):
+                shared[j] += 1
+        return shared
+
+    def screen(self, query, hits=None, both_strands=False):
+        # the indices of the (at most) hits references query shares the most k-mers with
+        # (_PANEL_HITS by default), best first, each with the strand of query on it
+        # as PreparedReference.orientation tells it (1 unless both_strands),
+        # or every reference if it shares none with any
+        if hits is None:
+            hits = _PANEL_HITS
+        query = _tostr(gapless(query)).upper()
+        forward = self.__shared(query)
+        if both_strands:
+            reverse = self.__shared(_reverse_complement(query))
+        else:
+            reverse = [0] * len(self.references)
+        shared = [max(f, r) for f, r in zip(forward, reverse)]
+        # ties stay in the order of the panel
+        order = sorted((i for i in range(len(shared)) if shared[i]), key=lambda i: -shared[i])
+        if not order:
+            return [(i, 0 if both_strands else 1) for i in range(len(shared))]
+        return [
+            (i, _orientation(forward[i], reverse[i]) if both_strands else 1)
+            for i in order[:hits]
+            ]
+
+
 class Aligner:
     __slots__ = (
         '__globalStartingPoint',
@@ -68,14 +363,19 @@ class Aligner:
         '__do_local',
         '__do_affine',
         '__do_codon',
-        '__codon3x5',
-        '__codon3x4',
-        '__codon3x2',
-        '__codon3x1',
+        '__band_width',
+        '__max_cells',
+        '__buffer_cells',
+        '__x_drop',
+        '__stats',
+        '__cache',
+        '__cache_key',
+        '__codon_tables',
+        '__precision',
+        '__scale',
+        '__scaled',
         '__cached_pid',
-        '__cached_score_matrix',
-        '__cached_deletion_matrix',
-        '__cached_insertion_matrix',
+        '__cached_matrices',
         )
 
     def __init__(
@@ -91,8 +391,24 @@ class Aligner:
             expected_identity=None,
             do_local=True,
             do_affine=True,
-            do_codon=True
+            do_codon=True,
+            band_width=None,
+            max_cells=2 ** 24,
+            buffer_cells=None,
+            precision='f64',
+            x_drop=None,
+            stats=False,
+            cache=None
             ):
+        if precision not in _PRECISIONS:
+            raise ValueError('precision must be one of ' + ', '.join(sorted(_PRECISIONS)))
+
+        # X-drop stops extending the alignment where its score falls more than x_drop
+        # (in the units of the score matrix) below the best score in its column yet,
+        # which needs an alignment free to end anywhere
+        if x_drop is not None and x_drop > 0 and not (do_local or globalStartingPoint):
+            raise ValueError('x_drop requires do_local or globalStartingPoint')
+
         if(globalStartingPoint):
             print("Using a Global Starting Point")
 
@@ -159,10 +475,46 @@ class Aligner:
         for i, l in enumerate(letters):
             char_map[ord(l)] = i
 
+        # codon3x5, codon3x4, codon3x2 and codon3x1 depend only on score_matrix_,
+        # so are cached on disk, and map the same file in every process
         if do_codon:
-            codon3x5, codon3x4, codon3x2, codon3x1 = _compute_codon_matrices(score_matrix_)
+            codon_tables = cached_arrays(
+                'codon',
+                (score_matrix_,),
+                lambda: _compute_codon_matrices(score_matrix_)
+                )
         else:
-            codon3x5 = codon3x4 = codon3x2 = codon3x1 = np.zeros((0, 0), dtype=float)
+            codon_tables = SharedArrays([np.zeros((0, 0), dtype=float) for _ in range(4)])
+
+        # i32-scaled aligns with the score matrix, the penalties and the codon tables
+        # (which hold only entries of the score matrix) multiplied by scale
+        scale = 1
+        scaled = None
+        if precision == 'i32-scaled':
+            scale = _integral_scale((
+                score_matrix_,
+                open_insertion,
+                extend_insertion,
+                open_deletion,
+                extend_deletion,
+                miscall_cost
+                ))
+            if scale is None:
+                print("Scores are not integral at any scale up to " + str(_SCALE_MAX) + ", using f64 precision")
+                precision = 'f64'
+                scale = 1
+            else:
+                print("Scores scaled by " + str(scale) + " for i32-scaled precision")
+                score_matrix_scaled = score_matrix_ * scale
+                if do_codon:
+                    codon_tables_scaled = cached_arrays(
+                        'codon',
+                        (score_matrix_scaled,),
+                        lambda: _compute_codon_matrices(score_matrix_scaled)
+                        )
+                else:
+                    codon_tables_scaled = codon_tables
+                scaled = (score_matrix_scaled, np.abs(score_matrix_scaled).max(), codon_tables_scaled)
 
         self.__globalStartingPoint = globalStartingPoint
         self.__nchars = len(letters)
@@ -178,14 +530,31 @@ class Aligner:
         self.__do_local = do_local
         self.__do_affine = do_affine
         self.__do_codon = do_codon
-        self.__codon3x5 = codon3x5
-        self.__codon3x4 = codon3x4
-        self.__codon3x2 = codon3x2
-        self.__codon3x1 = codon3x1
+        self.__band_width = band_width
+        self.__max_cells = max_cells
+        self.__buffer_cells = buffer_cells
+        self.__x_drop = x_drop if x_drop is not None and x_drop > 0 else 0
+        # with stats, each alignment adds its counters to an AlignStats
+        self.__stats = AlignStats() if stats else None
+        # with an AlignCache, each alignment is keyed on the digest of these parameters,
+        # of the reference and of the query, and of the penalties it is computed with
+        self.__cache = cache
+        self.__cache_key = _digest((
+            _CACHE_VERSION,
+            letters,
+            score_matrix_,
+            do_codon,
+            globalStartingPoint,
+            precision,
+            scale,
+            self.__x_drop
+            )) if cache is not None else None
+        self.__codon_tables = codon_tables
+        self.__precision = precision
+        self.__scale = scale
+        self.__scaled = scaled
         self.__cached_pid = getpid()
-        self.__cached_score_matrix = np.empty((1,), dtype=float)
-        self.__cached_deletion_matrix = np.empty((1,), dtype=float)
-        self.__cached_insertion_matrix = np.empty((1,), dtype=float)
+        self.__cached_matrices = Aligner.__matrices()
 
     @staticmethod
     def _expected_score(score_matrix, expected_identity):
@@ -195,7 +564,12 @@ class Aligner:
             print("Expected Score Was Not Computed")
         else:
             N = len(score_matrix.letters)
-            freqs = list(score_matrix.freqs().values())
+            # the frequencies are a numerical optimization, so are cached on disk
+            freqs, = cached_arrays(
+                'freqs',
+                (type(score_matrix).__name__, score_matrix.letters, score_matrix.tondarray()),
+                lambda: [np.array(list(score_matrix.freqs().values()), dtype=float)]
+                )
             expected_score = 0.0
             pair_norm = 1.0 / (1.0 - sum(v ** 2 for v in freqs))
             for i in range(N):
@@ -227,7 +601,170 @@ class Aligner:
             extend_deletion=None,
             miscall_cost=None,
             do_local=None,
-            do_affine=None
+            do_affine=None,
+            band_width=None,
+            band_offset=None,
+            min_score=None
+            ):
+        return self.__align(
+            self.__cached(),
+            ref,
+            query,
+            open_insertion=open_insertion,
+            extend_insertion=extend_insertion,
+            open_deletion=open_deletion,
+            extend_deletion=extend_deletion,
+            miscall_cost=miscall_cost,
+            do_local=do_local,
+            do_affine=do_affine,
+            band_width=band_width,
+            band_offset=band_offset,
+            min_score=min_score
+            )
+
+    def cigar(
+            self,
+            ref,
+            query,
+            open_insertion=None,
+            extend_insertion=None,
+            open_deletion=None,
+            extend_deletion=None,
+            miscall_cost=None,
+            do_local=None,
+            do_affine=None,
+            band_width=None,
+            band_offset=None,
+            min_score=None
+            ):
+        # align as __call__ does, but return the (per-position) score,
+        # the alignment as a list of (SAM operation, length) pairs (0 is M, 1 is I, 2 is D),
+        # its position in ref and its edit distance (NM) straight from the backtrack,
+        # as misc.compute_cigar would find them, without building the aligned strings
+        return self.__align(
+            self.__cached(),
+            ref,
+            query,
+            open_insertion=open_insertion,
+            extend_insertion=extend_insertion,
+            open_deletion=open_deletion,
+            extend_deletion=extend_deletion,
+            miscall_cost=miscall_cost,
+            do_local=do_local,
+            do_affine=do_affine,
+            band_width=band_width,
+            band_offset=band_offset,
+            min_score=min_score,
+            do_cigar=True
+            )
+
+    def prepare_reference(self, ref):
+        # encode ref once, so that aligning it to each query
+        # costs nothing more than the query itself:
+        # the result may be passed as ref to __call__, align_many and score
+        ref = gapless(ref)
+        ref_ = _tostr(ref).upper()
+
+        if self.__do_codon and len(ref_) % 3 != 0:
+            raise ValueError('when do_codon = True, len(ref) must be a multiple of 3. Your len(ref) mod 3 was ' + str(len(ref_)%3))
+
+        codes = self.__char_map[np.frombuffer(ref_.encode('utf-8'), dtype=np.uint8)]
+
+        if self.__do_codon:
+            codes = codes.reshape((-1, 3))
+            codes = (codes[:, 0] * self.__nchars + codes[:, 1]) * self.__nchars + codes[:, 2]
+            # codons with unknown characters score as the last row of the matrix
+            codes[codes < 0] = self.__score_matrix_.shape[0] - 1
+
+        return PreparedReference(ref, ref_, np.ascontiguousarray(codes), self.__do_codon)
+
+    def prepare_panel(self, refs):
+        # prepare each of refs as prepare_reference does, as a PreparedPanel
+        # which picks the few of them worth aligning each query to
+        return PreparedPanel(self.prepare_reference(ref) for ref in refs)
+
+    def __precision_for(self, penalties, size):
+        # the dtype of the matrices, the scale, the score matrix, the penalties
+        # and the codon tables to align with at our precision: i32-scaled falls back
+        # to f64 when the penalties are not integral at our scale, or when the scores
+        # of an alignment of size (rows + columns) could overflow
+        if self.__precision == 'i32-scaled':
+            score_matrix_, max_cost, codon_tables = self.__scaled
+            penalties_ = tuple(penalty * self.__scale for penalty in penalties)
+            max_cost = max([max_cost] + [abs(penalty) for penalty in penalties_])
+            if all(penalty == int(penalty) for penalty in penalties_) and max_cost * size < _SCALE_BOUND:
+                return np.int32, self.__scale, score_matrix_, penalties_, codon_tables
+        return (
+            _PRECISIONS['f32' if self.__precision == 'f32' else 'f64'],
+            1,
+            self.__score_matrix_,
+            penalties,
+            self.__codon_tables
+            )
+
+    def __reference(self, ref):
+        # the gapless reference, its uppercase string and its encoding,
+        # and its codes if it was prepared (otherwise AlignStrings computes them)
+        if isinstance(ref, PreparedReference):
+            if ref.do_codon != self.__do_codon:
+                raise ValueError('ref was prepared for a different value of do_codon')
+            return ref.ref, ref.seq, ref.encoded, ref.codes
+        ref = gapless(ref)
+        ref_ = _tostr(ref).upper()
+        return ref, ref_, ref_.encode('utf-8'), None
+
+    def align_many(self, ref, queries, n_threads=None, **kwargs):
+        # align each of queries to ref as __call__ would (with kwargs),
+        # on a pool of n_threads threads (one per cpu by default),
+        # and return the results in the order of queries
+        return self.align_pairs(((ref, query) for query in queries), n_threads, **kwargs)
+
+    def align_pairs(self, pairs, n_threads=None, do_cigar=False, **kwargs):
+        # align the query of each of pairs to its ref as __call__ would (with kwargs),
+        # or as cigar would if do_cigar, on a pool of n_threads threads (one per cpu by default),
+        # and return the results in the order of pairs:
+        # each thread has its own matrices, and the alignment itself
+        # runs without the GIL
+        if n_threads is None:
+            n_threads = cpu_count()
+
+        pairs = list(pairs)
+
+        if n_threads <= 1 or len(pairs) <= 1:
+            matrices = self.__cached()
+            return [self.__align(matrices, ref, query, do_cigar=do_cigar, **kwargs) for ref, query in pairs]
+
+        thread = local()
+
+        def align(pair):
+            if not hasattr(thread, 'matrices'):
+                thread.matrices = Aligner.__matrices()
+            ref, query = pair
+            return self.__align(thread.matrices, ref, query, do_cigar=do_cigar, **kwargs)
+
+        pool = ThreadPool(min(n_threads, len(pairs)))
+        try:
+            return pool.map(align, pairs)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __align(
+            self,
+            matrices,
+            ref,
+            query,
+            open_insertion=None,
+            extend_insertion=None,
+            open_deletion=None,
+            extend_deletion=None,
+            miscall_cost=None,
+            do_local=None,
+            do_affine=None,
+            band_width=None,
+            band_offset=None,
+            min_score=None,
+            do_cigar=False
             ):
 
         # populate defaults from initialization
@@ -245,37 +782,52 @@ class Aligner:
             do_local = self.__do_local
         if do_affine is None:
             do_affine = self.__do_affine
+        if band_width is None:
+            band_width = self.__band_width
 
-        ref = gapless(ref)
+        # banded alignment only computes the cells within band_width
+        # of the diagonal placing the query at band_offset in the reference,
+        # the band is widened automatically if the alignment runs along its edge,
+        # or if it scores below min_score (the per-position score of an alignment
+        # known to exist, say from score)
+        if band_width is None or band_width <= 0:
+            band_width = 0
+
+        prepared = ref if isinstance(ref, PreparedReference) else None
+        ref_digest = prepared.digest() if prepared is not None and self.__cache is not None else None
+        ref, ref_, b_ref, ref_codes = self.__reference(ref)
         query = gapless(query)
 
-        # if the reference and query are the same, we can return early
-        if len(ref) and ref == query:
-            if codonMatrix and self.__do_codon:
-                 print("returning early when using a codon matrix is not currently supported")
-            elif self.__do_codon:
-                score = sum(self.__score_matrix[char, char] for char in _translate(ref))
+        # without a band_offset, the band follows the diagonals of the best chain
+        # of k-mer seeds of the query, and there is no band if it has none
+        if band_width and band_offset is None:
+            if prepared is None:
+                prepared = PreparedReference(ref, ref_, None, self.__do_codon)
+            diagonals = prepared.diagonals(query)
+            if diagonals is None:
+                band_width = 0
             else:
-                score = sum(self.__score_matrix[char, char] for char in ref)
-            return score / len(ref), ref, query
+                lo, hi = diagonals
+                band_offset = (lo + hi) // 2
+                band_width += (hi - lo + 1) // 2
+        if not band_width:
+            band_offset = 0
 
-        if isinstance(ref, SeqRecord):
-            ref_ = str(ref.seq)
-        elif isinstance(ref, Seq):
-            ref_ = str(ref)
-        else:
-            ref_ = ref
-
-        if isinstance(query, SeqRecord):
-            query_ = str(query.seq)
-        elif isinstance(query, Seq):
-            query_ = str(query)
-        else:
-            query_ = query
+        # if the reference and query are the same, we can return early
+        # (but not with the empirical codon matrix, which scores codons directly),
+        # normalizing the score per position as the alignment would
+        codonMatrix = self.__do_codon and not isinstance(self.__score_matrix, _ProteinScoreMatrix)
+        if len(ref_) and not codonMatrix and ref_ == _tostr(query).upper():
+            if self.__do_codon:
+                score = sum(self.__score_matrix[char, char] for char in _translate(ref_)) / (len(ref_) / 3)
+            else:
+                score = sum(self.__score_matrix[char, char] for char in ref_) / len(ref_)
+            if do_cigar:
+                return score, [(0, len(ref_))], 0, 0
+            return score, ref, query
 
         # convert to uppercase, because _align assumes it
-        ref_ = ref_.upper()
-        query_ = query_.upper()
+        query_ = _tostr(query).upper()
 
         if self.__do_codon and len(ref_) % 3 != 0:
             raise ValueError('when do_codon = True, len(ref) must be a multiple of 3. Your len(ref) mod 3 was ' + str(len(ref_)%3))
@@ -288,39 +840,78 @@ class Aligner:
 #         else:
 #             ns = 0
 
-        # for shared memory safety, recreate matrices if the PID changed
-        current_pid = getpid()
-        if self.__cached_pid != current_pid:
-            self.__cached_pid = current_pid
-            self.__cached_score_matrix = np.empty((1,), dtype=float)
-            self.__cached_deletion_matrix = np.empty((1,), dtype=float)
-            self.__cached_insertion_matrix = np.empty((1,), dtype=float)
-
         if self.__do_codon:
-            cache_size = (len(ref_) // 3 + 1) * (len(query_) + 1)
+            rows = len(ref_) // 3 + 1
+        else:
+            rows = len(ref_) + 1
+        cols = len(query_) + 1
+
+        # above max_cells, switch to linear memory: keep a block of rows
+        # and the first row of every block, about 2 sqrt(rows) rows in all,
+        # and recompute each block from its first row during the backtrack
+        if self.__max_cells and rows > 1 and rows * cols > self.__max_cells:
+            block_rows = int(ceil(sqrt(rows - 1)))
+            cache_size = (block_rows + 1 + -(-(rows - 1) // block_rows)) * cols
         else:
-            cache_size = (len(ref_) + 1) * (len(query_) + 1)
+            block_rows = 0
+            cache_size = rows * cols
+
+        dtype, scale, score_matrix_, penalties, codon_tables = self.__precision_for(
+            (open_insertion, extend_insertion, open_deletion, extend_deletion, miscall_cost),
+            rows + cols
+            )
+        open_insertion, extend_insertion, open_deletion, extend_deletion, miscall_cost = penalties
 
-        if self.__cached_score_matrix.shape[0] < cache_size:
-            self.__cached_score_matrix.resize((cache_size,))
+        # normalize scores to per-position
+        norm = scale * ((len(query_) / 3) if self.__do_codon else len(query_))
 
-        if do_affine:
-            if self.__cached_deletion_matrix.shape[0] < cache_size:
-                self.__cached_deletion_matrix.resize((cache_size,))
+        # min_score in the units of the matrices, less a little for the rounding of the scores
+        if min_score is None or not band_width:
+            min_score = float('-Inf')
+        else:
+            min_score = min_score * norm - 1e-6 * max(1.0, abs(min_score * norm))
 
-            if self.__cached_insertion_matrix.shape[0] < cache_size:
-                self.__cached_insertion_matrix.resize((cache_size,))
+        # with a cache, the alignment is looked up there by the digest of all it depends on,
+        # otherwise it is computed as a CIGAR to be kept there,
+        # from which the aligned strings are built as the backtrack would
+        key = None
+        cached = None
+        if self.__cache is not None and len(query_):
+            key = _digest((
+                self.__cache_key,
+                ref_digest if ref_digest is not None else sha1(b_ref).hexdigest(),
+                query_,
+                penalties,
+                do_local,
+                do_affine,
+                band_width,
+                band_offset,
+                min_score
+                ))
+            cached = self.__cache.get(key)
 
         if len(query) == 0:
+            if do_cigar:
+                return float('-Inf'), [], 0, 0
             score, ref_aligned, query_aligned = float('-Inf'), ref_, '-' * len(ref_)
+        elif cached is not None:
+            if do_cigar:
+                return cached
+            score, cigar, position, _ = cached
+            ref_aligned, query_aligned = _aligned(ref_, query_, cigar, position)
         else:
-            score, ref_aligned, query_aligned = _align(
-                ref_.encode('utf-8'),
+            resizes = Aligner.__resize(matrices, cache_size, do_affine, dtype)
+            codon3x5, codon3x4, codon3x2, codon3x1 = codon_tables
+            counters = np.zeros((3,), dtype=int) if self.__stats is not None else None
+
+            start = time()
+            result = _align(
+                b_ref,
                 query_.encode('utf-8'),
                 self.__nchars,
                 self.__char_map,
-                self.__score_matrix_,
-                self.__score_matrix_.shape[0],
+                score_matrix_,
+                score_matrix_.shape[0],
                 open_insertion,
                 extend_insertion,
                 open_deletion,
@@ -330,18 +921,41 @@ class Aligner:
                 do_affine,
 		self.__globalStartingPoint,
                 self.__do_codon,
-                self.__codon3x5,
-                self.__codon3x4,
-                self.__codon3x2,
-                self.__codon3x1,
-                self.__cached_score_matrix,
-                self.__cached_deletion_matrix,
-                self.__cached_insertion_matrix
+                codon3x5,
+                codon3x4,
+                codon3x2,
+                codon3x1,
+                matrices[0],
+                matrices[1],
+                matrices[2],
+                band_width,
+                band_offset,
+                block_rows,
+                ref_codes,
+                do_cigar or key is not None,
+                self.__x_drop * scale,
+                counters,
+                min_score
                 )
 
-            if sys.version_info >= (3, 0):
-                ref_aligned = ref_aligned.decode('utf-8')
-                query_aligned = query_aligned.decode('utf-8')
+            if counters is not None:
+                self.__stats.add(time() - start, counters, resizes)
+
+            if do_cigar or key is not None:
+                score, cigar, position, edit_distance = result
+                score /= norm
+                if key is not None:
+                    self.__cache.put(key, (score, cigar, position, edit_distance))
+                if do_cigar:
+                    return score, cigar, position, edit_distance
+                ref_aligned, query_aligned = _aligned(ref_, query_, cigar, position)
+            else:
+                score, ref_aligned, query_aligned = result
+                score /= norm
+
+                if sys.version_info >= (3, 0):
+                    ref_aligned = ref_aligned.decode('utf-8')
+                    query_aligned = query_aligned.decode('utf-8')
 
         if isinstance(ref, SeqRecord):
             ref_aligned_ = SeqRecord(
@@ -371,11 +985,161 @@ class Aligner:
         else:
             query_aligned_ = query_aligned
 
+        return score, ref_aligned_, query_aligned_
+
+    def score(
+            self,
+            ref,
+            query,
+            open_insertion=None,
+            extend_insertion=None,
+            open_deletion=None,
+            extend_deletion=None,
+            miscall_cost=None,
+            do_local=None,
+            do_affine=None
+            ):
+        # the (per-position) score of the alignment __call__ would return,
+        # computed with two rows of the matrices and without the backtrack,
+        # which makes for a cheap test against expected()
+
+        if open_insertion is None:
+            open_insertion = self.__open_insertion
+        if extend_insertion is None:
+            extend_insertion = self.__extend_insertion
+        if open_deletion is None:
+            open_deletion = self.__open_deletion
+        if extend_deletion is None:
+            extend_deletion = self.__extend_deletion
+        if miscall_cost is None:
+            miscall_cost = self.__miscall_cost
+        if do_local is None:
+            do_local = self.__do_local
+        if do_affine is None:
+            do_affine = self.__do_affine
+
+        ref, ref_, b_ref, ref_codes = self.__reference(ref)
+        query_ = _tostr(gapless(query)).upper()
+
+        if self.__do_codon and len(ref_) % 3 != 0:
+            raise ValueError('when do_codon = True, len(ref) must be a multiple of 3. Your len(ref) mod 3 was ' + str(len(ref_)%3))
+
+        if len(query_) == 0:
+            return float('-Inf')
+
+        dtype, scale, score_matrix_, penalties, codon_tables = self.__precision_for(
+            (open_insertion, extend_insertion, open_deletion, extend_deletion, miscall_cost),
+            (len(ref_) // 3 if self.__do_codon else len(ref_)) + len(query_) + 2
+            )
+        open_insertion, extend_insertion, open_deletion, extend_deletion, miscall_cost = penalties
+
+        matrices = self.__cached()
+        resizes = Aligner.__resize(matrices, 2 * (len(query_) + 1), do_affine, dtype)
+        codon3x5, codon3x4, codon3x2, codon3x1 = codon_tables
+        counters = np.zeros((3,), dtype=int) if self.__stats is not None else None
+
+        start = time()
+        score = _align_score(
+            b_ref,
+            query_.encode('utf-8'),
+            self.__nchars,
+            self.__char_map,
+            score_matrix_,
+            score_matrix_.shape[0],
+            open_insertion,
+            extend_insertion,
+            open_deletion,
+            extend_deletion,
+            miscall_cost,
+            do_local,
+            do_affine,
+            self.__globalStartingPoint,
+            self.__do_codon,
+            codon3x5,
+            codon3x4,
+            codon3x2,
+            codon3x1,
+            matrices[0],
+            matrices[1],
+            matrices[2],
+            ref_codes,
+            self.__x_drop * scale,
+            counters
+            )
+
+        if counters is not None:
+            self.__stats.add(time() - start, counters, resizes)
+
         # normalize score to per-position
-        if len(query_):
-            score /= (len(query_) / 3) if self.__do_codon else len(query_)
+        return score / (scale * ((len(query_) / 3) if self.__do_codon else len(query_)))
 
-        return score, ref_aligned_, query_aligned_
+    @staticmethod
+    def __matrices():
+        # the score, deletion, and insertion matrices
+        return [np.empty((1,), dtype=float) for _ in range(3)]
+
+    @staticmethod
+    def __resize(matrices, cache_size, do_affine, dtype=np.float64):
+        # the matrices must all share dtype, even those unused without do_affine,
+        # return the number reallocated to hold cache_size cells
+        resizes = 0
+        for i in range(3):
+            if matrices[i].dtype != dtype:
+                matrices[i] = np.empty((1,), dtype=dtype)
+        for i in ((0, 1, 2) if do_affine else (0,)):
+            if matrices[i].shape[0] < cache_size:
+                matrices[i] = np.empty((cache_size,), dtype=dtype)
+                resizes += 1
+        return resizes
+
+    @staticmethod
+    def __shrink(matrices, buffer_cells):
+        # release the matrices above buffer_cells
+        for i in range(3):
+            if matrices[i].shape[0] > buffer_cells:
+                matrices[i] = np.empty((1,), dtype=matrices[i].dtype)
+
+    def __getstate__(self):
+        # the matrices are scratch space, not worth sending to another process
+        state = dict((name, getattr(self, '_Aligner' + name)) for name in Aligner.__slots__)
+        state['__cached_matrices'] = Aligner.__matrices()
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, '_Aligner' + name, value)
+
+    @property
+    def stats(self):
+        # the AlignStats of the alignments so far, if created with stats=True
+        return self.__stats
+
+    @property
+    def do_codon(self):
+        return self.__do_codon
+
+    @property
+    def buffer_cells(self):
+        # the cells the matrices of this process are cut back to by release_buffers
+        return self.__buffer_cells
+
+    def release_buffers(self):
+        # release the matrices of this process above buffer_cells
+        # (all of them without it), say while it is idle: in between,
+        # they are kept however large the alignments grow them,
+        # rather than reallocated for each large alignment
+        if self.__buffer_cells is None:
+            self.__cached_matrices = Aligner.__matrices()
+        else:
+            Aligner.__shrink(self.__cached(), self.__buffer_cells)
+
+    def __cached(self):
+        # for shared memory safety, recreate matrices if the PID changed
+        current_pid = getpid()
+        if self.__cached_pid != current_pid:
+            self.__cached_pid = current_pid
+            self.__cached_matrices = Aligner.__matrices()
+        return self.__cached_matrices
 
     def expected(self, score, expected_identity=None):
         if expected_identity is None:
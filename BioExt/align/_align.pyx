@@ -5,7 +5,7 @@ import numpy as np
 cimport numpy as np
 cimport cython
 
-from libc.math cimport exp, log
+from libc.math cimport exp, log, INFINITY
 from libc.stdlib cimport free
 
 dtype = np.float64
@@ -20,15 +20,16 @@ GAP = '-'
 cdef dtype_t A_LARGE_NUMBER
 A_LARGE_NUMBER = 1.0e100
 
-cdef extern from "alignment.h":
-    dtype_t AlignStrings(
+# AlignStrings, and its specializations over float32 and int32 matrices,
+# which take the scoring matrices untyped
+ctypedef dtype_t (*align_strings_t)(
         char *,
         char *,
         char **,
         char **,
         itype_t,
-        itype_t *,
-        dtype_t *,
+        const itype_t *,
+        const dtype_t *,
         itype_t,
         char,
         dtype_t,
@@ -39,16 +40,33 @@ cdef extern from "alignment.h":
         itype_t,
         itype_t,
         itype_t,
-	itype_t,
-        dtype_t *,
-        dtype_t *,
-        dtype_t *,
-        dtype_t *,
-        dtype_t *,
-        dtype_t *,
-        dtype_t *
+        itype_t,
+        const dtype_t *,
+        const dtype_t *,
+        const dtype_t *,
+        const dtype_t *,
+        void *,
+        void *,
+        void *,
+        itype_t,
+        itype_t,
+        itype_t *,
+        itype_t,
+        const itype_t *,
+        itype_t **,
+        itype_t *,
+        itype_t *,
+        itype_t *,
+        dtype_t,
+        itype_t *
         ) nogil
 
+cdef extern from "alignment.h":
+    enum: ALIGN_STATS_COUNT
+    align_strings_t AlignStrings
+    align_strings_t AlignStringsF32
+    align_strings_t AlignStringsI32
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
@@ -121,6 +139,48 @@ def _compute_codon_matrices(dtype_t[:, :] cost_matrix):
     return codon3x5, codon3x4, codon3x2, codon3x1
 
 
+cdef itype_t * _ref_codes(
+        bytes b_ref,
+        itype_t do_codon,
+        np.ndarray[itype_t, ndim=1, mode='c'] ref_codes) except? NULL:
+    # ref_codes is the reference already encoded through the character map,
+    # or as codon indices if do_codon, or None to encode it in AlignStrings
+    if ref_codes is None:
+        return NULL
+    if ref_codes.shape[0] != (len(b_ref) // 3 if do_codon else len(b_ref)):
+        raise ValueError('ref_codes does not match the reference')
+    return <itype_t *> ref_codes.data
+
+
+cdef itype_t * _stats(np.ndarray[itype_t, ndim=1, mode='c'] stats) except? NULL:
+    # stats is an array of the counters AlignStrings adds to
+    # (cells, traceback length and frameshifts), or None
+    if stats is None:
+        return NULL
+    if stats.shape[0] < ALIGN_STATS_COUNT:
+        raise ValueError('stats must hold {0} counters'.format(ALIGN_STATS_COUNT))
+    return <itype_t *> stats.data
+
+
+cdef align_strings_t _align_strings(
+        np.ndarray score_matrix,
+        np.ndarray deletion_matrix,
+        np.ndarray insertion_matrix) except NULL:
+    # the AlignStrings for the dtype of the matrices, which must all share it
+    for matrix in (score_matrix, deletion_matrix, insertion_matrix):
+        if matrix.dtype != score_matrix.dtype:
+            raise ValueError('the matrices must all share a dtype')
+        if not matrix.flags.c_contiguous:
+            raise ValueError('the matrices must be C-contiguous')
+    if score_matrix.dtype == np.float64:
+        return AlignStrings
+    elif score_matrix.dtype == np.float32:
+        return AlignStringsF32
+    elif score_matrix.dtype == np.int32:
+        return AlignStringsI32
+    raise ValueError('unsupported matrix dtype: {0}'.format(score_matrix.dtype))
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def _align(
@@ -143,47 +203,111 @@ def _align(
         np.ndarray[dtype_t, ndim=2, mode='c'] codon3x4,
         np.ndarray[dtype_t, ndim=2, mode='c'] codon3x2,
         np.ndarray[dtype_t, ndim=2, mode='c'] codon3x1,
-        np.ndarray[dtype_t, ndim=1, mode='c'] score_matrix,
-        np.ndarray[dtype_t, ndim=1, mode='c'] deletion_matrix,
-        np.ndarray[dtype_t, ndim=1, mode='c'] insertion_matrix):
-    
+        np.ndarray score_matrix not None,
+        np.ndarray deletion_matrix not None,
+        np.ndarray insertion_matrix not None,
+        itype_t band_width=0,
+        itype_t band_offset=0,
+        itype_t block_rows=0,
+        np.ndarray[itype_t, ndim=1, mode='c'] ref_codes=None,
+        itype_t do_cigar=0,
+        dtype_t x_drop=0,
+        np.ndarray[itype_t, ndim=1, mode='c'] stats=None,
+        dtype_t min_score=-INFINITY):
+
+    # returns the score and the aligned strings, or if do_cigar,
+    # the score, the alignment as a list of (SAM operation, length) pairs,
+    # its position in the reference, and its edit distance,
+    # without building the aligned strings at all.
+    # if x_drop > 0 (and do_local or globalStartingPoint), cells scoring more than
+    # x_drop below the best score so far are not extended, and the alignment
+    # ends where it would without X-drop, unless X-drop pruned every cell there:
+    # then it ends at the best cell, and pays for the rest of the query as insertions.
+    # if stats is given, the cells computed, the length of the traceback
+    # and the frameshifts in it are added to its counters.
+    # a banded alignment scoring below min_score is widened, as one
+    # running along the edge of the band is
+
     # cast from unicode to char *
     cdef char * ref = b_ref
     cdef char * query = b_query
+    cdef itype_t * codes = _ref_codes(b_ref, do_codon, ref_codes)
+    cdef align_strings_t align_strings = _align_strings(score_matrix, deletion_matrix, insertion_matrix)
+    cdef itype_t * counters = _stats(stats)
 
     cdef char * ref_aligned = NULL
     cdef char * query_aligned = NULL
+    cdef char ** ref_res = NULL if do_cigar else &ref_aligned
+    cdef char ** query_res = NULL if do_cigar else &query_aligned
     cdef bytes b_ref_aligned
     cdef bytes b_query_aligned
     cdef dtype_t score
+    cdef itype_t band_touched = 0
+    cdef itype_t * cigar = NULL
+    cdef itype_t ** cigar_res = &cigar if do_cigar else NULL
+    cdef itype_t cigar_len = 0
+    cdef itype_t position = 0
+    cdef itype_t edit_distance = 0
+    cdef itype_t i
 
     if do_codon and len(b_ref) % 3 != 0:
         raise ValueError('when do_codon = True, len(ref) must be a multiple of 3')
     
     try:
-        score = AlignStrings(
-            ref, query,
-            &ref_aligned, &query_aligned,
-            char_count,
-            <itype_t *> char_map.data,
-            <dtype_t *> cost_matrix.data,
-            cost_stride,
-            GAP,
-            open_insertion, extend_insertion,
-            open_deletion, extend_deletion,
-            miscall_cost,
-            do_local, do_affine, do_codon, globalStartingPoint, 
-            <dtype_t *> codon3x5.data,
-            <dtype_t *> codon3x4.data,
-            <dtype_t *> codon3x2.data,
-            <dtype_t *> codon3x1.data,
-            <dtype_t *> score_matrix.data,
-            <dtype_t *> deletion_matrix.data,
-            <dtype_t *> insertion_matrix.data)
+        while True:
+            # release the GIL, so that other threads may align at the same time
+            with nogil:
+                score = align_strings(
+                    ref, query,
+                    ref_res, query_res,
+                    char_count,
+                    <itype_t *> char_map.data,
+                    <dtype_t *> cost_matrix.data,
+                    cost_stride,
+                    GAP,
+                    open_insertion, extend_insertion,
+                    open_deletion, extend_deletion,
+                    miscall_cost,
+                    do_local, do_affine, do_codon, globalStartingPoint, 
+                    <dtype_t *> codon3x5.data,
+                    <dtype_t *> codon3x4.data,
+                    <dtype_t *> codon3x2.data,
+                    <dtype_t *> codon3x1.data,
+                    <void *> score_matrix.data,
+                    <void *> deletion_matrix.data,
+                    <void *> insertion_matrix.data,
+                    band_width, band_offset, &band_touched,
+                    block_rows, codes,
+                    cigar_res, &cigar_len, &position, &edit_distance,
+                    x_drop, counters)
+
+            # if the best path ran along the edge of the band, or scores below
+            # an alignment known to exist, a better one lies outside of it:
+            # widen the band and retry, until it holds every cell
+            if band_width <= 0 or not (band_touched or score < min_score):
+                break
+            if band_width > len(b_ref) + len(b_query) + abs(band_offset):
+                break
 
-        if ref_aligned == NULL or query_aligned == NULL:
             free(ref_aligned)
             free(query_aligned)
+            free(cigar)
+            ref_aligned = NULL
+            query_aligned = NULL
+            cigar = NULL
+            band_width *= 2
+
+        if do_cigar:
+            if cigar == NULL:
+                raise MemoryError('memory allocation error in AlignStrings(...)')
+            return (
+                score,
+                [(cigar[2 * i], cigar[2 * i + 1]) for i in range(cigar_len)],
+                position,
+                edit_distance
+                )
+
+        if ref_aligned == NULL or query_aligned == NULL:
             raise MemoryError('memory allocation error in AlignStrings(...)')
 
         # cast char * back to unicode
@@ -193,5 +317,78 @@ def _align(
     finally:
         free(ref_aligned)
         free(query_aligned)
+        free(cigar)
 
     return score, b_ref_aligned, b_query_aligned
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _align_score(
+        bytes b_ref,
+        bytes b_query,
+        itype_t char_count,
+        np.ndarray[itype_t] char_map,
+        np.ndarray[dtype_t, ndim=2, mode='c'] cost_matrix,
+        itype_t cost_stride,
+        dtype_t open_insertion,
+        dtype_t extend_insertion,
+        dtype_t open_deletion,
+        dtype_t extend_deletion,
+        dtype_t miscall_cost,
+        itype_t do_local,
+        itype_t do_affine,
+        itype_t globalStartingPoint,
+        itype_t do_codon,
+        np.ndarray[dtype_t, ndim=2, mode='c'] codon3x5,
+        np.ndarray[dtype_t, ndim=2, mode='c'] codon3x4,
+        np.ndarray[dtype_t, ndim=2, mode='c'] codon3x2,
+        np.ndarray[dtype_t, ndim=2, mode='c'] codon3x1,
+        np.ndarray score_matrix not None,
+        np.ndarray deletion_matrix not None,
+        np.ndarray insertion_matrix not None,
+        np.ndarray[itype_t, ndim=1, mode='c'] ref_codes=None,
+        dtype_t x_drop=0,
+        np.ndarray[itype_t, ndim=1, mode='c'] stats=None):
+
+    # the score of the alignment _align would find, without the alignment:
+    # the matrices need only hold two rows of len(b_query) + 1 cells
+
+    cdef char * ref = b_ref
+    cdef char * query = b_query
+    cdef itype_t * codes = _ref_codes(b_ref, do_codon, ref_codes)
+    cdef align_strings_t align_strings = _align_strings(score_matrix, deletion_matrix, insertion_matrix)
+    cdef itype_t * counters = _stats(stats)
+    cdef dtype_t score
+
+    if do_codon and len(b_ref) % 3 != 0:
+        raise ValueError('when do_codon = True, len(ref) must be a multiple of 3')
+
+    if score_matrix.shape[0] < 2 * (len(b_query) + 1):
+        raise ValueError('score_matrix must hold two rows')
+
+    with nogil:
+        score = align_strings(
+            ref, query,
+            NULL, NULL,
+            char_count,
+            <itype_t *> char_map.data,
+            <dtype_t *> cost_matrix.data,
+            cost_stride,
+            GAP,
+            open_insertion, extend_insertion,
+            open_deletion, extend_deletion,
+            miscall_cost,
+            do_local, do_affine, do_codon, globalStartingPoint,
+            <dtype_t *> codon3x5.data,
+            <dtype_t *> codon3x4.data,
+            <dtype_t *> codon3x2.data,
+            <dtype_t *> codon3x1.data,
+            <void *> score_matrix.data,
+            <void *> deletion_matrix.data,
+            <void *> insertion_matrix.data,
+            0, 0, NULL, 0, codes,
+            NULL, NULL, NULL, NULL,
+            x_drop, counters)
+
+    return score
@@ -0,0 +1,311 @@
+
+from __future__ import division, print_function
+
+import os
+import sqlite3
+import sys
+
+from hashlib import sha1
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+
+import numpy as np
+
+
+__all__ = ['AlignCache']
+
+
+# bump this whenever the arrays, or the alignments, computed for the same inputs change
+_CACHE_VERSION = 2
+
+# the alignments an AlignCache keeps by default,
+# beyond which the least recently used are evicted
+_ALIGN_CACHE_SIZE = 2 ** 20
+# eviction goes down to this fraction of the size,
+# so that it isn't needed again on the very next alignment
+_ALIGN_CACHE_SLACK = 0.9
+# each process counts the alignments in the cache again
+# after this many of its own, as the other processes add theirs
+_ALIGN_CACHE_RECOUNT = 1024
+
+
+def _cache_dir():
+    # BIOEXT_CACHE overrides the location of the cache,
+    # and setting it to the empty string disables it
+    path = os.environ.get('BIOEXT_CACHE')
+    if path is None:
+        path = os.path.join(
+            os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+            'BioExt'
+            )
+    return path
+
+
+def _digest(parts):
+    h = sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(repr((part.dtype.str, part.shape)).encode('utf-8'))
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(repr(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _encode_shapes(shapes):
+    # a flat array of ints: the number of arrays, then the rank and dimensions of each
+    encoded = [len(shapes)]
+    for shape in shapes:
+        encoded.append(len(shape))
+        encoded.extend(shape)
+    return np.array(encoded, dtype=int)
+
+
+def _decode_shapes(encoded):
+    encoded = [int(v) for v in encoded]
+    shapes = []
+    i = 1
+    for _ in range(encoded[0]):
+        shapes.append(tuple(encoded[i + 1:i + 1 + encoded[i]]))
+        i += 1 + encoded[i]
+    return shapes
+
+
+class SharedArrays(object):
+    # a list of arrays of doubles, which are views into a single file when path is set:
+    # pickling them then sends only the path, so that every process that unpickles them
+    # maps the same pages of the file (copy-on-write, so never written back),
+    # rather than each process holding its own copy
+    __slots__ = (
+        '__path',
+        '__shapes',
+        '__arrays',
+        )
+
+    def __init__(self, arrays, path=None):
+        self.__path = path
+        self.__shapes = [np.shape(array) for array in arrays]
+        self.__arrays = list(arrays)
+
+    @staticmethod
+    def map(path, shapes):
+        segment = np.load(path, mmap_mode='c')
+        if segment.ndim != 1 or segment.shape[0] != sum(int(np.prod(shape)) for shape in shapes):
+            raise ValueError('{0} does not hold arrays of these shapes'.format(path))
+        arrays = []
+        offset = 0
+        for shape in shapes:
+            size = int(np.prod(shape))
+            arrays.append(segment[offset:offset + size].reshape(shape))
+            offset += size
+        return SharedArrays(arrays, path)
+
+    def __reduce__(self):
+        if self.__path is None:
+            return (SharedArrays, (self.__arrays,))
+        return (SharedArrays.map, (self.__path, self.__shapes))
+
+    def __len__(self):
+        return len(self.__arrays)
+
+    def __getitem__(self, key):
+        return self.__arrays[key]
+
+    def __iter__(self):
+        return iter(self.__arrays)
+
+
+def _save(path, array):
+    # write to a temporary file and move it in place,
+    # so that readers never see a partial file
+    fd, tmp = mkstemp(suffix='.npy', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            np.save(handle, array)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+def cached_arrays(name, parts, compute):
+    # the arrays of doubles compute() returns, as SharedArrays
+    # memory-mapped from the cache if they were already computed
+    # for the same name and parts (the inputs they are derived from),
+    # otherwise computed and saved to it first
+    path = _cache_dir()
+    if not path:
+        return SharedArrays([np.asarray(array, dtype=float) for array in compute()])
+
+    prefix = os.path.join(path, '{0}-{1}'.format(name, _digest((_CACHE_VERSION,) + tuple(parts))))
+    segment = prefix + '.npy'
+    index = prefix + '-shapes.npy'
+
+    try:
+        # the index is written last
+        return SharedArrays.map(segment, _decode_shapes(np.load(index)))
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    arrays = [np.asarray(array, dtype=float) for array in compute()]
+    shapes = [array.shape for array in arrays]
+
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        _save(segment, np.concatenate([array.ravel() for array in arrays]))
+        _save(index, _encode_shapes(shapes))
+        return SharedArrays.map(segment, shapes)
+    except (IOError, OSError, ValueError):
+        # the cache is only an optimization
+        return SharedArrays(arrays)
+
+
+def _encode_cigar(cigar):
+    # as BAM does, each operation and its length in a single int
+    return np.array([(num << 4) | op for op, num in cigar], dtype='<u4').tobytes()
+
+
+def _decode_cigar(encoded):
+    return [(int(v & 0xf), int(v >> 4)) for v in np.frombuffer(encoded, dtype='<u4')]
+
+
+class AlignCache(object):
+    # the results of alignments, as (score, cigar, position, edit distance),
+    # by the digest of everything they depend on, kept in an sqlite database at path
+    # (alignments.sqlite in the cache directory by default) to be reused across runs:
+    # beyond size alignments, the least recently used are evicted.
+    # the database is opened in each process on first use, so that
+    # the cache may be sent to the workers, which then share it
+    __slots__ = (
+        'path',
+        'size',
+        'hits',
+        'misses',
+        '__db',
+        '__pid',
+        '__lock',
+        '__count',
+        '__added',
+        '__clock',
+        )
+
+    def __init__(self, path=None, size=None):
+        if size is None:
+            size = _ALIGN_CACHE_SIZE
+        if path is None:
+            path = _cache_dir()
+            if not path:
+                raise ValueError('the cache is disabled, as BIOEXT_CACHE is empty')
+            path = os.path.join(path, 'alignments.sqlite')
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.path = path
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.__db = None
+        self.__pid = None
+        self.__lock = Lock()
+        self.__count = 0
+        self.__added = 0
+        self.__clock = 0.0
+
+    def __reduce__(self):
+        # the connection stays behind, each process opens its own
+        return (AlignCache, (self.path, self.size))
+
+    def __connect(self):
+        # the connection of this process, or None if the database can't be opened:
+        # the cache is only an optimization
+        pid = os.getpid()
+        if self.__pid == pid:
+            return self.__db
+        self.__pid = pid
+        self.__db = None
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS alignments ('
+                'key TEXT PRIMARY KEY, score REAL, cigar BLOB, position INTEGER, edit_distance INTEGER, used REAL'
+                ')'
+                )
+            db.execute('CREATE INDEX IF NOT EXISTS alignments_used ON alignments (used)')
+            self.__count, = db.execute('SELECT COUNT(*) FROM alignments').fetchone()
+            self.__added = 0
+            self.__db = db
+        except (IOError, OSError, sqlite3.Error) as e:
+            print("the alignment cache at '{0}' is unavailable: {1}".format(self.path, e), file=sys.stderr)
+        return self.__db
+
+    def __used(self):
+        # when an alignment was last used, never the same time twice in a process
+        self.__clock = max(time(), self.__clock + 1e-6)
+        return self.__clock
+
+    def __len__(self):
+        with self.__lock:
+            db = self.__connect()
+            if db is None:
+                return 0
+            count, = db.execute('SELECT COUNT(*) FROM alignments').fetchone()
+            return count
+
+    def get(self, key):
+        # the result of the alignment with digest key, or None if it isn't cached
+        with self.__lock:
+            db = self.__connect()
+            row = None
+            if db is not None:
+                try:
+                    row = db.execute(
+                        'SELECT score, cigar, position, edit_distance FROM alignments WHERE key = ?',
+                        (key,)
+                        ).fetchone()
+                    if row is not None:
+                        db.execute('UPDATE alignments SET used = ? WHERE key = ?', (self.__used(), key))
+                except sqlite3.Error:
+                    row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        score, cigar, position, edit_distance = row
+        return score, _decode_cigar(cigar), position, edit_distance
+
+    def put(self, key, result):
+        # keep result, the (score, cigar, position, edit distance) of the alignment with digest key
+        score, cigar, position, edit_distance = result
+        with self.__lock:
+            db = self.__connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    'INSERT OR REPLACE INTO alignments VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, float(score), _encode_cigar(cigar), int(position), int(edit_distance), self.__used())
+                    )
+                self.__count += 1
+                self.__added += 1
+                if self.__count > self.size or self.__added >= _ALIGN_CACHE_RECOUNT:
+                    self.__evict(db)
+            except sqlite3.Error:
+                pass
+
+    def __evict(self, db):
+        self.__count, = db.execute('SELECT COUNT(*) FROM alignments').fetchone()
+        self.__added = 0
+        if self.__count > self.size:
+            excess = self.__count - int(self.size * _ALIGN_CACHE_SLACK)
+            db.execute(
+                'DELETE FROM alignments WHERE key IN (SELECT key FROM alignments ORDER BY used LIMIT ?)',
+                (excess,)
+                )
+            self.__count -= excess
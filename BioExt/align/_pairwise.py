@@ -0,0 +1,194 @@
+
+from __future__ import division, print_function
+
+import os
+
+from itertools import islice
+
+import numpy as np
+
+from Bio.SeqRecord import SeqRecord
+
+from BioExt.align._cache import _digest
+from BioExt.misc import gapless
+
+
+__all__ = ['PackedTriangle', 'pairwise']
+
+
+# pairwise aligns _PAIRWISE_CHUNK pairs at a time,
+# and saves its progress after each chunk
+_PAIRWISE_CHUNK = 256
+
+# the version of the results pairwise keeps on disk,
+# a part of their digest so that those of another are not resumed
+_PAIRWISE_VERSION = 2
+
+# each entry of a pairwise result on disk: the score and identity
+# of the better alignment of the pair, and whether it was computed yet
+_PAIRWISE_DTYPE = np.dtype([
+    ('score', np.float64),
+    ('identity', np.float64),
+    ('done', np.bool_),
+    ])
+
+
+def _packed_size(n):
+    return n * (n + 1) // 2
+
+
+def _packed_index(n, i, j):
+    # the index of (i, j), i <= j, in the rows of the upper triangle packed one after the other
+    return i * (2 * n - i + 1) // 2 + (j - i)
+
+
+class PackedTriangle(object):
+    # a symmetric n x n matrix, of which only the upper triangle
+    # (the diagonal included) is kept, packed row by row into a flat array
+    __slots__ = (
+        'n',
+        'data',
+        )
+
+    def __init__(self, n, data=None, dtype=float):
+        if data is None:
+            data = np.zeros((_packed_size(n),), dtype=dtype)
+        elif data.shape != (_packed_size(n),):
+            raise ValueError('data must hold {0:d} values'.format(_packed_size(n)))
+        self.n = n
+        self.data = data
+
+    def __len__(self):
+        return self.n
+
+    def __index(self, key):
+        i, j = key
+        if i > j:
+            i, j = j, i
+        if i < 0 or j >= self.n:
+            raise IndexError('index out of range')
+        return _packed_index(self.n, i, j)
+
+    def __getitem__(self, key):
+        return self.data[self.__index(key)]
+
+    def __setitem__(self, key, value):
+        self.data[self.__index(key)] = value
+
+    def row(self, i):
+        # the ith row (and column) of the matrix
+        return np.array([self[i, j] for j in range(self.n)], dtype=self.data.dtype)
+
+    def tondarray(self):
+        # the full matrix
+        matrix = np.zeros((self.n, self.n), dtype=self.data.dtype)
+        rows, cols = np.triu_indices(self.n)
+        matrix[rows, cols] = self.data
+        matrix[cols, rows] = self.data
+        return matrix
+
+
+def _open(path, n, digest):
+    # the entries of the result kept at path, those of a partial result
+    # for the same sequences if one is there, or new ones otherwise
+    check = path + '.sha1'
+    size = _packed_size(n)
+    if os.path.exists(path) and os.path.exists(check):
+        with open(check) as handle:
+            digest_ = handle.read().strip()
+        if digest_ != digest:
+            raise ValueError("'{0}' holds the distances of other sequences, or of another version".format(path))
+        entries = np.load(path, mmap_mode='r+')
+        if entries.dtype != _PAIRWISE_DTYPE or entries.shape != (size,):
+            raise ValueError("'{0}' is not a pairwise result for {1:d} sequences".format(path, n))
+        return entries
+    entries = np.lib.format.open_memmap(path, mode='w+', dtype=_PAIRWISE_DTYPE, shape=(size,))
+    entries.flush()
+    with open(check, 'w') as handle:
+        handle.write(digest + '\n')
+    return entries
+
+
+def _pending(n, done):
+    # the index and (i, j) of each pair not yet done, row by row
+    for i in range(n):
+        start = _packed_index(n, i, i)
+        end = start + n - i
+        if done[start:end].all():
+            continue
+        for j in range(i, n):
+            if not done[start + j - i]:
+                yield start + j - i, i, j
+
+
+def _identity(cigar, edit_distance):
+    # the fraction of the columns of the alignment which match
+    columns = sum(num for _, num in cigar)
+    return (columns - edit_distance) / columns if columns else 0.0
+
+
+def pairwise(aligner, seqs, path=None, n_threads=None, chunk_size=_PAIRWISE_CHUNK):
+    # the scores and identities of the alignments of every pair of seqs
+    # by aligner, on n_threads threads, as PackedTriangles. scores are not symmetric,
+    # seqs[j] aligned to seqs[i] scoring per position of seqs[j], so both are aligned,
+    # and entry (i, j), as (j, i), is the one of the two which scores higher
+    # (seqs[j] to seqs[i] on a tie): its score, and its identity,
+    # the fraction of its columns which match (1 - NM / columns).
+    # if path is given, the entries are kept in the .npy there as they are computed,
+    # chunk_size pairs at a time, and those of a partial result left there
+    # by an earlier call (for the same seqs) are not computed again.
+    # every sequence is a reference, so with a codon aligner the length of each,
+    # gapless, must be a multiple of 3, or nothing is aligned (nor kept at path)
+    seqs = [gapless(seq) for seq in seqs]
+    names = [
+        '{0:d} ({1})'.format(i, seq.id) if isinstance(seq, SeqRecord) else '{0:d}'.format(i)
+        for i, seq in enumerate(seqs)
+        ]
+    seqs = [str(seq.seq) if isinstance(seq, SeqRecord) else str(seq) for seq in seqs]
+    n = len(seqs)
+
+    if aligner.do_codon:
+        bad = [name for name, seq in zip(names, seqs) if len(seq) % 3]
+        if bad:
+            raise ValueError(
+                'when do_codon = True, the length of every sequence must be a multiple of 3, '
+                'but not that of sequences ' + ', '.join(bad)
+                )
+
+    if path is None:
+        entries = np.zeros((_packed_size(n),), dtype=_PAIRWISE_DTYPE)
+    else:
+        entries = _open(path, n, _digest([_PAIRWISE_VERSION] + [seq.upper() for seq in seqs]))
+
+    # each sequence is the reference of its row, prepared once
+    refs = {}
+    pending = _pending(n, entries['done'])
+    while True:
+        chunk = list(islice(pending, chunk_size))
+        if not chunk:
+            break
+        # seqs[j] to seqs[i], and seqs[i] to seqs[j] unless they are the same
+        pairs = [(k, i, j) for k, i, j in chunk]
+        pairs.extend((k, j, i) for k, i, j in chunk if i != j)
+        refs = dict(
+            (i, refs[i] if i in refs else aligner.prepare_reference(seqs[i]))
+            for i in set(i for _, i, _ in pairs)
+            )
+        results = aligner.align_pairs(
+            ((refs[i], seqs[j]) for _, i, j in pairs),
+            n_threads,
+            do_cigar=True
+            )
+        best = {}
+        for (k, _, _), (score, cigar, _, edit_distance) in zip(pairs, results):
+            if k not in best or score > best[k][0]:
+                best[k] = score, _identity(cigar, edit_distance)
+        for k, (score, identity) in best.items():
+            entries[k] = (score, identity, True)
+        if path is not None:
+            entries.flush()
+
+    return (
+        PackedTriangle(n, np.array(entries['score'])),
+        PackedTriangle(n, np.array(entries['identity']))
+        )
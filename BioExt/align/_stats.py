@@ -0,0 +1,122 @@
+
+from __future__ import division, print_function
+
+import json
+
+from threading import Lock
+
+
+__all__ = ['AlignStats']
+
+
+# the counters of the alignments: those computed (scores included),
+# the cells computed in them, the times the matrices were reallocated,
+# the length of their tracebacks and the frameshifts taken in them,
+# and the seconds spent computing them
+_COUNTERS = (
+    'alignments',
+    'cells',
+    'resizes',
+    'traceback',
+    'frameshifts',
+    'seconds',
+    )
+
+
+class AlignStats(object):
+    # the counters Aligner collects when created with stats=True,
+    # which _align_par merges from each worker, adding the reads of the run
+    # and the seconds it took, and the counters of each worker by its pid
+    __slots__ = _COUNTERS + (
+        'reads',
+        'elapsed',
+        'workers',
+        '__lock',
+        )
+
+    def __init__(self, counters=None):
+        for name in _COUNTERS:
+            setattr(self, name, 0)
+        self.reads = 0
+        self.elapsed = 0.0
+        self.workers = {}
+        self.__lock = Lock()
+        if counters:
+            for name in _COUNTERS:
+                setattr(self, name, counters.get(name, 0))
+
+    def __reduce__(self):
+        # the lock stays behind, and so do the workers
+        return (AlignStats, (self.counters(),))
+
+    def counters(self):
+        return dict((name, getattr(self, name)) for name in _COUNTERS)
+
+    def add(self, seconds, counters, resizes=0):
+        # an alignment which took seconds, with the counters from _align,
+        # after resizes reallocations of the matrices
+        cells, traceback, frameshifts = (int(v) for v in counters[:3])
+        with self.__lock:
+            self.alignments += 1
+            self.cells += cells
+            self.resizes += resizes
+            self.traceback += traceback
+            self.frameshifts += frameshifts
+            self.seconds += seconds
+
+    def merge(self, other, worker=None):
+        # add the counters of other, also to those of worker if given
+        counters = other.counters()
+        with self.__lock:
+            for name in _COUNTERS:
+                setattr(self, name, getattr(self, name) + counters[name])
+            if worker is not None:
+                if worker not in self.workers:
+                    self.workers[worker] = AlignStats()
+                self.workers[worker].merge(other)
+
+    def pop(self):
+        # the counters so far, which are then reset,
+        # so that a worker may send those of each chunk in turn
+        with self.__lock:
+            stats = AlignStats(self.counters())
+            for name in _COUNTERS:
+                setattr(self, name, 0)
+        return stats
+
+    def todict(self):
+        stats = self.counters()
+        stats['cells_per_second'] = self.cells / self.seconds if self.seconds > 0 else 0.0
+        if self.elapsed > 0:
+            stats['reads'] = self.reads
+            stats['elapsed'] = self.elapsed
+            stats['reads_per_second'] = self.reads / self.elapsed
+        if self.workers:
+            stats['workers'] = dict(
+                (str(worker), stats_.todict())
+                for worker, stats_ in sorted(self.workers.items())
+                )
+        return stats
+
+    def dump(self, handle):
+        json.dump(self.todict(), handle, indent=2, sort_keys=True)
+        handle.write('\n')
+
+    def __str__(self):
+        stats = self.todict()
+        lines = []
+        if self.elapsed > 0:
+            lines.append('{reads:d} reads in {elapsed:.2f}s ({reads_per_second:.1f} reads/s)'.format(**stats))
+        lines.extend([
+            '{alignments:d} alignments of {cells:d} cells in {seconds:.2f}s ({cells_per_second:.3g} cells/s)'.format(**stats),
+            '{resizes:d} resizes, {traceback:d} traceback steps, {frameshifts:d} frameshifts'.format(**stats),
+            ])
+        if self.workers:
+            lines.append('{0:d} workers: {1}'.format(
+                len(self.workers),
+                ', '.join(
+                    '{0:d} alignments ({1:.3g} cells/s)'.format(stats_.alignments, stats_.todict()['cells_per_second'])
+                    for _, stats_ in sorted(self.workers.items())
+                    )
+                ))
+        return '\n'.join(lines)
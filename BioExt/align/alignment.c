@@ -6,6 +6,7 @@
 #include <string.h>
 
 #include "alignment.h"
+#include "simd.h"
 
 //____________________________________________________________________________________
 
@@ -62,16 +63,47 @@
 #define ISNULL( var ) ( ( var ) == NULL )
 
 #define MAX(a, b) ( (( a ) > ( b )) ? ( a ) : ( b ) )
+#define MIN(a, b) ( (( a ) < ( b )) ? ( a ) : ( b ) )
 
 #define FALSE 0
 #define TRUE  1
 
 #define A_LARGE_NUMBER 1.e100
 
+// this file is also compiled with float and int32_t matrices
+// (see alignment_f32.c and alignment_i32.c), which define SCORE_T,
+// the type of the matrices, SCORE_MIN, the score of a cell no path may
+// pass through, and ALIGN_STRINGS and PRINT_SCORE_MATRIX, the names
+// of the functions they export, before they include it
+#ifndef SCORE_T
+#define SCORE_T double
+#define SCORE_MIN ( -A_LARGE_NUMBER )
+#define ALIGN_STRINGS AlignStrings
+#define PRINT_SCORE_MATRIX print_score_matrix
+#endif
+
+// X-drop stops extending the alignment in the cells whose scores fall more than
+// x_drop below the best score in their column (the best alignment of the same
+// prefix of the query) in the rows above: each row is only computed in the columns
+// the cells of the row above within x_drop reach, and lo and hi keep them,
+// so that rows recomputed from a checkpoint are computed exactly as before.
+// the best score of all the alignment is compared to, as the ends of the reference
+// are free, would drop the alignments starting further along it
+typedef struct {
+    double x_drop;
+    double best;        // the best score yet, at best_row and best_col
+    long best_row;
+    long best_col;
+    long rows;          // the rows computed so far, the next row's columns are proposed in lo and hi
+    long * lo;
+    long * hi;
+    double * column;    // the best score in each column, in the rows above
+} XDrop;
+
 //____________________________________________________________________________________
 
-void print_score_matrix( FILE * const file
-                       , const double * const score_matrix
+void PRINT_SCORE_MATRIX( FILE * const file
+                       , const SCORE_T * const score_matrix
                        , const long score_rows
                        , const long score_cols
                        )
@@ -101,12 +133,102 @@ void print_score_matrix( FILE * const file
 
 //____________________________________________________________________________________
 
-static long CodonAlignStringsStep( double * const score_matrix
-                                 , double * const insertion_matrix
-                                 , double * const deletion_matrix
-                                 , long * const reference
+static inline void BandBounds( const long row
+                             , const long ref_stride
+                             , const long diag_lo
+                             , const long diag_hi
+                             , const long score_cols
+                             , long * const lo
+                             , long * const hi
+                             )
+{
+    /**
+     * a band is the set of diagonals diag_lo <= q - ref_stride * r <= diag_hi,
+     * where r is the row (CODON position when doing codon alignment)
+     * and q the column (NUC position in the query),
+     * so that a gapless (or frameshift-free) alignment stays on one diagonal.
+     * the first column is the boundary and is never part of the band.
+     * if *lo > *hi, the band does not intersect this row
+     */
+    *lo = MAX( 1, ref_stride * row + diag_lo );
+    *hi = MIN( score_cols - 1, ref_stride * row + diag_hi );
+}
+
+//____________________________________________________________________________________
+
+static inline long OnBandEdge( const long row
+                             , const long col
+                             , const long ref_stride
+                             , const long diag_lo
+                             , const long diag_hi
+                             , const long score_cols
+                             )
+{
+    long lo, hi;
+
+    // the first row is the boundary, always computed in full
+    if ( row < 1 )
+        return FALSE;
+
+    BandBounds( row, ref_stride, diag_lo, diag_hi, score_cols, &lo, &hi );
+
+    // touching the edge of the matrix is fine,
+    // touching the edge of the band means the band may have cut off a better path
+    return ( col == lo && lo > 1 ) || ( col == hi && hi < score_cols - 1 );
+}
+
+//____________________________________________________________________________________
+
+static inline void BandGuard( SCORE_T * const score_matrix
+                            , SCORE_T * const insertion_matrix
+                            , SCORE_T * const deletion_matrix
+                            , const long row
+                            , const long base
+                            , const long ref_stride
+                            , const long diag_lo
+                            , const long diag_hi
+                            , const long score_cols
+                            )
+{
+    /**
+     * cells outside the band are never computed, but the cells just
+     * to the left of the band (a codon step reaches back 5 columns)
+     * and to the right of it (which the next row reads as its previous row)
+     * must hold -infinity so that no path passes through them,
+     * row is stored at row - base in the matrices
+     */
+    long lo, hi, k;
+    const long hi_next = ref_stride * ( row + 1 ) + diag_hi,
+               offset = ( row - base ) * score_cols;
+
+    BandBounds( row, ref_stride, diag_lo, diag_hi, score_cols, &lo, &hi );
+
+    for ( k = MAX( 1, lo - 5 ); k < MIN( lo, score_cols ); ++k ) {
+        score_matrix[ offset + k ] = SCORE_MIN;
+        if ( deletion_matrix ) {
+            deletion_matrix[ offset + k ] = SCORE_MIN;
+            insertion_matrix[ offset + k ] = SCORE_MIN;
+        }
+    }
+
+    for ( k = MAX( 1, hi + 1 ); k <= MIN( score_cols - 1, hi_next ); ++k ) {
+        score_matrix[ offset + k ] = SCORE_MIN;
+        if ( deletion_matrix ) {
+            deletion_matrix[ offset + k ] = SCORE_MIN;
+            insertion_matrix[ offset + k ] = SCORE_MIN;
+        }
+    }
+}
+
+//____________________________________________________________________________________
+
+static long CodonAlignStringsStep( SCORE_T * const score_matrix
+                                 , SCORE_T * const insertion_matrix
+                                 , SCORE_T * const deletion_matrix
+                                 , const long * const r_codons
                                  , long * const query
                                  , const long r
+                                 , const long row
                                  , const long q
                                  , const long score_cols
                                  , const long char_count
@@ -126,22 +248,23 @@ static long CodonAlignStringsStep( double * const score_matrix
 	
     /**
      * r is CODON position in the reference,
+     * r_codons holds the index of each codon in the reference,
      * q is NUC position in the query,
      * curr is a pointer to the current position in the scoring matrix,
      * prev is a pointer to the previous CODON in the scoring matrix
      * NOTE: moving by score_cols in the scoring matrix changes the CODON
      *       position in the scoring matrix, as we're only interested in CODON
      *       alignments to the reference
-     * rpos is the position of r in the reference
+     * row is the row of the scoring matrix that holds r, which differs from r
+     *     when the scoring matrix holds only a block of its rows
      */
 
-    const long curr = ( r - 0 ) * score_cols + q, // where we currently are
-               prev = ( r - 1 ) * score_cols + q, // up a codon in the reference
+    const long curr = ( row - 0 ) * score_cols + q, // where we currently are
+               prev = ( row - 1 ) * score_cols + q, // up a codon in the reference
                offset3x5 = HY_3X5_COUNT * char_count * char_count * char_count, // both 3x5 and 3x4 are
                offset3x4 = HY_3X4_COUNT * char_count * char_count * char_count, // full codons
                offset3x2 = HY_3X2_COUNT * char_count * char_count,
-               offset3x1 = HY_3X1_COUNT * char_count,
-               rpos = r * 3; // the real position in R
+               offset3x1 = HY_3X1_COUNT * char_count;
     // mutable vars
     long r_codon = -1,
          q_codon = -1,
@@ -191,13 +314,7 @@ static long CodonAlignStringsStep( double * const score_matrix
             choices[ HY_111_000 ] = score_matrix[ prev ] - open_deletion;
         }
 
-        r_codon = ( reference[ rpos - 3 ]   * char_count
-                  + reference[ rpos - 2 ] ) * char_count
-                  + reference[ rpos - 1 ] ;
-
-        if ( r_codon < 0 ) {
-            r_codon = cost_stride - 1;
-        }
+        r_codon = r_codons[ r - 1 ];
     }
 
     // if we're at least 1 codon away from the edge
@@ -628,7 +745,508 @@ static inline void MatchScore( char * r_str
 
 //____________________________________________________________________________________
 
-double AlignStrings( char * const r_str
+static inline void CopyRow( SCORE_T * const score_matrix
+                          , SCORE_T * const insertion_matrix
+                          , SCORE_T * const deletion_matrix
+                          , const long dst
+                          , const long src
+                          , const long score_cols
+                          )
+{
+    memcpy( score_matrix + dst * score_cols, score_matrix + src * score_cols, sizeof( SCORE_T ) * score_cols );
+    if ( deletion_matrix ) {
+        memcpy( deletion_matrix + dst * score_cols, deletion_matrix + src * score_cols, sizeof( SCORE_T ) * score_cols );
+        memcpy( insertion_matrix + dst * score_cols, insertion_matrix + src * score_cols, sizeof( SCORE_T ) * score_cols );
+    }
+}
+
+//____________________________________________________________________________________
+
+static inline void SimdLoadRow( SimdProfile * const p
+                              , const SCORE_T * const score_row
+                              , const SCORE_T * const deletion_row
+                              )
+{
+    // start the vector kernel from a row of the matrices
+    int32_t * const s = p->score[ p->curr ],
+            * const d = p->deletion[ p->curr ];
+    long j;
+
+    for ( j = 0; j < p->cols; ++j ) {
+        s[ j ] = (int32_t) ( score_row[ j ] * p->scale );
+        d[ j ] = (int32_t) ( deletion_row[ j ] * p->scale );
+    }
+}
+
+//____________________________________________________________________________________
+
+static inline void SimdStoreRow( const SimdProfile * const p
+                               , SCORE_T * const score_row
+                               , SCORE_T * const deletion_row
+                               , SCORE_T * const insertion_row
+                               )
+{
+    // the row the vector kernel just computed, back in the matrices
+    const double inv_scale = 1. / p->scale;
+    const int32_t * const s = p->score[ p->curr ],
+                  * const d = p->deletion[ p->curr ];
+    long j;
+
+    for ( j = 1; j < p->cols; ++j ) {
+        score_row[ j ] = s[ j ] * inv_scale;
+        deletion_row[ j ] = d[ j ] * inv_scale;
+        insertion_row[ j ] = p->insertion[ j ] * inv_scale;
+    }
+}
+
+//____________________________________________________________________________________
+
+static inline void XDropGuard( SCORE_T * const score_matrix
+                             , SCORE_T * const insertion_matrix
+                             , SCORE_T * const deletion_matrix
+                             , const long offset
+                             , const long from
+                             , const long to
+                             )
+{
+    // no path may pass through columns from through to of the row at offset
+    long k;
+
+    for ( k = from; k <= to; ++k ) {
+        score_matrix[ offset + k ] = SCORE_MIN;
+        if ( deletion_matrix ) {
+            deletion_matrix[ offset + k ] = SCORE_MIN;
+            insertion_matrix[ offset + k ] = SCORE_MIN;
+        }
+    }
+}
+
+//____________________________________________________________________________________
+
+static inline long XDropBounds( XDrop * const x
+                              , SCORE_T * const score_matrix
+                              , SCORE_T * const insertion_matrix
+                              , SCORE_T * const deletion_matrix
+                              , const long row
+                              , const long base
+                              , const long score_cols
+                              , long * const lo
+                              , long * const hi
+                              )
+{
+    /**
+     * narrow the columns lo through hi of row to those within reach of the cells
+     * of the row above X-drop kept, and guard the cells either side of them.
+     * rows computed once already are computed again in the same columns.
+     * return FALSE if X-drop kept none of the row above
+     */
+    const long offset = ( row - base ) * score_cols;
+
+    if ( row < x->rows ) {
+        *lo = x->lo[ row ];
+        *hi = x->hi[ row ];
+    }
+    else {
+        *lo = MAX( *lo, x->lo[ row ] );
+        *hi = MIN( *hi, x->hi[ row ] );
+    }
+
+    if ( *lo > *hi )
+        return FALSE;
+
+    XDropGuard( score_matrix, insertion_matrix, deletion_matrix, offset, MAX( 1, *lo - 5 ), *lo - 1 );
+    // the cells of the row above beyond those guarded when it was computed,
+    // which the row only reaches if XDropExtend extended it
+    XDropGuard( score_matrix, insertion_matrix, deletion_matrix, offset - score_cols, x->hi[ row - 1 ] + 6, *hi );
+
+    return TRUE;
+}
+
+//____________________________________________________________________________________
+
+static inline long XDropLive( const XDrop * const x
+                            , const SCORE_T * const score_row
+                            , const long col
+                            )
+{
+    // whether the cell in col is within x_drop of the best in its column
+    return score_row[ col ] >= x->column[ col ] - x->x_drop;
+}
+
+//____________________________________________________________________________________
+
+static inline long XDropExtend( XDrop * const x
+                              , SCORE_T * const score_matrix
+                              , SCORE_T * const insertion_matrix
+                              , SCORE_T * const deletion_matrix
+                              , const long row
+                              , const long base
+                              , const long score_cols
+                              , const long col
+                              , const long cap
+                              , const long span
+                              )
+{
+    /**
+     * in the first pass over row, return TRUE if it must be computed
+     * beyond col (but not beyond cap), because one of the last span cells
+     * of the row is still live, and insertions may carry it further
+     */
+    const long offset = ( row - base ) * score_cols;
+    long k;
+
+    if ( row < x->rows || col >= cap )
+        return FALSE;
+
+    for ( k = MAX( 1, col - span + 1 ); k <= col; ++k ) {
+        if ( XDropLive( x, score_matrix + offset, k ) ) {
+            if ( col + 1 > x->hi[ row - 1 ] + 5 )
+                XDropGuard( score_matrix, insertion_matrix, deletion_matrix, offset - score_cols, col + 1, col + 1 );
+            return TRUE;
+        }
+    }
+
+    return FALSE;
+}
+
+//____________________________________________________________________________________
+
+static inline void XDropUpdate( XDrop * const x
+                              , const SCORE_T * const score_row
+                              , const long row
+                              , const long lo
+                              , const long hi
+                              , const long score_cols
+                              , const long span
+                              )
+{
+    /**
+     * in the first pass over row, record the columns lo through hi computed in it,
+     * the best scores yet, and the columns of the next row within span
+     * of the live cells of this one
+     */
+    long first = -1, last = -1, j;
+
+    if ( row < x->rows )
+        return;
+
+    x->lo[ row ] = lo;
+    x->hi[ row ] = hi;
+    x->rows = row + 1;
+
+    // the first column is the boundary
+    if ( XDropLive( x, score_row, 0 ) )
+        first = last = 0;
+    x->column[ 0 ] = MAX( x->column[ 0 ], score_row[ 0 ] );
+
+    for ( j = lo; j <= hi; ++j ) {
+        if ( score_row[ j ] > x->best ) {
+            x->best = score_row[ j ];
+            x->best_row = row;
+            x->best_col = j;
+        }
+        if ( XDropLive( x, score_row, j ) ) {
+            if ( first < 0 )
+                first = j;
+            last = j;
+        }
+    }
+
+    for ( j = lo; j <= hi; ++j )
+        x->column[ j ] = MAX( x->column[ j ], score_row[ j ] );
+
+    if ( first < 0 ) {
+        x->lo[ row + 1 ] = 1;
+        x->hi[ row + 1 ] = 0;
+    }
+    else {
+        x->lo[ row + 1 ] = MAX( 1, first );
+        x->hi[ row + 1 ] = MIN( score_cols - 1, last + span );
+    }
+}
+
+//____________________________________________________________________________________
+
+static inline double XDropTail( const long tail
+                              , const long do_affine
+                              , const long do_codon
+                              , const double open_insertion
+                              , const double extend_insertion
+                              , const double miscall_cost
+                              )
+{
+    /**
+     * the cost of inserting the last tail letters of the query,
+     * a codon at a time if do_codon, where a partial codon left over costs a miscall
+     */
+    const long n = do_codon ? ( tail + 2 ) / 3 : tail;
+
+    if ( n <= 0 )
+        return 0.;
+
+    return ( do_affine ? open_insertion + ( n - 1 ) * extend_insertion : n * open_insertion )
+         + ( do_codon && tail % 3 ? miscall_cost : 0. );
+}
+
+//____________________________________________________________________________________
+
+static void FillRows( SCORE_T * const score_matrix
+                    , SCORE_T * const insertion_matrix
+                    , SCORE_T * const deletion_matrix
+                    , const SCORE_T * const score_column
+                    , const SCORE_T * const insertion_column
+                    , const SCORE_T * const deletion_column
+                    , SCORE_T * const last_column
+                    , char * const r_str
+                    , char * const q_str
+                    , const long * const r_enc
+                    , long * const q_enc
+                    , const long first
+                    , const long last
+                    , const long base
+                    , const long score_cols
+                    , const long char_count
+                    , const long * const char_map
+                    , const double * const cost_matrix
+                    , const long cost_stride
+                    , const double open_insertion
+                    , const double extend_insertion
+                    , const double open_deletion
+                    , const double extend_deletion
+                    , const double miscall_cost
+                    , const long do_affine
+                    , const long do_codon
+                    , const double * const codon3x5
+                    , const double * const codon3x4
+                    , const double * const codon3x2
+                    , const double * const codon3x1
+                    , const long band_width
+                    , const long diag_lo
+                    , const long diag_hi
+                    , SimdProfile * const profile
+                    , XDrop * const xdrop
+                    , long * const cells
+                    )
+{
+    /**
+     * compute rows first through last of the scoring matrices,
+     * row i is stored at i - base, and row first - 1 must already be there.
+     * the first column of each row comes from the *_column arrays,
+     * and the last column is saved in last_column.
+     * if profile is given, the affine non-codon rows are computed by its vector kernel,
+     * if xdrop is given (never with profile), only the cells X-drop reaches are computed,
+     * and cells counts those computed
+     */
+    const long ref_stride = do_codon ? 3 : 1;
+    SCORE_T * const insertions = do_affine ? insertion_matrix : NULL,
+            * const deletions = do_affine ? deletion_matrix : NULL;
+    long i, j, k, lo, hi, cap;
+
+    for ( i = first; i <= last; ++i ) {
+        const long offset = ( i - base ) * score_cols;
+
+        // the first column is the boundary, and a codon step
+        // never writes insertions in the next two columns
+        for ( k = offset; k < offset + MIN( 3, score_cols ); ++k ) {
+            score_matrix[ k ] = 0.;
+            if ( do_affine ) {
+                deletion_matrix[ k ] = 0.;
+                insertion_matrix[ k ] = 0.;
+            }
+        }
+        score_matrix[ offset ] = score_column[ i ];
+        if ( do_affine ) {
+            deletion_matrix[ offset ] = deletion_column[ i ];
+            insertion_matrix[ offset ] = insertion_column[ i ];
+        }
+
+        BandBounds( i, ref_stride, diag_lo, diag_hi, score_cols, &lo, &hi );
+        if ( band_width > 0 )
+            BandGuard( score_matrix
+                     , do_affine ? insertion_matrix : NULL
+                     , do_affine ? deletion_matrix : NULL
+                     , i
+                     , base
+                     , ref_stride
+                     , diag_lo
+                     , diag_hi
+                     , score_cols
+                     );
+
+        cap = hi;
+        if ( xdrop && ! XDropBounds( xdrop, score_matrix, insertions, deletions, i, base, score_cols, &lo, &hi ) ) {
+            // X-drop has stopped, this row and those below it are left out
+            XDropUpdate( xdrop, score_matrix + offset, i, lo, hi, score_cols, 0 );
+            last_column[ i ] = SCORE_MIN;
+            continue;
+        }
+
+        if ( do_codon ) {
+            for ( j = lo; j <= hi; ++j ) {
+                CodonAlignStringsStep( score_matrix
+                                     , insertion_matrix
+                                     , deletion_matrix
+                                     , r_enc
+                                     , q_enc
+                                     , i
+                                     , i - base
+                                     , j
+                                     , score_cols
+                                     , char_count
+                                     , miscall_cost
+                                     , open_insertion
+                                     , open_deletion
+                                     , extend_insertion
+                                     , extend_deletion
+                                     , cost_matrix
+                                     , cost_stride
+                                     , codon3x5
+                                     , codon3x4
+                                     , codon3x2
+                                     , codon3x1
+                                     );
+                if ( xdrop && j == hi && XDropExtend( xdrop, score_matrix, insertions, deletions, i, base, score_cols, j, cap, 3 ) )
+                    ++hi;
+            }
+        }
+        else if ( profile ) {
+            if ( i == first )
+                SimdLoadRow( profile
+                           , score_matrix + offset - score_cols
+                           , deletion_matrix + offset - score_cols
+                           );
+            SimdProfileFillRow( profile
+                              , i
+                              , r_enc[ i - 1 ]
+                              , score_matrix[ offset ]
+                              , deletion_matrix[ offset ]
+                              , insertion_matrix[ offset ]
+                              );
+            SimdStoreRow( profile
+                        , score_matrix + offset
+                        , deletion_matrix + offset
+                        , insertion_matrix + offset
+                        );
+        }
+        else {
+            const long r_char = r_enc[ i - 1 ];
+
+            for ( j = lo; j <= hi; ++j ) {
+                const long curr = offset + j,
+                           prev = offset - score_cols + j;
+                // ref but not query is deletion
+                // query but not ref is insertion
+                double deletion  = score_matrix[ prev ] - open_deletion,
+                       insertion = score_matrix[ curr - 1 ] - open_insertion,
+                       match     = score_matrix[ prev - 1 ];
+
+                // if there is a match bonus or penalty, add it in
+                if ( r_char >= 0 ) {
+                    const long q_char = char_map[ (int) q_str[ j - 1 ] ];
+
+                    if ( q_char >= 0 ) {
+                        match += cost_matrix[ r_char * cost_stride + q_char ];
+                    }
+                }
+
+                // if we're doing affine gaps,
+                // look up potential moves in the affine gap matrices
+                if ( do_affine ) {
+                    deletion  = MAX( deletion,
+                                     deletion_matrix[ prev ] - ( i > 1 ? extend_deletion : open_deletion ) );
+                    insertion = MAX( insertion,
+                                     insertion_matrix[ curr - 1 ] - ( j > 1 ? extend_insertion : open_insertion ) );
+                    // store the values back in the gap matrices
+                    deletion_matrix[ curr ] = deletion;
+                    insertion_matrix[ curr ] = insertion;
+                }
+
+                score_matrix[ curr ] = MAX( match, MAX( deletion, insertion ) );
+
+                if ( xdrop && j == hi && XDropExtend( xdrop, score_matrix, insertions, deletions, i, base, score_cols, j, cap, 1 ) )
+                    ++hi;
+            }
+        }
+
+        *cells += hi - lo + 1;
+
+        if ( xdrop ) {
+            XDropGuard( score_matrix, insertions, deletions, offset, hi + 1, MIN( score_cols - 1, hi + 5 ) );
+            XDropUpdate( xdrop, score_matrix + offset, i, lo, hi, score_cols, do_codon ? 5 : 1 );
+            last_column[ i ] = hi == score_cols - 1 ? score_matrix[ offset + score_cols - 1 ] : SCORE_MIN;
+        }
+        else
+            last_column[ i ] = score_matrix[ offset + score_cols - 1 ];
+    }
+}
+
+//____________________________________________________________________________________
+
+static long EditOpsCigar( const signed char * const edit_ops
+                        , long edit_ptr
+                        , const char * const r_str
+                        , const char * const q_str
+                        , long * const cigar
+                        , long * const position
+                        , long * const edit_distance
+                        )
+{
+    /**
+     * run-length encode the edit_ops (which are in reverse) into cigar,
+     * as pairs of SAM operation (0 is M, 1 is I, 2 is D) and length,
+     * and return the number of pairs. the deletions before the first
+     * and after the last character of the query are left out,
+     * and the first give the position of the alignment in the reference
+     */
+    long i = 0, j = 0, n = 0, last = 0, op;
+
+    *position = 0;
+    *edit_distance = 0;
+
+    // skip the trailing deletions
+    while ( last < edit_ptr && edit_ops[ last ] < 0 )
+        ++last;
+
+    for ( --edit_ptr; edit_ptr >= last; --edit_ptr ) {
+        switch ( edit_ops[ edit_ptr ] ) {
+        case 0:
+            op = 0;
+            if ( r_str[ i++ ] != q_str[ j++ ] )
+                ++(*edit_distance);
+            break;
+        case 1:
+        case 2:
+            op = 1;
+            ++j;
+            ++(*edit_distance);
+            break;
+        default:
+            ++i;
+            // the leading deletions
+            if ( j == 0 ) {
+                ++(*position);
+                continue;
+            }
+            op = 2;
+            ++(*edit_distance);
+            break;
+        }
+
+        if ( n > 0 && cigar[ 2 * ( n - 1 ) ] == op )
+            ++cigar[ 2 * ( n - 1 ) + 1 ];
+        else {
+            cigar[ 2 * n ] = op;
+            cigar[ 2 * n + 1 ] = 1;
+            ++n;
+        }
+    }
+
+    return n;
+}
+
+//____________________________________________________________________________________
+
+double ALIGN_STRINGS( char * const r_str
                    , char * const q_str
                    , char ** r_res
                    , char ** q_res
@@ -650,9 +1268,20 @@ double AlignStrings( char * const r_str
                    , const double * const codon3x4
                    , const double * const codon3x2
                    , const double * const codon3x1
-                   , double * const score_matrix
-                   , double * const deletion_matrix
-                   , double * const insertion_matrix
+                   , void * const score_matrix_
+                   , void * const deletion_matrix_
+                   , void * const insertion_matrix_
+                   , const long band_width
+                   , const long band_offset
+                   , long * const band_touched
+                   , const long block_rows
+                   , const long * const r_codes
+                   , long ** cigar_res
+                   , long * const cigar_len
+                   , long * const position
+                   , long * const edit_distance
+                   , const double x_drop
+                   , long * const stats
                    )
 {
     /*
@@ -677,18 +1306,58 @@ double AlignStrings( char * const r_str
     //fprintf(stderr, "\n");
     //print_score_matrix( stderr, cost_matrix, cost_stride, cost_stride);
 
+    SCORE_T * const score_matrix = score_matrix_,
+            * const deletion_matrix = deletion_matrix_,
+            * const insertion_matrix = insertion_matrix_;
+
     const unsigned long r_len = strlen( r_str ),
                         q_len = strlen( q_str ),
                         ref_stride = ( do_codon ? 3 : 1 ), //3
                         score_rows = r_len / ref_stride + 1,
                         score_cols = q_len + 1;
 
-    long i, j, k;
+    long i, j, k, lo, hi, diag_lo, diag_hi;
     double score = 0.;
 
+    // if r_res is NULL, the aligned strings are not built,
+    // and if cigar_res is NULL too, only the score is computed, without a backtrack,
+    // and the matrices need hold only two rows.
+    // cigar_res receives the alignment as run-length encoded pairs (see EditOpsCigar)
+    const long do_backtrack = r_res != NULL || cigar_res != NULL;
+
+    if ( cigar_res ) {
+        *cigar_res = NULL;
+        *cigar_len = 0;
+        *position = 0;
+        *edit_distance = 0;
+    }
+
+    if ( band_touched )
+        *band_touched = FALSE;
+
+    // the band is centered on the diagonal that places the start of the query
+    // at band_offset in the reference, it must be at least a codon wide
+    // so that each row of the band overlaps the one before it
+    diag_lo = -band_offset - MAX( band_width, ref_stride );
+    diag_hi = -band_offset + MAX( band_width, ref_stride );
+
+    if ( band_width <= 0 ) {
+        // no band, compute every cell
+        diag_lo = -( (long) r_len );
+        diag_hi = q_len;
+    }
+    else if ( ! do_local && ! globalStartingPoint ) {
+        // a global alignment must be able to reach the last cell,
+        // so include the diagonals of both corners of the matrix
+        diag_lo = MIN( diag_lo, MIN( 0, (long) q_len - (long) r_len ) );
+        diag_hi = MAX( diag_hi, MAX( 0, (long) q_len - (long) r_len ) );
+    }
+
     if ( do_codon && ( r_len % 3 != 0 ) ) {
-        *r_res = NULL;
-        *q_res = NULL;
+        if ( r_res ) {
+            *r_res = NULL;
+            *q_res = NULL;
+        }
         return -A_LARGE_NUMBER;
     }
 
@@ -696,24 +1365,38 @@ double AlignStrings( char * const r_str
     // return early if possible
     if ( score_rows <= 1 ) {
         if ( score_cols > 1 ) {
-            *r_res = ALLOCA( char, q_len + 1 );
-            *q_res = ALLOCA( char, q_len + 1 );
-
-            if ( ISNULL( *r_res ) || ISNULL( *q_res ) ) {
-                free( *r_res );
-                free( *q_res );
-                *r_res = NULL;
-                *q_res = NULL;
-                return 0.;
+            // only build the strings if they are wanted
+            if ( r_res ) {
+                *r_res = ALLOCA( char, q_len + 1 );
+                *q_res = ALLOCA( char, q_len + 1 );
+
+                if ( ISNULL( *r_res ) || ISNULL( *q_res ) ) {
+                    free( *r_res );
+                    free( *q_res );
+                    *r_res = NULL;
+                    *q_res = NULL;
+                    return 0.;
+                }
+
+                // no ref, just query, which remains untouched
+                memcpy( *q_res, q_str, q_len + 1 );
+                // ref full of gaps
+                memset( *r_res, gap, sizeof( char ) * q_len );
+                // null terminate
+                r_res[ q_len ] = '\0';
+                q_res[ q_len ] = '\0';
             }
 
-            // no ref, just query, which remains untouched
-            memcpy( *q_res, q_str, q_len + 1 );
-            // ref full of gaps
-            memset( *r_res, gap, sizeof( char ) * q_len );
-            // null terminate
-            r_res[ q_len ] = '\0';
-            q_res[ q_len ] = '\0';
+            // the query is all insertion
+            if ( cigar_res ) {
+                *cigar_res = ALLOCA( long, 2 );
+                if ( ISNULL( *cigar_res ) )
+                    return 0.;
+                (*cigar_res)[ 0 ] = 1;
+                (*cigar_res)[ 1 ] = q_len;
+                *cigar_len = 1;
+                *edit_distance = q_len;
+            }
 
             // compute score
             if ( ! do_local || globalStartingPoint) {
@@ -726,24 +1409,27 @@ double AlignStrings( char * const r_str
     }
     else {
         if ( score_rows <= 1 ) {
-            *r_res = ALLOCA( char, r_len + 1 );
-            *q_res = ALLOCA( char, r_len + 1 );
-
-            if ( ISNULL( *r_res ) || ISNULL( *q_res ) ) {
-                free( *r_res );
-                free( *q_res );
-                *r_res = NULL;
-                *q_res = NULL;
-                return 0.;
-            }
+            // only build the strings if they are wanted
+            if ( r_res ) {
+                *r_res = ALLOCA( char, r_len + 1 );
+                *q_res = ALLOCA( char, r_len + 1 );
 
-            // no query, just ref, which remains untouched
-            memcpy( *r_res, r_str, r_len + 1 );
-            // ref full of gaps
-            memset( *q_res, gap, sizeof( char ) * r_len );
-            // null terminate
-            r_res[ r_len ] = '\0';
-            q_res[ r_len ] = '\0';
+                if ( ISNULL( *r_res ) || ISNULL( *q_res ) ) {
+                    free( *r_res );
+                    free( *q_res );
+                    *r_res = NULL;
+                    *q_res = NULL;
+                    return 0.;
+                }
+
+                // no query, just ref, which remains untouched
+                memcpy( *r_res, r_str, r_len + 1 );
+                // ref full of gaps
+                memset( *q_res, gap, sizeof( char ) * r_len );
+                // null terminate
+                r_res[ r_len ] = '\0';
+                q_res[ r_len ] = '\0';
+            }
 
             // if do local, score is 0
             if ( ! do_local || globalStartingPoint) {
@@ -763,9 +1449,71 @@ double AlignStrings( char * const r_str
                    * const deletion_matrix  = do_affine ? ALLOCA( double, score_rows * score_cols ) : NULL,
                    * const insertion_matrix = do_affine ? ALLOCA( double, score_rows * score_cols ) : NULL;
 #endif
-            // encode each string using the character map (char_map)
-            long * const r_enc = ALLOCA( long, r_len ),
+            // encode each string using the character map (char_map),
+            // the reference as codon indices if do_codon,
+            // unless r_codes already holds it encoded
+            long * const r_buf = r_codes ? NULL : ALLOCA( long, r_len ),
                  * const q_enc = ALLOCA( long, q_len );
+            const long * const r_enc = r_codes ? r_codes : r_buf;
+            // the first column of each matrix, and the last of the scoring matrix
+            SCORE_T * const score_column = ALLOCA( SCORE_T, score_rows ),
+                    * const deletion_column = ALLOCA( SCORE_T, score_rows ),
+                    * const insertion_column = ALLOCA( SCORE_T, score_rows ),
+                    * const last_column = ALLOCA( SCORE_T, score_rows );
+            // if block_rows is set, the matrices hold only block_rows + 1 rows
+            // followed by the checkpoints, the first row of every block,
+            // and each block is recomputed from its checkpoint during the backtrack
+            const long checkpoints = block_rows + 1;
+            long base = 0;
+            // X-drop only applies where the alignment may end anywhere,
+            // it starts from the first cell
+            const long use_xdrop = x_drop > 0 && ( do_local || globalStartingPoint );
+            XDrop xdrop = { x_drop, 0., 0, 0, 0, NULL, NULL, NULL };
+            // the cells computed, recomputed ones included
+            long cells = 0;
+            // affine, non-codon, unbanded alignments with integral scores
+            // are computed exactly by a vectorized integer kernel (which computes
+            // whole rows, so not with X-drop)
+            SimdProfile profile;
+            const long use_simd = do_affine && ! do_codon && band_width <= 0 && ! use_xdrop
+                               && SimdProfileInit( &profile
+                                                 , q_str
+                                                 , score_rows
+                                                 , score_cols
+                                                 , char_map
+                                                 , cost_matrix
+                                                 , cost_stride
+                                                 , open_insertion
+                                                 , extend_insertion
+                                                 , open_deletion
+                                                 , extend_deletion
+                                                 );
+
+            if ( use_xdrop ) {
+                xdrop.lo = ALLOCA( long, score_rows + 1 );
+                xdrop.hi = ALLOCA( long, score_rows + 1 );
+                // zeroed, the score of the alignment before its first cell
+                xdrop.column = ALLOCA( double, score_cols );
+            }
+
+#define FILL_ARGS score_matrix, insertion_matrix, deletion_matrix, \
+                  score_column, insertion_column, deletion_column, last_column, \
+                  r_str, q_str, r_enc, q_enc
+#define FILL_OPTS score_cols, char_count, char_map, cost_matrix, cost_stride, \
+                  open_insertion, extend_insertion, open_deletion, extend_deletion, miscall_cost, \
+                  do_affine, do_codon, codon3x5, codon3x4, codon3x2, codon3x1, \
+                  band_width, diag_lo, diag_hi, ( use_simd ? &profile : NULL ), \
+                  ( use_xdrop ? &xdrop : NULL ), &cells
+// make sure row and the one above it are in the matrices
+#define LOAD_ROWS( row ) \
+            if ( block_rows > 0 && ( row ) >= 1 && ( row ) - 1 < base ) { \
+                base = ( ( row ) - 1 ) / block_rows * block_rows; \
+                CopyRow( score_matrix \
+                       , do_affine ? insertion_matrix : NULL \
+                       , do_affine ? deletion_matrix : NULL \
+                       , 0, checkpoints + base / block_rows, score_cols ); \
+                FillRows( FILL_ARGS, base + 1, MIN( base + block_rows, score_rows - 1 ), base, FILL_OPTS ); \
+            }
 
             if ( ISNULL( edit_ops )
 #if 0
@@ -773,38 +1521,48 @@ double AlignStrings( char * const r_str
               || ( do_affine && ( ISNULL( insertion_matrix )
                                || ISNULL( deletion_matrix  ) ) )
 #endif
-              || ISNULL( r_enc )
-              || ISNULL( q_enc ) ) {
-                *r_res = NULL;
-                *q_res = NULL;
+              || ( ! r_codes && ISNULL( r_buf ) )
+              || ISNULL( q_enc )
+              || ISNULL( score_column )
+              || ISNULL( deletion_column )
+              || ISNULL( insertion_column )
+              || ISNULL( last_column )
+              || ( use_xdrop && ( ISNULL( xdrop.lo ) || ISNULL( xdrop.hi ) || ISNULL( xdrop.column ) ) ) ) {
+                if ( r_res ) {
+                    *r_res = NULL;
+                    *q_res = NULL;
+                }
+                score = -A_LARGE_NUMBER;
                 goto end;
             }
 
-#if 1
-            // if this is set, then 8 0-bytes is equivalent to a 0. double,
-            // which is done because we calloc'd
-#ifdef __STDC_IEC_559__
-            memset( score_matrix, 0, sizeof( double ) * score_rows * score_cols );
-            if ( do_affine ) { //true
-                memset( deletion_matrix, 0, sizeof( double ) * score_rows * score_cols );
-                memset( insertion_matrix, 0, sizeof( double ) * score_rows * score_cols );
-            }
-#else
-            for ( i = 0; i < score_rows * score_cols; ++i ) { //not called
+            // the first row is the boundary, clear it
+            // (the first column of every row is cleared as it is computed)
+            for ( i = 0; i < score_cols; ++i ) {
                 score_matrix[ i ] = 0.;
-            }
-            if ( do_affine )
-                for ( i = 0; i < score_rows * score_cols; ++i ) {
-
+                if ( do_affine ) {
                     deletion_matrix[ i ] = 0.;
                     insertion_matrix[ i ] = 0.;
                 }
-#endif
-#endif
+            }
+
+            if ( ! r_codes ) {
+                if ( do_codon ) {
+                    for ( i = 0; i < score_rows - 1; ++i ) {
+                        r_buf[ i ] = ( char_map[ (int) r_str[ 3 * i ] ] * char_count
+                                     + char_map[ (int) r_str[ 3 * i + 1 ] ] ) * char_count
+                                     + char_map[ (int) r_str[ 3 * i + 2 ] ];
+                        if ( r_buf[ i ] < 0 )
+                            r_buf[ i ] = cost_stride - 1;
+                    }
+                }
+                else {
+                    for ( i = 0; i < r_len; ++i )
+                        r_buf[ i ] = char_map[ (int) r_str[ i ] ];
+                }
+            }
+
             if ( do_codon ) {
-                for ( i = 0; i < r_len; ++i ){
-                    r_enc[ i ] = char_map[ (int) r_str[ i ] ];
-		}
                 for ( i = 0; i < q_len; ++i )
                     q_enc[ i ] = char_map[ (int) q_str[ i ] ];
             }
@@ -831,10 +1589,10 @@ double AlignStrings( char * const r_str
                     cost = -open_deletion;
                     deletion_matrix[ 0 ] = cost;
 
-                    for ( i = score_cols; i < score_rows * score_cols; i += score_cols, cost -= extend_deletion ) {
-                        score_matrix[ i ] = cost;
-                        insertion_matrix[ i ] = cost;
-                        deletion_matrix[ i ] = cost;
+                    for ( i = 1; i < score_rows; ++i, cost -= extend_deletion ) {
+                        score_column[ i ] = cost;
+                        insertion_column[ i ] = cost;
+                        deletion_column[ i ] = cost;
                     }
                 }
                 else {
@@ -847,8 +1605,8 @@ double AlignStrings( char * const r_str
 
                         cost = -open_deletion;
 
-                        for ( i = score_cols; i < score_rows * score_cols; i += score_cols, cost -= open_deletion )
-                            score_matrix[ i ] = cost;
+                        for ( i = 1; i < score_rows; ++i, cost -= open_deletion )
+                            score_column[ i ] = cost;
 
                         // handle the do_local, do_codon case
                     }
@@ -860,8 +1618,8 @@ double AlignStrings( char * const r_str
 
                         cost = -open_deletion;
 
-                        for ( i = score_cols, j = 0; i < score_rows * score_cols; i += score_cols, cost -= open_insertion, ++j )
-                            score_matrix[ i ] = cost - ( j % 3 != 0 ? miscall_cost : 0 );
+                        for ( i = 1, j = 0; i < score_rows; ++i, cost -= open_insertion, ++j )
+                            score_column[ i ] = cost - ( j % 3 != 0 ? miscall_cost : 0 );
                     }
                 }
 
@@ -881,8 +1639,8 @@ double AlignStrings( char * const r_str
 			}
                         // fill in the first column of the affine insertion matrix
                         // with the insertion cost plus the miscall penalty
-                        for ( i = score_cols, j = 0; i < score_rows * score_cols; i += score_cols, ++j ){
-                            insertion_matrix[ i ] = -open_insertion - ( j % 3 != 0 ? miscall_cost : 0 );
+                        for ( i = 1, j = 0; i < score_rows; ++i, ++j ){
+                            insertion_column[ i ] = -open_insertion - ( j % 3 != 0 ? miscall_cost : 0 );
 			}
                     }
                     else {
@@ -893,80 +1651,43 @@ double AlignStrings( char * const r_str
 
                         // fill in the first column of the affine insertion matrix
                         // with the insertion cost
-                        for ( i = score_cols; i < score_rows * score_cols; i += score_cols )
-                            insertion_matrix[ i ] = -open_insertion;
+                        for ( i = 1; i < score_rows; ++i )
+                            insertion_column[ i ] = -open_insertion;
                     }
                 }
             }
 
-            if ( do_codon ) {
-                for ( i = 1; i < score_rows; ++i )
-                    for ( j = 1; j < score_cols; ++j )
-                        CodonAlignStringsStep( score_matrix
-                                             , insertion_matrix
-                                             , deletion_matrix
-                                             , r_enc
-                                             , q_enc
-                                             , i
-                                             , j
-                                             , score_cols
-                                             , char_count
-                                             , miscall_cost
-                                             , open_insertion
-                                             , open_deletion
-                                             , extend_insertion
-                                             , extend_deletion
-                                             , cost_matrix
-                                             , cost_stride
-                                             , codon3x5
-                                             , codon3x4
-                                             , codon3x2
-                                             , codon3x1
-                                             );
-		
-		
-		        //print_score_matrix( stderr, score_matrix, score_rows, score_cols); //rows: 11, cols: 33
-		
-                // not doing codon alignment
-            }
-	    
-            else {
-                for ( i = 1; i < score_rows; ++i ) {
-                    const long r_char = char_map[ (int) r_str[ i - 1 ] ];
-
-                    for ( j = 1; j < score_cols; ++j ) {
-                        const long curr = ( i - 0 ) * score_cols + j,
-                                   prev = ( i - 1 ) * score_cols + j;
-                        // ref but not query is deletion
-                        // query but not ref is insertion
-                        double deletion  = score_matrix[ prev ] - open_deletion,
-                               insertion = score_matrix[ curr - 1 ] - open_insertion,
-                               match     = score_matrix[ prev - 1 ];
-
-                        // if there is a match bonus or penalty, add it in
-                        if ( r_char >= 0 ) {
-                            const long q_char = char_map[ (int) q_str[ j - 1 ] ];
+            last_column[ 0 ] = score_matrix[ score_cols - 1 ];
 
-                            if ( q_char >= 0 ) {
-                                match += cost_matrix[ r_char * cost_stride + q_char ];
-                            }
-                        }
-
-                        // if we're doing affine gaps,
-                        // look up potential moves in the affine gap matrices
-                        if ( do_affine ) {
-                            deletion  = MAX( deletion,
-                                             deletion_matrix[ prev ] - ( i > 1 ? extend_deletion : open_deletion ) );
-                            insertion = MAX( insertion,
-                                             insertion_matrix[ curr - 1 ] - ( j > 1 ? extend_insertion : open_insertion ) );
-                            // store the values back in the gap matrices
-                            deletion_matrix[ curr ] = deletion;
-                            insertion_matrix[ curr ] = insertion;
-                        }
+            if ( use_xdrop )
+                XDropUpdate( &xdrop, score_matrix, 0, 1, score_cols - 1, score_cols, do_codon ? 5 : 1 );
 
-                        score_matrix[ curr ] = MAX( match, MAX( deletion, insertion ) );
-                    }
+            if ( ! do_backtrack ) {
+                // without a backtrack, the previous row is all we need
+                SCORE_T * const insertions = do_affine ? insertion_matrix : NULL,
+                        * const deletions = do_affine ? deletion_matrix : NULL;
+                for ( base = 0; base + 1 < score_rows - 1; ++base ) {
+                    FillRows( FILL_ARGS, base + 1, base + 1, base, FILL_OPTS );
+                    CopyRow( score_matrix, insertions, deletions, 0, 1, score_cols );
+                }
+                FillRows( FILL_ARGS, base + 1, score_rows - 1, base, FILL_OPTS );
+            }
+            else if ( block_rows > 0 ) {
+                // keep the first row of each block as a checkpoint,
+                // the last block stays in place for the backtrack
+                SCORE_T * const insertions = do_affine ? insertion_matrix : NULL,
+                        * const deletions = do_affine ? deletion_matrix : NULL;
+                CopyRow( score_matrix, insertions, deletions, checkpoints, 0, score_cols );
+                for ( base = 0; base + block_rows < score_rows - 1; base += block_rows ) {
+                    FillRows( FILL_ARGS, base + 1, base + block_rows, base, FILL_OPTS );
+                    CopyRow( score_matrix, insertions, deletions,
+                             checkpoints + ( base + block_rows ) / block_rows, block_rows, score_cols );
+                    CopyRow( score_matrix, insertions, deletions, 0, block_rows, score_cols );
                 }
+                FillRows( FILL_ARGS, base + 1, score_rows - 1, base, FILL_OPTS );
+            }
+            else {
+                FillRows( FILL_ARGS, 1, score_rows - 1, 0, FILL_OPTS );
             }
 
             // set these indices to point at the ends
@@ -975,8 +1696,13 @@ double AlignStrings( char * const r_str
             j = q_len;
             // grab maximum score from the last entry in the table
 
-             score = score_matrix[ score_rows * score_cols - 1 ];
-	       
+            BandBounds( score_rows - 1, ref_stride, diag_lo, diag_hi, score_cols, &lo, &hi );
+
+            // the last entry may lie outside of the band
+            if ( lo <= hi && hi == score_cols - 1 )
+                score = last_column[ score_rows - 1 ];
+            else
+                score = -A_LARGE_NUMBER;
 
             // if we're doing a local alignment,
             // find the best score in the last row and column of the scoring matrix
@@ -988,29 +1714,61 @@ double AlignStrings( char * const r_str
                 // grab the best score from the last column of the score matrix,
                 // skipping the very last entry ( we already checked it )
 
-                for ( k = score_cols - 1; k < score_rows * score_cols - 1; k += score_cols )
-                    if ( score_matrix[ k ] > score ) {
-                           score = score_matrix[ k ];
+                for ( k = 0; k < score_rows - 1; ++k ) {
+                    // skip the rows where the band doesn't reach the last column
+                    if ( k >= 1 ) {
+                        BandBounds( k, ref_stride, diag_lo, diag_hi, score_cols, &lo, &hi );
+                        if ( lo > hi || hi != score_cols - 1 )
+                            continue;
+                    }
+                    if ( last_column[ k ] > score ) {
+                           score = last_column[ k ];
 
-                        // if do_codon, k / score_cols indexes into the codon space
+                        // if do_codon, k indexes into the codon space
                         // of the reference, which is resolved by multiplication
                         // by ref_stride ( which is 3 ), otherwise this
                         // directly indexes into the reference
 
-                          i = ref_stride * ( k / score_cols );
+                          i = ref_stride * k;
                     }
+                }
 
                 // grab the best score from the last row of the score matrix,
                 // skipping the very last entry ( we already checked it )
-                for ( k = ( score_rows - 1 ) * score_cols; k < score_rows * score_cols - 1; ++k )
+                BandBounds( score_rows - 1, ref_stride, diag_lo, diag_hi, score_cols, &lo, &hi );
+                for ( k = ( score_rows - 1 - base ) * score_cols; k < ( score_rows - base ) * score_cols - 1; ++k ) {
+                    // the first column is the boundary, otherwise stay in the band
+                    const long col = k - ( score_rows - 1 - base ) * score_cols;
+                    if ( col > 0 && ( col < lo || col > hi ) )
+                        continue;
+                    // or in the columns X-drop computed
+                    if ( use_xdrop && col > 0
+                      && ( col < xdrop.lo[ score_rows - 1 ] || col > xdrop.hi[ score_rows - 1 ] ) )
+                        continue;
                     if ( score_matrix[ k ] > score ) {
                         score = score_matrix[ k ];
                         // if we've found a better score here,
                         // don't forget to reset the ref index
                         i = r_len;
                         // remove the initial value!
-                        j = k - ( score_rows - 1 ) * score_cols;
+                        j = col;
                     }
+                }
+                // X-drop only prunes, the alignment ends in the last row or column
+                // as it would without it, unless X-drop pruned every cell there:
+                // then it ends at the best cell, paying for the rest of the query as insertions
+                if ( use_xdrop && score < SCORE_MIN / 2 ) {
+                    score = xdrop.best - XDropTail( q_len - xdrop.best_col
+                                                  , do_affine
+                                                  , do_codon
+                                                  , open_insertion
+                                                  , extend_insertion
+                                                  , miscall_cost
+                                                  );
+                    i = ref_stride * xdrop.best_row;
+                    j = xdrop.best_col;
+                }
+
                 // fill in the edit_ops with the difference
                 // between r_len and i
                 for ( k = i; k < r_len; ++k )
@@ -1022,6 +1780,11 @@ double AlignStrings( char * const r_str
                     edit_ops[ edit_ptr++ ] = 1;
             }
             //fprintf(stderr, "%s %g %s", "\nScore: ", score, "\n");
+
+            // only the score was wanted
+            if ( ! do_backtrack )
+                goto end;
+
             // backtrack now
 
             /*
@@ -1053,7 +1816,14 @@ double AlignStrings( char * const r_str
 	    //fprintf(stderr, "%lu %s %lu %s", i/3, " ", j,"\n");
 
                 while ( i && j && ( i >= 3 || j >= 3 ) ) {
-			
+
+                    LOAD_ROWS( i / 3 );
+
+                    // note if the path runs along the edge of the band
+                    if ( band_width > 0 && band_touched
+                      && OnBandEdge( i / 3, j, ref_stride, diag_lo, diag_hi, score_cols ) )
+                        *band_touched = TRUE;
+
                     // perform a step
                     const long code = CodonAlignStringsStep(
                                         score_matrix
@@ -1063,6 +1833,7 @@ double AlignStrings( char * const r_str
                                       , q_enc
                                       // divide by 3 to index into codon space
                                       , ( i / 3 )
+                                      , ( i / 3 ) - base
                                       , j
                                       , score_cols
                                       , char_count
@@ -1079,9 +1850,21 @@ double AlignStrings( char * const r_str
                                       , codon3x1
                                       );
 
+                    // the band can leave cells near the first columns unreachable
+                    // (partial codons with ambiguous characters are disallowed),
+                    // if the path leads into one, the band is too narrow
+                    if ( band_width > 0
+                      && score_matrix[ ( i / 3 - base ) * score_cols + j ] <= SCORE_MIN ) {
+                        if ( band_touched )
+                            *band_touched = TRUE;
+                        break;
+                    }
+
                     // alter edit_ops and decrement i and j
                     // according to the step k we took
                     BacktrackAlignCodon( edit_ops, &edit_ptr, &i, &j, code);
+                    if ( stats && code >= HY_3X1_START )
+                        ++stats[ ALIGN_STATS_FRAMESHIFTS ];
 		    // At this point, i and j have changed values according to BacktrackAlignCodon
 
 			
@@ -1089,8 +1872,10 @@ double AlignStrings( char * const r_str
 		    
                     // if anything drops below 0, something bad happened
                     if ( i < 0 || j < 0 ) {
-                        *r_res = NULL;
-                        *q_res = NULL;
+                        if ( r_res ) {
+                            *r_res = NULL;
+                            *q_res = NULL;
+                        }
 			            fprintf(stderr, "something bad!");
                         score = -A_LARGE_NUMBER;
                         goto end;
@@ -1099,7 +1884,7 @@ double AlignStrings( char * const r_str
                     // handle the affine cases
                     if ( do_affine ) {
                         // divide by 3 to index into codon space
-                        k = ( i / 3 ) * score_cols + j; 
+                        k = ( i / 3 - base ) * score_cols + j; 
                         
                         // reference matched but not query, a deletion
                         if ( code == HY_111_000 ) {
@@ -1116,7 +1901,12 @@ double AlignStrings( char * const r_str
                                 edit_ops[ edit_ptr++ ] = -1;
                                 // move up a row in the score_matrix
                                 // which is a codon in the reference
-                                k -= score_cols;
+                                // (and into the previous block, if need be)
+                                LOAD_ROWS( i / 3 );
+                                k = ( i / 3 - base ) * score_cols + j;
+                                if ( band_width > 0 && band_touched
+                                  && OnBandEdge( i / 3, j, ref_stride, diag_lo, diag_hi, score_cols ) )
+                                    *band_touched = TRUE;
                             }
 
                             // query matched but not reference, insertion
@@ -1134,6 +1924,9 @@ double AlignStrings( char * const r_str
                                 // move up 3 in the score_matrix
                                 // which is a codon in the query
                                 k -= 3;
+                                if ( band_width > 0 && band_touched
+                                  && OnBandEdge( i / 3, j, ref_stride, diag_lo, diag_hi, score_cols ) )
+                                    *band_touched = TRUE;
                             }
                         }
                         
@@ -1145,9 +1938,16 @@ double AlignStrings( char * const r_str
 		
                 if ( do_affine ) {
                     while ( i && j ) {
-                        long curr = ( i - 0 ) * score_cols + j,
-                             prev = ( i - 1 ) * score_cols + j,
+                        LOAD_ROWS( i );
+
+                        long curr = ( i - 0 - base ) * score_cols + j,
+                             prev = ( i - 1 - base ) * score_cols + j,
                              best_choice = 0;
+
+                        // note if the path runs along the edge of the band
+                        if ( band_width > 0 && band_touched
+                          && OnBandEdge( i, j, ref_stride, diag_lo, diag_hi, score_cols ) )
+                            *band_touched = TRUE;
                         // check the current affine scores and the match score
                         double scores[ 3 ] = {
                             deletion_matrix[ curr ],
@@ -1179,7 +1979,11 @@ double AlignStrings( char * const r_str
                                   ) {
                                 --i;
                                 edit_ops[ edit_ptr++ ] = -1;
-                                curr -= score_cols;
+                                LOAD_ROWS( i );
+                                curr = ( i + 1 - base ) * score_cols + j;
+                                if ( band_width > 0 && band_touched
+                                  && OnBandEdge( i, j, ref_stride, diag_lo, diag_hi, score_cols ) )
+                                    *band_touched = TRUE;
                             }
 
                             break;
@@ -1200,6 +2004,9 @@ double AlignStrings( char * const r_str
                                 --j;
                                 edit_ops[ edit_ptr++ ] = 1;
                                 --curr;
+                                if ( band_width > 0 && band_touched
+                                  && OnBandEdge( i, j, ref_stride, diag_lo, diag_hi, score_cols ) )
+                                    *band_touched = TRUE;
                             }
 
                             break;
@@ -1217,8 +2024,13 @@ double AlignStrings( char * const r_str
                 }
                 else {
                     while ( i && j ) {
-                        const long curr = ( i - 0 ) * score_cols + j,
-                                   prev = ( i - 1 ) * score_cols + j;
+                        LOAD_ROWS( i );
+
+                        const long curr = ( i - 0 - base ) * score_cols + j,
+                                   prev = ( i - 1 - base ) * score_cols + j;
+                        if ( band_width > 0 && band_touched
+                          && OnBandEdge( i, j, ref_stride, diag_lo, diag_hi, score_cols ) )
+                            *band_touched = TRUE;
                         double deletion  = score_matrix[ prev ] - open_deletion,
                                insertion = score_matrix[ curr - 1 ] - open_insertion,
                                match     = score_matrix[ prev - 1 ];
@@ -1240,7 +2052,19 @@ double AlignStrings( char * const r_str
                 edit_ops[ edit_ptr++ ] = 1;
 	    }
 
-            if ( edit_ptr > 0 ) {
+            if ( stats )
+                stats[ ALIGN_STATS_TRACEBACK ] += edit_ptr;
+
+            if ( cigar_res && edit_ptr > 0 ) {
+                *cigar_res = ALLOCA( long, 2 * edit_ptr );
+                if ( ISNULL( *cigar_res ) ) {
+                    score = 0.;
+                    goto end;
+                }
+                *cigar_len = EditOpsCigar( edit_ops, edit_ptr, r_str, q_str, *cigar_res, position, edit_distance );
+            }
+
+            if ( r_res && edit_ptr > 0 ) {
 
                 // reset indices to 0
                 i = j = 0;
@@ -1309,6 +2133,8 @@ double AlignStrings( char * const r_str
             }
 
 end:
+            if ( stats )
+                stats[ ALIGN_STATS_CELLS ] += cells;
 #if 0
             {
                 double max_score = -A_LARGE_NUMBER;
@@ -1352,7 +2178,7 @@ end:
     
                 if ( scorep > max_score ) {
                     fprintf( stderr, "\nscore: %g, seq: %s\n", score / ( 1.0 * q_len / ref_stride ), *q_res );
-                    print_score_matrix( stderr, score_matrix, score_rows, score_cols );
+                    PRINT_SCORE_MATRIX( stderr, score_matrix, score_rows, score_cols );
                 }
             }
 #endif
@@ -1363,8 +2189,20 @@ end:
             free( deletion_matrix );
             free( insertion_matrix );
 #endif
-            free( r_enc );
+            free( r_buf );
             free( q_enc );
+            free( score_column );
+            free( deletion_column );
+            free( insertion_column );
+            free( last_column );
+            free( xdrop.lo );
+            free( xdrop.hi );
+            free( xdrop.column );
+            if ( use_simd )
+                SimdProfileFree( &profile );
+#undef LOAD_ROWS
+#undef FILL_OPTS
+#undef FILL_ARGS
         }
     }
 
@@ -1,28 +1,56 @@
 
-double AlignStrings(
-    char * const,
-    char * const,
-    char **,
-    char **,
-    const long,
-    const long * const,
-    const double * const,
-    const long,
-    const char,
-    const double,
-    const double,
-    const double,
-    const double,
-    const double,
-    const long,
-    const long,
-    const long,
-    const long,
-    const double * const,
-    const double * const,
-    const double * const,
-    const double * const,
-    double * const,
-    double * const,
-    double * const
-    );
+// AlignStrings is also compiled as AlignStringsF32 and AlignStringsI32,
+// over float and int32_t scoring matrices respectively,
+// which are passed untyped in place of the double ones
+
+// the counters AlignStrings adds to, if given an array of ALIGN_STATS_COUNT:
+// the cells computed, the length of the traceback,
+// and the codon steps taken in it which shift the frame
+#define ALIGN_STATS_CELLS 0
+#define ALIGN_STATS_TRACEBACK 1
+#define ALIGN_STATS_FRAMESHIFTS 2
+#define ALIGN_STATS_COUNT 3
+
+#define ALIGN_STRINGS_PARAMS \
+    char * const, \
+    char * const, \
+    char **, \
+    char **, \
+    const long, \
+    const long * const, \
+    const double * const, \
+    const long, \
+    const char, \
+    const double, \
+    const double, \
+    const double, \
+    const double, \
+    const double, \
+    const long, \
+    const long, \
+    const long, \
+    const long, \
+    const double * const, \
+    const double * const, \
+    const double * const, \
+    const double * const, \
+    void * const, \
+    void * const, \
+    void * const, \
+    const long, \
+    const long, \
+    long * const, \
+    const long, \
+    const long * const, \
+    long **, \
+    long * const, \
+    long * const, \
+    long * const, \
+    const double, \
+    long * const
+
+double AlignStrings( ALIGN_STRINGS_PARAMS );
+
+double AlignStringsF32( ALIGN_STRINGS_PARAMS );
+
+double AlignStringsI32( ALIGN_STRINGS_PARAMS );
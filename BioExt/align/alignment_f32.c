@@ -0,0 +1,12 @@
+
+#include <float.h>
+
+// AlignStrings over float matrices, half the memory of the double ones,
+// exact as long as every score is representable in a float
+
+#define SCORE_T float
+#define SCORE_MIN ( -FLT_MAX )
+#define ALIGN_STRINGS AlignStringsF32
+#define PRINT_SCORE_MATRIX print_score_matrix_f32
+
+#include "alignment.c"
@@ -0,0 +1,12 @@
+
+#include <stdint.h>
+
+// AlignStrings over int32_t matrices, for scores and penalties
+// already scaled to integers, which must stay well within SCORE_MIN
+
+#define SCORE_T int32_t
+#define SCORE_MIN ( -( 1 << 30 ) )
+#define ALIGN_STRINGS AlignStringsI32
+#define PRINT_SCORE_MATRIX print_score_matrix_i32
+
+#include "alignment.c"
@@ -0,0 +1,317 @@
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "simd.h"
+
+#if defined( __GNUC__ ) && ( defined( __x86_64__ ) || defined( __i386__ ) )
+#define HAVE_SIMD 1
+#include <immintrin.h>
+#endif
+
+//____________________________________________________________________________________
+
+#define ALLOCA( type, len ) ( (type *) calloc( ( len ), sizeof( type ) ) )
+#define ISNULL( var ) ( ( var ) == NULL )
+
+#define MAX(a, b) ( (( a ) > ( b )) ? ( a ) : ( b ) )
+
+#define FALSE 0
+#define TRUE  1
+
+// the widest vector we use holds 8 scores
+#define SIMD_WIDTH 8
+// the smallest score we use, half of INT32_MIN so that subtracting a penalty is safe
+#define SIMD_NEG ( -( 1 << 30 ) )
+// scores (and the sums we form from them) must stay within this bound
+#define SIMD_BOUND ( 1 << 29 )
+// the largest power of two we try to make the scores integral
+#define SIMD_MAX_SCALE 1024.
+
+/**
+ * the integer kernel for the affine, non-codon, unbanded alignment:
+ *
+ * when every score and penalty is a multiple of a power of two 1 / scale,
+ * and no score can grow beyond SIMD_BOUND / scale, the scores are computed
+ * exactly as integers scaled by scale, and the matrices used
+ * for the backtrack hold exactly what the scalar kernel would have put there.
+ *
+ * each row is computed in two vectorized passes:
+ * first the best of match and deletion for each cell, H, which only depend
+ * on the previous row, then the insertions, which depend on the cell to the left:
+ *     I[ j ] = max( S[ j - 1 ] - open_insertion, I[ j - 1 ] - extend_insertion )
+ * as long as open_insertion >= extend_insertion, S[ j - 1 ] can be replaced
+ * with H[ j - 1 ], and then
+ *     I[ j ] + j * extend_insertion = max_{ k <= j }( H[ k - 1 ] - open_insertion + k * extend_insertion )
+ * is a running maximum, which we compute a vector at a time
+ */
+
+//____________________________________________________________________________________
+
+static double Scale( const double * const cost_matrix
+                   , const long cost_stride
+                   , const double open_insertion
+                   , const double extend_insertion
+                   , const double open_deletion
+                   , const double extend_deletion
+                   , double * const max_cost
+                   )
+{
+    const long n = cost_stride * cost_stride;
+    double scale;
+    long i;
+
+    for ( scale = 1.; scale <= SIMD_MAX_SCALE; scale *= 2. ) {
+        long integral = floor( open_insertion * scale ) == open_insertion * scale
+                     && floor( extend_insertion * scale ) == extend_insertion * scale
+                     && floor( open_deletion * scale ) == open_deletion * scale
+                     && floor( extend_deletion * scale ) == extend_deletion * scale;
+
+        *max_cost = MAX( MAX( fabs( open_insertion ), fabs( extend_insertion ) ),
+                         MAX( fabs( open_deletion ), fabs( extend_deletion ) ) );
+
+        for ( i = 0; integral && i < n; ++i ) {
+            integral = floor( cost_matrix[ i ] * scale ) == cost_matrix[ i ] * scale;
+            *max_cost = MAX( *max_cost, fabs( cost_matrix[ i ] ) );
+        }
+
+        if ( integral ) {
+            *max_cost *= scale;
+            return scale;
+        }
+    }
+
+    return 0.;
+}
+
+//____________________________________________________________________________________
+
+#ifdef HAVE_SIMD
+
+static inline __m128i Max128( const __m128i a, const __m128i b )
+{
+    // SSE2 has no signed 32-bit max
+    const __m128i mask = _mm_cmpgt_epi32( a, b );
+    return _mm_or_si128( _mm_and_si128( mask, a ), _mm_andnot_si128( mask, b ) );
+}
+
+__attribute__(( target( "sse2" ) ))
+static void FillRowSSE2( SimdProfile * const p
+                       , const long row
+                       , const long r_char
+                       )
+{
+    const int32_t * const prof = p->profile + r_char * p->stride,
+                  * const s_prev = p->score[ 1 - p->curr ],
+                  * const d_prev = p->deletion[ 1 - p->curr ];
+    int32_t * const s = p->score[ p->curr ],
+            * const d = p->deletion[ p->curr ],
+            * const ins = p->insertion,
+            * const h = p->match;
+    const __m128i open_insertion = _mm_set1_epi32( p->open_insertion ),
+                  open_deletion = _mm_set1_epi32( p->open_deletion ),
+                  extend_deletion = _mm_set1_epi32( row > 1 ? p->extend_deletion : p->open_deletion ),
+                  neg1 = _mm_set_epi32( 0, 0, 0, SIMD_NEG ),
+                  neg2 = _mm_set_epi32( 0, 0, SIMD_NEG, SIMD_NEG );
+    __m128i carry = _mm_set1_epi32( SIMD_NEG );
+    long j;
+
+    for ( j = 1; j < p->cols; j += 4 ) {
+        const __m128i del = Max128( _mm_sub_epi32( _mm_loadu_si128( (const __m128i *) ( s_prev + j ) ), open_deletion ),
+                                    _mm_sub_epi32( _mm_loadu_si128( (const __m128i *) ( d_prev + j ) ), extend_deletion ) ),
+                      match = _mm_add_epi32( _mm_loadu_si128( (const __m128i *) ( s_prev + j - 1 ) ),
+                                             _mm_loadu_si128( (const __m128i *) ( prof + j ) ) );
+        _mm_storeu_si128( (__m128i *) ( d + j ), del );
+        _mm_storeu_si128( (__m128i *) ( h + j ), Max128( match, del ) );
+    }
+
+    for ( j = 1; j < p->cols; j += 4 ) {
+        const __m128i ramp = _mm_loadu_si128( (const __m128i *) ( p->ramp + j ) );
+        __m128i v = _mm_add_epi32( _mm_sub_epi32( _mm_loadu_si128( (const __m128i *) ( h + j - 1 ) ), open_insertion ), ramp );
+        // running maximum within the vector, then across vectors
+        v = Max128( v, _mm_or_si128( _mm_slli_si128( v, 4 ), neg1 ) );
+        v = Max128( v, _mm_or_si128( _mm_slli_si128( v, 8 ), neg2 ) );
+        v = Max128( v, carry );
+        carry = _mm_shuffle_epi32( v, 0xFF );
+        v = _mm_sub_epi32( v, ramp );
+        _mm_storeu_si128( (__m128i *) ( ins + j ), v );
+        _mm_storeu_si128( (__m128i *) ( s + j ), Max128( _mm_loadu_si128( (const __m128i *) ( h + j ) ), v ) );
+    }
+}
+
+__attribute__(( target( "avx2" ) ))
+static void FillRowAVX2( SimdProfile * const p
+                       , const long row
+                       , const long r_char
+                       )
+{
+    const int32_t * const prof = p->profile + r_char * p->stride,
+                  * const s_prev = p->score[ 1 - p->curr ],
+                  * const d_prev = p->deletion[ 1 - p->curr ];
+    int32_t * const s = p->score[ p->curr ],
+            * const d = p->deletion[ p->curr ],
+            * const ins = p->insertion,
+            * const h = p->match;
+    const __m256i open_insertion = _mm256_set1_epi32( p->open_insertion ),
+                  open_deletion = _mm256_set1_epi32( p->open_deletion ),
+                  extend_deletion = _mm256_set1_epi32( row > 1 ? p->extend_deletion : p->open_deletion ),
+                  neg = _mm256_set1_epi32( SIMD_NEG ),
+                  shift1 = _mm256_setr_epi32( 0, 0, 1, 2, 3, 4, 5, 6 ),
+                  shift2 = _mm256_setr_epi32( 0, 0, 0, 1, 2, 3, 4, 5 ),
+                  shift4 = _mm256_setr_epi32( 0, 0, 0, 0, 0, 1, 2, 3 ),
+                  last = _mm256_set1_epi32( 7 );
+    __m256i carry = neg;
+    long j;
+
+    for ( j = 1; j < p->cols; j += 8 ) {
+        const __m256i del = _mm256_max_epi32( _mm256_sub_epi32( _mm256_loadu_si256( (const __m256i *) ( s_prev + j ) ), open_deletion ),
+                                              _mm256_sub_epi32( _mm256_loadu_si256( (const __m256i *) ( d_prev + j ) ), extend_deletion ) ),
+                      match = _mm256_add_epi32( _mm256_loadu_si256( (const __m256i *) ( s_prev + j - 1 ) ),
+                                                _mm256_loadu_si256( (const __m256i *) ( prof + j ) ) );
+        _mm256_storeu_si256( (__m256i *) ( d + j ), del );
+        _mm256_storeu_si256( (__m256i *) ( h + j ), _mm256_max_epi32( match, del ) );
+    }
+
+    for ( j = 1; j < p->cols; j += 8 ) {
+        const __m256i ramp = _mm256_loadu_si256( (const __m256i *) ( p->ramp + j ) );
+        __m256i v = _mm256_add_epi32( _mm256_sub_epi32( _mm256_loadu_si256( (const __m256i *) ( h + j - 1 ) ), open_insertion ), ramp );
+        // running maximum within the vector, then across vectors
+        v = _mm256_max_epi32( v, _mm256_blend_epi32( _mm256_permutevar8x32_epi32( v, shift1 ), neg, 0x01 ) );
+        v = _mm256_max_epi32( v, _mm256_blend_epi32( _mm256_permutevar8x32_epi32( v, shift2 ), neg, 0x03 ) );
+        v = _mm256_max_epi32( v, _mm256_blend_epi32( _mm256_permutevar8x32_epi32( v, shift4 ), neg, 0x0F ) );
+        v = _mm256_max_epi32( v, carry );
+        carry = _mm256_permutevar8x32_epi32( v, last );
+        v = _mm256_sub_epi32( v, ramp );
+        _mm256_storeu_si256( (__m256i *) ( ins + j ), v );
+        _mm256_storeu_si256( (__m256i *) ( s + j ), _mm256_max_epi32( _mm256_loadu_si256( (const __m256i *) ( h + j ) ), v ) );
+    }
+}
+
+#endif
+
+//____________________________________________________________________________________
+
+long SimdProfileInit( SimdProfile * const p
+                    , const char * const q_str
+                    , const long score_rows
+                    , const long score_cols
+                    , const long * const char_map
+                    , const double * const cost_matrix
+                    , const long cost_stride
+                    , const double open_insertion
+                    , const double extend_insertion
+                    , const double open_deletion
+                    , const double extend_deletion
+                    )
+{
+    /**
+     * returns FALSE if the scores cannot be computed exactly as integers,
+     * or if there is no vector kernel for this machine,
+     * in which case p need not be freed
+     */
+    double max_cost = 0.;
+    long i, j;
+
+    memset( p, 0, sizeof( SimdProfile ) );
+
+#ifdef HAVE_SIMD
+    if ( __builtin_cpu_supports( "avx2" ) )
+        p->fill_row = FillRowAVX2;
+    else if ( __builtin_cpu_supports( "sse2" ) )
+        p->fill_row = FillRowSSE2;
+#endif
+
+    if ( ! p->fill_row || open_insertion < extend_insertion )
+        return FALSE;
+
+    p->scale = Scale( cost_matrix, cost_stride, open_insertion, extend_insertion, open_deletion, extend_deletion, &max_cost );
+    p->cols = score_cols;
+    p->cost_stride = cost_stride;
+    p->stride = score_cols + 2 * SIMD_WIDTH;
+
+    // every score is bounded by the cost of the longest path through the matrix
+    if ( p->scale == 0.
+      || ( score_rows + p->stride + 1 ) * MAX( max_cost, 1. ) >= SIMD_BOUND )
+        return FALSE;
+
+    p->open_insertion = (int32_t) ( open_insertion * p->scale );
+    p->open_deletion = (int32_t) ( open_deletion * p->scale );
+    p->extend_deletion = (int32_t) ( extend_deletion * p->scale );
+
+    // one row per reference character, and a last row of 0s for characters
+    // that aren't in the score matrix
+    p->profile = ALLOCA( int32_t, ( cost_stride + 1 ) * p->stride );
+    p->ramp = ALLOCA( int32_t, p->stride );
+    p->score[ 0 ] = ALLOCA( int32_t, p->stride );
+    p->score[ 1 ] = ALLOCA( int32_t, p->stride );
+    p->deletion[ 0 ] = ALLOCA( int32_t, p->stride );
+    p->deletion[ 1 ] = ALLOCA( int32_t, p->stride );
+    p->insertion = ALLOCA( int32_t, p->stride );
+    p->match = ALLOCA( int32_t, p->stride );
+
+    if ( ISNULL( p->profile ) || ISNULL( p->ramp )
+      || ISNULL( p->score[ 0 ] ) || ISNULL( p->score[ 1 ] )
+      || ISNULL( p->deletion[ 0 ] ) || ISNULL( p->deletion[ 1 ] )
+      || ISNULL( p->insertion ) || ISNULL( p->match ) ) {
+        SimdProfileFree( p );
+        return FALSE;
+    }
+
+    for ( j = 1; j < score_cols; ++j ) {
+        const long q_char = char_map[ (int) q_str[ j - 1 ] ];
+        if ( q_char < 0 )
+            continue;
+        for ( i = 0; i < cost_stride; ++i )
+            p->profile[ i * p->stride + j ] = (int32_t) ( cost_matrix[ i * cost_stride + q_char ] * p->scale );
+    }
+
+    for ( j = 0; j < p->stride; ++j )
+        p->ramp[ j ] = (int32_t) ( j * extend_insertion * p->scale );
+
+    return TRUE;
+}
+
+//____________________________________________________________________________________
+
+void SimdProfileFillRow( SimdProfile * const p
+                       , const long row
+                       , const long r_char
+                       , const double score_first
+                       , const double deletion_first
+                       , const double insertion_first
+                       )
+{
+    /**
+     * compute row from the last row computed (or loaded into score and deletion),
+     * given the first column of the row, leaving it in score[ curr ],
+     * deletion[ curr ] and insertion for the caller to read back
+     */
+    int32_t * s, * d;
+
+    p->curr = 1 - p->curr;
+    s = p->score[ p->curr ];
+    d = p->deletion[ p->curr ];
+
+    s[ 0 ] = (int32_t) ( score_first * p->scale );
+    d[ 0 ] = (int32_t) ( deletion_first * p->scale );
+    p->insertion[ 0 ] = (int32_t) ( insertion_first * p->scale );
+    // an insertion in the first column extends the first column
+    p->match[ 0 ] = MAX( s[ 0 ], p->insertion[ 0 ] );
+
+    p->fill_row( p, row, r_char >= 0 ? r_char : p->cost_stride );
+}
+
+//____________________________________________________________________________________
+
+void SimdProfileFree( SimdProfile * const p )
+{
+    free( p->profile );
+    free( p->ramp );
+    free( p->score[ 0 ] );
+    free( p->score[ 1 ] );
+    free( p->deletion[ 0 ] );
+    free( p->deletion[ 1 ] );
+    free( p->insertion );
+    free( p->match );
+    memset( p, 0, sizeof( SimdProfile ) );
+}
@@ -0,0 +1,48 @@
+#include <stdint.h>
+
+typedef struct SimdProfile SimdProfile;
+
+struct SimdProfile {
+    double scale;             // scores are multiplied by scale to make them integral
+    long cols;                // columns in the scoring matrix
+    long cost_stride;
+    long stride;              // columns in each row below, with room to spare
+    int32_t open_insertion;
+    int32_t open_deletion;
+    int32_t extend_deletion;
+    int32_t * profile;        // cost of each reference character against the query
+    int32_t * ramp;           // j * extend_insertion
+    int32_t * score[ 2 ];     // the previous and current rows
+    int32_t * deletion[ 2 ];
+    int32_t * insertion;
+    int32_t * match;          // the best of match and deletion, for the current row
+    long curr;
+    void ( * fill_row )( SimdProfile * const, const long, const long );
+};
+
+long SimdProfileInit(
+    SimdProfile * const,
+    const char * const,
+    const long,
+    const long,
+    const long * const,
+    const double * const,
+    const long,
+    const double,
+    const double,
+    const double,
+    const double
+    );
+
+void SimdProfileFillRow(
+    SimdProfile * const,
+    const long,
+    const long,
+    const double,
+    const double,
+    const double
+    );
+
+void SimdProfileFree(
+    SimdProfile * const
+    );
@@ -0,0 +1,24 @@
+"""
+Helpers shared by the tests of the aligner.
+"""
+
+from __future__ import division, print_function
+
+from BioExt.align import Aligner
+from BioExt.references import hxb2, nl4_3
+
+
+def pair(gene='nef'):
+    # the HXB2 gene as the reference, without its gaps, and its NL4-3 counterpart as the query
+    return str(getattr(hxb2, gene).load().seq).replace('-', ''), str(getattr(nl4_3, gene).load().seq)
+
+
+def aligner(score_matrix, do_codon, globalStartingPoint=False, extendGapPenalty=2.5, **kwargs):
+    # an Aligner for score_matrix (a score matrix still to load), ends free by default
+    return Aligner(
+        score_matrix.load(),
+        globalStartingPoint,
+        extendGapPenalty,
+        do_codon=do_codon,
+        **kwargs
+        )
@@ -0,0 +1,67 @@
+"""
+Test that banded alignments place reads as unbanded ones do, wherever they start.
+"""
+
+from __future__ import division, print_function
+
+from BioExt.references import hxb2
+from BioExt.scorematrices import BLOSUM62, DNA80
+
+import nose
+
+from .common import aligner
+
+
+STARTS = (0, 300, 1500, 2000)
+
+
+def reads():
+    # pieces of HXB2 env, each with a codon deleted, as the queries,
+    # and the whole of env as the reference
+    ref = str(hxb2.env.load().seq).replace('-', '')
+    ref = ref[:len(ref) - len(ref) % 3]
+    return ref, [(start, ref[start:start + 150] + ref[start + 153:start + 300]) for start in STARTS]
+
+
+def aligners(score_matrix, do_codon, **kwargs):
+    return (
+        aligner(score_matrix, do_codon),
+        aligner(score_matrix, do_codon, band_width=16, **kwargs)
+        )
+
+
+###############################################################################
+
+def test_offsets():
+    # the band follows the k-mer seeds of each read, prepared reference or not
+    ref, queries = reads()
+    full, banded = aligners(DNA80, False)
+    ref_ = banded.prepare_reference(ref)
+    for start, query in queries:
+        expected = full.cigar(ref, query)
+        nose.tools.assert_equal(expected[2], start)
+        nose.tools.assert_equal(banded.cigar(ref_, query), expected)
+        nose.tools.assert_equal(banded.cigar(ref, query), expected)
+        nose.tools.assert_equal(banded(ref_, query), full(ref, query))
+
+
+def test_min_score():
+    # a band which scores below the alignment the unbanded score says exists is widened
+    ref, queries = reads()
+    for score_matrix, do_codon in ((DNA80, False), (BLOSUM62, True)):
+        full, banded = aligners(score_matrix, do_codon)
+        ref_ = banded.prepare_reference(ref)
+        for _, query in queries:
+            expected = full.cigar(ref, query)
+            score = full.score(ref, query)
+            nose.tools.assert_equal(banded.cigar(ref_, query, min_score=score), expected)
+            # even a band about the wrong diagonal
+            nose.tools.assert_equal(banded.cigar(ref_, query, band_offset=1000, min_score=score), expected)
+
+
+def test_unseeded():
+    # a read sharing no k-mer with the reference is aligned without a band
+    ref, _ = reads()
+    full, banded = aligners(DNA80, False)
+    query = 'ACGT' * 30
+    nose.tools.assert_equal(banded.cigar(ref, query), full.cigar(ref, query))
@@ -0,0 +1,104 @@
+"""
+Test reusing alignments from an AlignCache.
+"""
+
+from __future__ import division, print_function
+
+import os
+import pickle
+
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from BioExt.align import AlignCache
+from BioExt.scorematrices import BLOSUM62, DNA80
+
+import nose
+
+from .common import aligner, pair
+
+
+def queries():
+    # pieces of the query, with a deletion and an insertion of their own
+    _, query = pair()
+    return [
+        query[:200],
+        query[100:400],
+        query[300:450] + query[452:],
+        query[150:250] + 'ACGTAC' + query[250:500],
+        query[:-30]
+        ]
+
+
+###############################################################################
+
+def test_reuse():
+    ref, _ = pair()
+    tmpdir = mkdtemp()
+    try:
+        for score_matrix, do_codon in ((DNA80, False), (BLOSUM62, True)):
+            path = os.path.join(tmpdir, 'alignments-{0:d}.sqlite'.format(do_codon))
+            aln = aligner(score_matrix, do_codon)
+            cache = AlignCache(path)
+            alc = aligner(score_matrix, do_codon, cache=cache)
+            for query in queries():
+                nose.tools.assert_equal(alc.cigar(ref, query), aln.cigar(ref, query))
+                # the aligned strings are built from the cached alignment
+                nose.tools.assert_equal(alc(ref, query), aln(ref, query))
+            nose.tools.assert_equal(cache.misses, len(queries()))
+            nose.tools.assert_equal(cache.hits, len(queries()))
+            # a prepared reference shares the alignments of the same reference
+            ref_ = alc.prepare_reference(ref)
+            for query in queries():
+                alc(ref_, query)
+            nose.tools.assert_equal(cache.hits, 2 * len(queries()))
+            nose.tools.assert_equal(len(cache), len(queries()))
+    finally:
+        rmtree(tmpdir)
+
+
+def test_keys():
+    ref, _ = pair()
+    tmpdir = mkdtemp()
+    try:
+        cache = AlignCache(os.path.join(tmpdir, 'alignments.sqlite'))
+        query = queries()[1]
+        aln = aligner(DNA80, False, cache=cache)
+        aln.cigar(ref, query)
+        # other penalties, other options of the aligner and another query all miss
+        aln.cigar(ref, query, open_insertion=20)
+        aligner(DNA80, False, True, cache=cache).cigar(ref, query)
+        aln.cigar(ref, query[1:])
+        nose.tools.assert_equal(cache.hits, 0)
+        nose.tools.assert_equal(len(cache), 4)
+        # the cache opens its database again in another process,
+        # or here once unpickled, and finds the alignments of the first
+        aln_ = pickle.loads(pickle.dumps(aln))
+        aln_.cigar(ref, query)
+        aln.cigar(ref, query)
+        nose.tools.assert_equal(cache.hits, 1)
+    finally:
+        rmtree(tmpdir)
+
+
+def test_evict():
+    ref, _ = pair()
+    tmpdir = mkdtemp()
+    try:
+        cache = AlignCache(os.path.join(tmpdir, 'alignments.sqlite'), size=4)
+        aln = aligner(DNA80, False, cache=cache)
+        queries_ = queries()
+        for query in queries_[:4]:
+            aln.cigar(ref, query)
+        # the first is used again, so the next two are the least recently used
+        aln.cigar(ref, queries_[0])
+        aln.cigar(ref, queries_[4])
+        nose.tools.assert_equal(len(cache), 3)
+        hits = cache.hits
+        for query in (queries_[0], queries_[3], queries_[4]):
+            aln.cigar(ref, query)
+        nose.tools.assert_equal(cache.hits, hits + 3)
+        aln.cigar(ref, queries_[1])
+        nose.tools.assert_equal(cache.hits, hits + 3)
+    finally:
+        rmtree(tmpdir)
@@ -0,0 +1,113 @@
+"""
+Test the pairwise alignments of every pair of sequences, both ways, and resuming them.
+"""
+
+from __future__ import division, print_function
+
+import os
+
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy as np
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from BioExt.align import PackedTriangle, pairwise
+from BioExt.references import hxb2, nl4_3
+from BioExt.scorematrices import BLOSUM62, DNA80
+
+import nose
+
+from .common import aligner
+
+
+def seqs():
+    # the vpr and tat of HXB2 and NL4-3, and the ends of each
+    seqs_ = []
+    for ref in (hxb2, nl4_3):
+        for gene in ('vpr', 'tat'):
+            seq = str(getattr(ref, gene).load().seq).replace('-', '')
+            seqs_.extend([seq, seq[:150], seq[-150:]])
+    return seqs_
+
+
+###############################################################################
+
+def test_packed():
+    triangle = PackedTriangle(4)
+    triangle[2, 1] = 5.0
+    triangle[3, 3] = 7.0
+    nose.tools.assert_equal(triangle[1, 2], 5.0)
+    nose.tools.assert_equal(triangle.data.shape, (10,))
+    matrix = triangle.tondarray()
+    nose.tools.assert_true((matrix == matrix.T).all())
+    nose.tools.assert_equal(matrix[3, 3], 7.0)
+    nose.tools.assert_equal(list(triangle.row(2)), list(matrix[2]))
+
+
+def test_pairwise():
+    seqs_ = seqs()
+    aln = aligner(DNA80, False)
+    scores, identities = pairwise(aln, seqs_, n_threads=2)
+    nose.tools.assert_equal(len(scores), len(seqs_))
+    for i in range(len(seqs_)):
+        nose.tools.assert_equal(identities[i, i], 1.0)
+        for j in range(i, len(seqs_)):
+            # of seqs_[j] to seqs_[i] and seqs_[i] to seqs_[j], the one which scores higher
+            score, cigar, _, edit_distance = aln.cigar(seqs_[i], seqs_[j])
+            score_, cigar_, _, edit_distance_ = aln.cigar(seqs_[j], seqs_[i])
+            if score_ > score:
+                score, cigar, edit_distance = score_, cigar_, edit_distance_
+            nose.tools.assert_equal(scores[i, j], score)
+            nose.tools.assert_equal(scores[j, i], score)
+            columns = sum(num for _, num in cigar)
+            nose.tools.assert_equal(identities[i, j], (columns - edit_distance) / columns)
+            nose.tools.assert_equal(identities[j, i], identities[i, j])
+
+
+def test_codon():
+    # with a codon aligner, any sequence whose length is not a multiple of 3
+    # fails before anything is aligned, or kept on disk
+    seqs_ = [str(hxb2.vpr.load().seq).replace('-', '')]
+    seqs_ += [seqs_[0][:-1], seqs_[0][3:], SeqRecord(Seq(seqs_[0][:-2]), id='short')]
+    aln = aligner(BLOSUM62, True)
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'pairwise.npy')
+        try:
+            pairwise(aln, seqs_, path=path)
+        except ValueError as e:
+            message = str(e)
+        else:
+            raise AssertionError('pairwise did not raise ValueError')
+        nose.tools.assert_true(message.endswith('sequences 1, 3 (short)'))
+        nose.tools.assert_equal(os.listdir(tmpdir), [])
+        scores, _ = pairwise(aln, seqs_[:1] + seqs_[2:3], path=path)
+        nose.tools.assert_equal(len(scores), 2)
+    finally:
+        rmtree(tmpdir)
+
+
+def test_resume():
+    seqs_ = seqs()
+    aln = aligner(DNA80, False)
+    expected = [triangle.data for triangle in pairwise(aln, seqs_)]
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'pairwise.npy')
+        pairwise(aln, seqs_, path=path, chunk_size=8)
+        # forget all but the first 20 entries, as if interrupted
+        entries = np.load(path, mmap_mode='r+')
+        entries['done'][20:] = False
+        entries['score'][20:] = 0
+        entries.flush()
+        del entries
+        results = [triangle.data for triangle in pairwise(aln, seqs_, path=path, chunk_size=8)]
+        for data, data_ in zip(results, expected):
+            nose.tools.assert_true((data == data_).all())
+        # a result for other sequences is not resumed
+        nose.tools.assert_raises(ValueError, pairwise, aln, seqs_[1:], path)
+    finally:
+        rmtree(tmpdir)
@@ -0,0 +1,55 @@
+"""
+Test that PreparedPanel screens queries for the references they come from.
+"""
+
+from __future__ import division, print_function
+
+from Bio.Seq import reverse_complement
+
+from BioExt.align import PreparedPanel
+from BioExt.misc import gapless
+from BioExt.references import hxb2, nl4_3
+from BioExt.scorematrices import DNA80
+
+import nose
+
+from .common import aligner
+
+
+GENES = ('gag', 'vif', 'vpr', 'env', 'nef')
+
+
+def panel():
+    aln = aligner(DNA80, False)
+    refs = [str(gapless(getattr(hxb2, gene).load()).seq) for gene in GENES]
+    return aln, aln.prepare_panel(refs)
+
+
+###############################################################################
+
+def test_screen():
+    aln, panel_ = panel()
+    nose.tools.assert_true(isinstance(panel_, PreparedPanel))
+    nose.tools.assert_equal(len(panel_), len(GENES))
+    for i, gene in enumerate(GENES):
+        query = str(getattr(nl4_3, gene).load().seq)
+        nose.tools.assert_equal(panel_.screen(query)[0], (i, 1))
+        nose.tools.assert_equal(panel_.screen(reverse_complement(query), both_strands=True)[0], (i, -1))
+        # the panel aligns the query as its reference alone would
+        nose.tools.assert_equal(aln.cigar(panel_[i], query), aln.cigar(panel_[i].seq, query))
+
+
+def test_hits():
+    _, panel_ = panel()
+    query = str(nl4_3.env.load().seq)
+    nose.tools.assert_equal(panel_.screen(query, hits=1), [(3, 1)])
+    hits = panel_.screen(query, hits=3)
+    nose.tools.assert_true(1 <= len(hits) <= 3)
+    nose.tools.assert_equal(hits[0], (3, 1))
+
+
+def test_unscreened():
+    # a query which shares no k-mer with any reference is aligned to all of them
+    _, panel_ = panel()
+    nose.tools.assert_equal(panel_.screen('ACGT' * 10), [(i, 1) for i in range(len(GENES))])
+    nose.tools.assert_equal(panel_.screen('ACGT' * 10, both_strands=True), [(i, 0) for i in range(len(GENES))])
@@ -0,0 +1,92 @@
+"""
+Test that f32 and i32-scaled alignments match the f64 ones,
+and that f32 scores are only rounded from them where the scores are not exact in a float.
+"""
+
+from __future__ import division, print_function
+
+from BioExt.align import Aligner
+from BioExt.references import hxb2, nl4_3
+from BioExt.scorematrices import BLOSUM62, DNA80
+from BioExt.scorematrices.CodonMatrix import getEmpiricalCodonMatrix
+
+import nose
+
+from .common import aligner
+
+
+GENES = ('vpr', 'tat', 'nef', 'env')
+
+
+def genes():
+    # each HXB2 gene as the reference, its NL4-3 counterpart as the query
+    for gene in GENES:
+        yield str(getattr(hxb2, gene).load().seq), str(getattr(nl4_3, gene).load().seq)
+
+
+def aligners(score_matrix, do_codon, **kwargs):
+    return dict(
+        (precision, aligner(score_matrix, do_codon, precision=precision, **kwargs))
+        for precision in ('f64', 'f32', 'i32-scaled')
+        )
+
+
+def check_parity(aligners_, precisions=('f32', 'i32-scaled')):
+    # the same scores, and the same alignments, ties broken the same way
+    f64 = aligners_['f64']
+    for ref, query in genes():
+        expected = f64(ref, query), f64.cigar(ref, query), f64.score(ref, query)
+        for precision in precisions:
+            aln = aligners_[precision]
+            nose.tools.assert_equal(
+                (aln(ref, query), aln.cigar(ref, query), aln.score(ref, query)),
+                expected
+                )
+
+
+###############################################################################
+
+def test_dna():
+    check_parity(aligners(DNA80, False))
+
+
+def test_codon():
+    check_parity(aligners(BLOSUM62, True))
+
+
+def test_banded():
+    check_parity(aligners(DNA80, False, band_width=8))
+    check_parity(aligners(BLOSUM62, True, band_width=8))
+
+
+def test_checkpoints():
+    # few enough cells to recompute the matrices from checkpoints
+    check_parity(aligners(DNA80, False, max_cells=5000))
+    check_parity(aligners(BLOSUM62, True, max_cells=5000))
+
+
+def test_fallback():
+    # 1% of the range of BLOSUM62 is not a multiple of any power of two:
+    # i32-scaled aligns as f64 does, f32 rounds the scores differently
+    check_parity(aligners(BLOSUM62, True, extendGapPenalty=1), precisions=('i32-scaled',))
+
+
+def test_rounding():
+    # the empirical codon matrix, bealign's default, is not exact in a float:
+    # the f32 scores are those of f64 up to rounding, though not all the same
+    f64 = Aligner(getEmpiricalCodonMatrix(), False, 1, do_codon=True)
+    f32 = Aligner(getEmpiricalCodonMatrix(), False, 1, do_codon=True, precision='f32')
+    exact = True
+    for ref, query in genes():
+        for method in ('score', 'cigar', '__call__'):
+            score = getattr(f64, method)(ref, query)
+            score_ = getattr(f32, method)(ref, query)
+            if method != 'score':
+                score, score_ = score[0], score_[0]
+            nose.tools.assert_true(abs(score_ - score) <= 1e-6 * abs(score))
+            exact = exact and score_ == score
+    nose.tools.assert_true(not exact)
+
+
+def test_precision():
+    nose.tools.assert_raises(ValueError, Aligner, DNA80.load(), False, 2.5, do_codon=False, precision='f16')
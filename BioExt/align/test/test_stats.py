@@ -0,0 +1,101 @@
+"""
+Test the counters Aligner collects with stats=True.
+"""
+
+from __future__ import division, print_function
+
+import json
+import pickle
+
+from io import StringIO
+
+from BioExt.align import AlignStats
+from BioExt.scorematrices import BLOSUM62, DNA80
+
+import nose
+
+from .common import aligner, pair
+
+
+###############################################################################
+
+def test_cells():
+    ref, query = pair()
+    aln = aligner(DNA80, False, stats=True)
+    _, cigar, _, _ = aln.cigar(ref, query)
+    # the traceback also steps through the deletions either side of the alignment
+    traceback = sum(num for op, num in cigar if op == 1) + len(ref)
+    stats = aln.stats
+    nose.tools.assert_equal(stats.alignments, 1)
+    nose.tools.assert_equal(stats.cells, len(ref) * len(query))
+    nose.tools.assert_equal(stats.traceback, traceback)
+    nose.tools.assert_equal(stats.frameshifts, 0)
+    # the score alone needs no traceback
+    aln.score(ref, query)
+    nose.tools.assert_equal(stats.alignments, 2)
+    nose.tools.assert_equal(stats.cells, 2 * len(ref) * len(query))
+    nose.tools.assert_equal(stats.traceback, traceback)
+
+
+def test_checkpoints():
+    # the blocks recomputed from their checkpoints count again
+    ref, query = pair()
+    aln = aligner(DNA80, False, max_cells=5000, stats=True)
+    aln.cigar(ref, query)
+    nose.tools.assert_true(aln.stats.cells > len(ref) * len(query))
+
+
+def test_resizes():
+    ref, query = pair()
+    aln = aligner(DNA80, False, stats=True)
+    aln.cigar(ref, query)
+    nose.tools.assert_equal(aln.stats.resizes, 3)
+    aln.cigar(ref, query[:-30])
+    nose.tools.assert_equal(aln.stats.resizes, 3)
+
+
+def test_release():
+    # matrices above buffer_cells are kept across alignments,
+    # and only released once the aligner is idle
+    ref, query = pair()
+    aln = aligner(DNA80, False, buffer_cells=1000, stats=True)
+    aln.cigar(ref, query)
+    aln.cigar(ref, query)
+    aln.score(ref, query)
+    nose.tools.assert_equal(aln.stats.resizes, 3)
+    aln.release_buffers()
+    aln.cigar(ref, query)
+    nose.tools.assert_equal(aln.stats.resizes, 6)
+
+
+def test_frameshifts():
+    ref, query = pair()
+    aln = aligner(BLOSUM62, True, stats=True)
+    aln.cigar(ref, query)
+    stats = aln.stats.pop()
+    # a base dropped from the middle of the query shifts its frame
+    aln.cigar(ref, query[:150] + query[151:])
+    nose.tools.assert_true(aln.stats.frameshifts > stats.frameshifts)
+
+
+def test_merge():
+    ref, query = pair()
+    aln = aligner(DNA80, False, stats=True)
+    aln.cigar(ref, query)
+    chunk = aln.stats.pop()
+    nose.tools.assert_equal(aln.stats.alignments, 0)
+    nose.tools.assert_equal(chunk.cells, len(ref) * len(query))
+    # the counters survive pickling, as they come back from the workers
+    chunk = pickle.loads(pickle.dumps(chunk))
+    total = AlignStats()
+    total.merge(chunk, worker=1)
+    total.merge(chunk, worker=2)
+    total.merge(chunk, worker=2)
+    nose.tools.assert_equal(total.cells, 3 * chunk.cells)
+    nose.tools.assert_equal(total.workers[2].alignments, 2)
+    handle = StringIO()
+    total.dump(handle)
+    stats = json.loads(handle.getvalue())
+    nose.tools.assert_equal(stats['cells'], 3 * chunk.cells)
+    nose.tools.assert_equal(stats['workers']['1']['alignments'], 1)
+    nose.tools.assert_true(str(total))
@@ -0,0 +1,85 @@
+"""
+Test that X-drop alignments are consistent, only prune, and drop the tails that do not align.
+"""
+
+from __future__ import division, print_function
+
+from random import Random
+
+from BioExt.references import hxb2, nl4_3
+from BioExt.scorematrices import BLOSUM62, DNA80
+
+import nose
+
+from .common import aligner
+
+
+def reads(junk=0):
+    # NL4-3 nef, and the ends of its env, as the queries, in HXB2 env and nef
+    # as the reference, with junk random bases after nef, where the reference ends
+    rng = Random(junk)
+    ref = str(hxb2.env.load().seq) + str(hxb2.nef.load().seq)
+    env = str(nl4_3.env.load().seq)
+    yield ref, str(nl4_3.nef.load().seq) + ''.join(rng.choice('ACGT') for _ in range(junk)), junk
+    yield ref, env[:600], 0
+    yield ref, env[-600:], 0
+
+
+def check_xdrop(score_matrix, do_codon, **kwargs):
+    full = aligner(score_matrix, do_codon)
+    xdrop = aligner(score_matrix, do_codon, x_drop=40)
+    xdrop_ = aligner(score_matrix, do_codon, x_drop=40, **kwargs)
+    for junk in (0, 200):
+        for ref, query, junk_ in reads(junk):
+            expected = xdrop.cigar(ref, query)
+            score, cigar, _, _ = expected
+            # pruning never finds a better alignment than the full one
+            nose.tools.assert_true(score <= full.cigar(ref, query)[0] + 1e-6)
+            nose.tools.assert_equal(xdrop_.cigar(ref, query), expected)
+            nose.tools.assert_equal(xdrop_.score(ref, query), score)
+            nose.tools.assert_equal(xdrop_(ref, query)[0], score)
+            # the best cell scores no less than where the full alignment
+            # of the read without the junk ends (scores are per position of the query)
+            read = query[:len(query) - junk_]
+            nose.tools.assert_true(
+                score * len(query) >= full.cigar(ref, read)[0] * len(read) - 1e-6
+                )
+            if junk_:
+                # the junk is left unaligned
+                nose.tools.assert_equal(cigar[-1][0], 1)
+                nose.tools.assert_true(cigar[-1][1] >= junk_)
+
+
+###############################################################################
+
+def test_dna():
+    check_xdrop(DNA80, False)
+
+
+def test_codon():
+    check_xdrop(BLOSUM62, True)
+
+
+def test_checkpoints():
+    check_xdrop(DNA80, False, max_cells=5000)
+    check_xdrop(BLOSUM62, True, max_cells=5000)
+
+
+def test_precision():
+    check_xdrop(DNA80, False, precision='i32-scaled')
+
+
+def test_parity():
+    # an X-drop nothing falls below prunes nothing, and changes nothing
+    for score_matrix, do_codon in ((DNA80, False), (BLOSUM62, True)):
+        full = aligner(score_matrix, do_codon)
+        xdrop = aligner(score_matrix, do_codon, x_drop=1e9)
+        for junk in (0, 200):
+            for ref, query, _ in reads(junk):
+                nose.tools.assert_equal(xdrop.cigar(ref, query), full.cigar(ref, query))
+                nose.tools.assert_equal(xdrop(ref, query), full(ref, query))
+                nose.tools.assert_equal(xdrop.score(ref, query), full.score(ref, query))
+
+
+def test_local():
+    nose.tools.assert_raises(ValueError, aligner, DNA80, False, do_local=False, x_drop=40)
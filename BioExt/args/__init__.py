@@ -5,6 +5,7 @@ from BioExt.scorematrices.CodonMatrix import getEmpiricalCodonMatrix
 
 __all__ = [
     'add_alphabet',
+    'add_panel',
     'add_reference',
     'add_scorematrix'
     ]
@@ -25,12 +26,10 @@ def add_alphabet(parser, *args):
     return parser
 
 
-def add_reference(parser, *args):
-    from argparse import ArgumentTypeError
-    from Bio import SeqIO
+def _references():
     from BioExt.references import hxb2, nl4_3
 
-    references = {
+    return {
         'HXB2_env': hxb2.env,
         'HXB2_gag': hxb2.gag,
         'HXB2_int': hxb2.int,
@@ -47,6 +46,13 @@ def add_reference(parser, *args):
         'NL4-3_prrt': nl4_3.prrt
         }
 
+
+def add_reference(parser, *args):
+    from argparse import ArgumentTypeError
+    from Bio import SeqIO
+
+    references = _references()
+
     def reference(string):
         if string in references:
             return references[string].load()
@@ -69,6 +75,48 @@ def add_reference(parser, *args):
     return parser
 
 
+def add_panel(parser, *args):
+    from argparse import ArgumentTypeError
+    from Bio import SeqIO
+    from BioExt.references import hxb2, nl4_3
+
+    references = _references()
+    panels = {
+        'HXB2': hxb2,
+        'NL4-3': nl4_3
+        }
+
+    # each REFERENCE is a list of references: every gene of a panel,
+    # a single named reference, or every sequence of a FASTA file
+    def panel(string):
+        if string in panels:
+            return [getattr(panels[string], gene).load() for gene in panels[string]._fields]
+        if string in references:
+            return [references[string].load()]
+        try:
+            with open(string) as handle:
+                refs = list(SeqIO.parse(handle, 'fasta'))
+            if not refs:
+                raise ValueError()
+            return refs
+        except:
+            msg = "'{0}' does not exist or is not a valid FASTA file".format(string)
+            raise ArgumentTypeError(msg)
+
+    kwargs = dict(
+        metavar='REFERENCE',
+        type=panel,
+        nargs='+',
+        help='align to a panel of REFERENCE FASTA files (of one or more sequences) or {{{0}}}'.format(
+            ', '.join(sorted(panels.keys()) + list(references.keys()))
+            )
+        )
+
+    parser.add_argument(*args, **kwargs)
+
+    return parser
+
+
 def add_scorematrix(parser, *args):
     import BioExt.scorematrices
     from BioExt.scorematrices import (
@@ -10,20 +10,36 @@ from pysam import sort as pysam_sort
 
 
 __all__ = [
+    'index',
     'parse',
     'write',
+    'write_alignments',
     'sort'
     ]
 
 
-def parse(path, index=True):
-    return _SamBamIO._parse('rb', path, index)
+def parse(path, index=True, lazy=False, region=None):
+    # with lazy, each read comes as a record which decodes its fields
+    # only on first use, rather than as a SeqRecord,
+    # and with region (name, start, end), only the reads which overlap it
+    return _SamBamIO._parse('rb', path, index, lazy, region)
+
+
+def index(path):
+    # index path, unless its index is current, and return whether it was
+    return _SamBamIO._index(path)
 
 
 def write(records, path, reference=None, new_style=False, header=None):
     return _SamBamIO._write('wb', records, path, reference, new_style, header)
 
 
+def write_alignments(alignments, path, reference=None, header=None, sort=False, buffer_size=None):
+    # with sort, the alignments are written sorted by coordinate as they come,
+    # spilling sorted runs of buffer_size of them to temporary BAMs to merge
+    return _SamBamIO._write_alignments('wb', alignments, path, reference, header, sort, buffer_size)
+
+
 def sort(path):
     try:
         fd, tmp_path = mkstemp()
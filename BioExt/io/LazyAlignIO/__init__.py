@@ -1,8 +1,14 @@
 
+import os
+
+from io import StringIO
 from os.path import abspath
 
+import numpy as np
+
 from Bio import Alphabet
 from Bio import SeqIO
+from Bio.Align import MultipleSeqAlignment
 
 
 __all__ = [
@@ -10,13 +16,65 @@ __all__ = [
     ]
 
 
-def read(handle, format):
-    return LazyMultipleSeqAlignment(handle, format)
+# bump this whenever the index changes
+_INDEX_VERSION = 1
+
+
+def read(handle, format, persist=False):
+    return LazyMultipleSeqAlignment(handle, format, persist=persist)
+
+
+def _stat(filename):
+    stat = os.stat(filename)
+    return np.array([_INDEX_VERSION, stat.st_size, stat.st_mtime], dtype=float)
+
+
+def _scan(filename):
+    # the byte-offset index of a FASTA file: the offset of each record (and of the end
+    # of the file), the offset of its sequence, its length, and the number of letters
+    # on each line of it and the stride of its lines (with their newline),
+    # both 0 when its lines aren't all as long as the first (but the last)
+    starts, offsets, lengths, widths, strides = [], [], [], [], []
+    uniform = last = False
+    offset = 0
+    with open(filename, 'rb') as handle:
+        for line in handle:
+            if line.startswith(b'>'):
+                if starts and not uniform:
+                    widths[-1] = strides[-1] = 0
+                starts.append(offset)
+                offsets.append(offset + len(line))
+                lengths.append(0)
+                widths.append(0)
+                strides.append(0)
+                uniform = True
+                last = False
+            elif starts:
+                letters = line.rstrip(b'\r\n')
+                lengths[-1] += len(letters.replace(b' ', b''))
+                if not letters or b' ' in letters:
+                    uniform = False
+                elif widths[-1] == 0:
+                    widths[-1] = len(letters)
+                    strides[-1] = len(line)
+                elif last or len(letters) > widths[-1] or (len(letters) == widths[-1] and len(line) != strides[-1]):
+                    uniform = False
+                last = last or len(letters) < widths[-1]
+            offset += len(line)
+    if starts and not uniform:
+        widths[-1] = strides[-1] = 0
+    starts.append(offset)
+    return [np.array(values, dtype=np.int64) for values in (starts, offsets, lengths, widths, strides)]
 
 
 class LazyMultipleSeqAlignment:
 
-    def __init__(self, handle, format, alphabet=None):
+    # the records of a FASTA file are found through a byte-offset index,
+    # built as the file is first scanned (and kept next to it, in .idx.npz, with persist),
+    # so that each is parsed on its own, and each letter of a column read on its own;
+    # the records of files of other formats are found by parsing the file up to them
+
+    def __init__(self, handle, format, alphabet=None, persist=False):
         if alphabet is not None:
             if (not isinstance(alphabet, Alphabet.Alphabet)
                     or isinstance(alphabet, Alphabet.AlphabetEncoder)):
@@ -25,6 +83,19 @@ class LazyMultipleSeqAlignment:
         else:
             self._alphabet = Alphabet.single_letter_alphabet
 
+        self._filename = abspath(handle.name)
+        self._format = format
+        self._index = None
+
+        if format.lower() == 'fasta':
+            self._index = self._load_index(persist)
+            lengths = self._index[2]
+            if len(lengths) and (lengths != lengths[0]).any():
+                raise ValueError('Sequences must all be the same length')
+            self._alignment_length = int(lengths[0]) if len(lengths) else None
+            self._length = len(lengths)
+            return
+
         length = None
         nr = 0
         for r in SeqIO.parse(handle, format):
@@ -34,11 +105,37 @@ class LazyMultipleSeqAlignment:
                 raise ValueError('Sequences must all be the same length')
             nr += 1
 
-        self._filename = abspath(handle.name)
-        self._format = format
         self._alignment_length = length
         self._length = nr
 
+    def _load_index(self, persist):
+        path = self._filename + '.idx.npz'
+        stat = _stat(self._filename)
+        if persist and os.path.exists(path):
+            try:
+                arrays = np.load(path)
+                if (arrays['stat'] == stat).all():
+                    return [arrays[name] for name in ('starts', 'offsets', 'lengths', 'widths', 'strides')]
+            except (IOError, OSError, KeyError, ValueError):
+                pass
+        index = _scan(self._filename)
+        if persist:
+            try:
+                starts, offsets, lengths, widths, strides = index
+                np.savez(
+                    path,
+                    stat=stat,
+                    starts=starts,
+                    offsets=offsets,
+                    lengths=lengths,
+                    widths=widths,
+                    strides=strides
+                    )
+            except (IOError, OSError):
+                # the index is only an optimization
+                pass
+        return index
+
     def __len__(self):
         return self._length
 
@@ -47,22 +144,80 @@ class LazyMultipleSeqAlignment:
             for record in SeqIO.parse(handle, self._format):
                 yield record
 
-    def __getitem__(self, index):
-        if isinstance(index, int):
-            N = len(self)
-            # handle negative indices
-            if index < 0 and index >= -N:
-                index = index % N
-            elif index >= N:
-                raise IndexError('index out of range')
+    def _row(self, index):
+        N = len(self)
+        # handle negative indices
+        if index < 0 and index >= -N:
+            index = index % N
+        elif index >= N or index < -N:
+            raise IndexError('index out of range')
+        return index
+
+    def _record(self, index):
+        if self._index is None:
             seq = None
             for i, seq_ in enumerate(self):
                 if i == index:
                     seq = seq_
                     break
             return seq
-        else:
-            raise ValueError('invalid index')
+        starts = self._index[0]
+        with open(self._filename, 'rb') as handle:
+            handle.seek(starts[index])
+            chunk = handle.read(starts[index + 1] - starts[index])
+        return next(SeqIO.parse(StringIO(chunk.decode('utf-8')), self._format))
+
+    def _letter(self, handle, index, column):
+        # the letter at column of the record at index, read straight from handle
+        # when its lines are uniform, or from the record otherwise
+        _, offsets, _, widths, strides = self._index
+        width = widths[index]
+        if not width:
+            return str(self._record(index).seq[column])
+        handle.seek(offsets[index] + (column // width) * strides[index] + column % width)
+        return handle.read(1).decode('utf-8')
+
+    def _column(self, rows, column):
+        N = self.get_alignment_length() or 0
+        # handle negative indices
+        if column < 0 and column >= -N:
+            column = column % N
+        elif column >= N or column < -N:
+            raise IndexError('index out of range')
+        if self._index is None:
+            return ''.join(str(record.seq[column]) for record in self._records(rows))
+        with open(self._filename, 'rb') as handle:
+            return ''.join(self._letter(handle, i, column) for i in rows)
+
+    def _records(self, rows):
+        # the records of rows, in order, parsing the file just once without the index
+        if self._index is None:
+            records = dict((i, record) for i, record in enumerate(self) if i in rows)
+            return [records[i] for i in rows]
+        return [self._record(i) for i in rows]
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return self._record(self._row(index))
+        elif isinstance(index, slice):
+            return MultipleSeqAlignment(self._records(range(*index.indices(len(self)))), self._alphabet)
+        elif isinstance(index, tuple) and len(index) == 2:
+            rows, column = index
+            if isinstance(rows, int) and isinstance(column, slice):
+                return self._record(self._row(rows))[column]
+            elif isinstance(rows, int) and isinstance(column, int):
+                return self._column((self._row(rows),), column)
+            elif isinstance(rows, slice) and isinstance(column, int):
+                return self._column(range(*rows.indices(len(self))), column)
+            elif isinstance(rows, slice) and isinstance(column, slice):
+                return MultipleSeqAlignment(
+                    [record[column] for record in self._records(range(*rows.indices(len(self))))],
+                    self._alphabet
+                    )
+        raise ValueError('invalid index')
+
+    def get_column(self, column):
+        return self._column(range(len(self)), column)
 
     def get_alignment_length(self):
         return self._alignment_length
@@ -10,8 +10,8 @@ __all__ = [
     ]
 
 
-def parse(path):
-    return _SamBamIO._parse('r', path)
+def parse(path, lazy=False):
+    return _SamBamIO._parse('r', path, lazy=lazy)
 
 
 def write(records, path, reference=None, new_style=False, header=None):
@@ -1,8 +1,13 @@
 
 from __future__ import division, print_function
 
+import os
+
 from hashlib import md5
+from heapq import merge
 from re import compile as re_compile
+from shutil import rmtree
+from tempfile import mkdtemp
 
 from Bio.Align import MultipleSeqAlignment
 from Bio.Alphabet import single_letter_alphabet
@@ -11,12 +16,17 @@ from Bio.SeqRecord import SeqRecord
 
 from BioExt.misc import compute_cigar
 
+import numpy as np
 import pysam
 
 
 _VALID_CHARS = re_compile(r'[^A-Z]')
 _CIGAR_MODES = 'MIDNSHP=X'
 
+# a sorted write keeps at most _SORT_BUFFER alignments in memory,
+# and spills each run of that many to a temporary BAM
+_SORT_BUFFER = 2 ** 18
+
 
 def _from_cigarstring(cigarstr):
     regexp = re_compile(r'([0-9]+)([M=XID])')
@@ -73,7 +83,126 @@ def _to_seqrecord(samfile, read):
     return record
 
 
-def _find_tid(header, name):
+class _LazyRecord(object):
+    # a read as _to_seqrecord would have it, which wraps the read instead
+    # and decodes each field only on first use: position, cigar (a list of
+    # (operation, length) pairs), sequence (a str) and qualities (the phred
+    # qualities, a numpy array, or None) cost next to nothing,
+    # while seq, annotations and letter_annotations are built as a SeqRecord's
+    # would be, to go wherever one would, say to BamIO.write.
+    # gapful and clip read position, cigar and sequence, and build neither.
+    # references are the names of the @SQs of the file of the read, by tid
+    __slots__ = (
+        '__read',
+        '__references',
+        '__sequence',
+        '__seq',
+        '__annotations',
+        '__letter_annotations',
+        'dbxrefs',
+        )
+
+    def __init__(self, read, references):
+        self.__read = read
+        self.__references = references
+        self.__sequence = None
+        self.__seq = None
+        self.__annotations = None
+        self.__letter_annotations = None
+        self.dbxrefs = []
+
+    @property
+    def read(self):
+        return self.__read
+
+    @property
+    def id(self):
+        return self.__read.qname
+
+    name = id
+    description = id
+
+    @property
+    def reference_name(self):
+        tid = self.__read.tid
+        return self.__references[tid] if 0 <= tid < len(self.__references) else None
+
+    @property
+    def position(self):
+        # once built, the annotations may have been changed
+        if self.__annotations is not None:
+            return self.__annotations['position']
+        return self.__read.pos
+
+    @property
+    def cigar(self):
+        if self.__annotations is not None:
+            return _from_cigarstring(self.__annotations['CIGAR'])
+        return self.__read.cigar
+
+    @property
+    def sequence(self):
+        if self.__seq is not None:
+            return str(self.__seq)
+        if self.__sequence is None:
+            seq = self.__read.seq
+            self.__sequence = seq.decode('ascii') if isinstance(seq, bytes) else seq
+        return self.__sequence
+
+    @property
+    def qualities(self):
+        qual = self.__read.qual
+        if not qual:
+            return None
+        if not isinstance(qual, bytes):
+            qual = qual.encode('ascii')
+        return np.frombuffer(qual, dtype=np.uint8) - 33
+
+    @property
+    def seq(self):
+        if self.__seq is None:
+            self.__seq = Seq(self.sequence, single_letter_alphabet)
+        return self.__seq
+
+    @seq.setter
+    def seq(self, seq):
+        self.__seq = seq
+
+    @property
+    def annotations(self):
+        if self.__annotations is None:
+            read = self.__read
+            self.__annotations = {
+                'sam_flag': read.flag,
+                'reference_name': self.reference_name,
+                'position': read.pos,
+                'mapping_quality': read.mapq,
+                'CIGAR': _to_cigarstring(read.cigar),
+                'reference_next': read.rnext,
+                'position_next': read.pnext,
+                'template_length': read.tlen
+                }
+        return self.__annotations
+
+    @property
+    def letter_annotations(self):
+        if self.__letter_annotations is None:
+            qualities = self.qualities
+            self.__letter_annotations = {} if qualities is None else {'phred_quality': qualities}
+        return self.__letter_annotations
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __str__(self):
+        return self.sequence
+
+
+def _find_tid(header, name, tids=None):
+
+    # tids, if given, maps the name of each @SQ of header to its tid
+    if tids is not None:
+        return tids.get(name, -1)
 
     try:
         tid = next(
@@ -87,12 +216,13 @@ def _find_tid(header, name):
     return tid
 
 
-def _from_seqrecord(header, record):
+def _from_seqrecord(header, record, tids=None):
 
     qname = record.name
     tid = _find_tid(
         header,
-        record.annotations.get('reference_name', '*')
+        record.annotations.get('reference_name', '*'),
+        tids
         )
     seq = _VALID_CHARS.sub('', str(record.seq).upper()).encode('ascii')
     cigar = _from_cigarstring(record.annotations['CIGAR'])
@@ -101,7 +231,8 @@ def _from_seqrecord(header, record):
     mapq = record.annotations.get('mapping_quality', 255)
     rnext = _find_tid(
         header,
-        record.annotations.get('reference_next', '*')
+        record.annotations.get('reference_next', '*'),
+        tids
         )
     pnext = record.annotations.get('position_next', -1)
     tlen = record.annotations.get('template_length', 0)
@@ -133,39 +264,132 @@ def _from_seqrecord(header, record):
     return read
 
 
-def _parse(mode, path, index=True):
+def _from_alignment(alignment):
+
+    # alignment is (qname, tid, pos, cigar, seq, edit_distance), as the aligner has it:
+    # cigar a list of (operation, length) pairs and seq the uppercase bytes of the query
+    qname, tid, pos, cigar, seq, edit_distance = alignment
+
+    read = pysam.AlignedRead()
+
+    read.qname = qname
+    read.tid = tid
+    read.pos = pos
+    read.seq = seq
+    read.cigar = cigar
+    read.flag = 0
+    read.mapq = 255
+    read.rnext = -1
+    read.pnext = -1
+    read.tlen = 0
+    read.tags = [('NM', edit_distance)]
+
+    return read
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return '{0:d} {1!r}\n'.format(stat.st_size, stat.st_mtime)
+
+
+def _index(path):
+    # index the BAM at path, unless its index is current: the size and mtime
+    # of the BAM the index was built for are kept next to it, in the .bai.stat
+    key = path + '.bai.stat'
+    stat = _stat(path)
+    try:
+        if os.path.exists(path + '.bai'):
+            with open(key) as handle:
+                if handle.read() == stat:
+                    return False
+    except (IOError, OSError):
+        pass
+
+    pysam.index(path)
+
+    try:
+        with open(key, 'w') as handle:
+            handle.write(stat)
+    except (IOError, OSError):
+        # the index is only rebuilt the next time
+        pass
+
+    return True
+
+
+def _parse(mode, path, index=True, lazy=False, region=None):
+    # region, if given, is (name, start, end): only the reads which overlap
+    # start to end (0-based, half-open, either None for the end of the reference)
+    # of the reference name are fetched, from the index
+    samfile = None
     try:
         # make sure the index is up to date
         if 'b' in mode and index:
-            pysam.index(path)
+            _index(path)
 
         samfile = pysam.Samfile(path, mode)
 
-        for read in samfile.fetch():
-            yield _to_seqrecord(samfile, read)
+        reads = samfile.fetch(*region) if region is not None else samfile.fetch()
+
+        if lazy:
+            references = samfile.references
+            for read in reads:
+                yield _LazyRecord(read, references)
+        else:
+            for read in reads:
+                yield _to_seqrecord(samfile, read)
     finally:
         if samfile is not None:
             samfile.close()
 
 
+def _sq(reference):
+    hasher = md5()
+    hasher.update(
+        _VALID_CHARS.sub('', str(reference.seq).upper()).encode('ascii')
+        )
+    return {
+        'SN': reference.name,
+        'LN': len(reference),
+        'M5': hasher.hexdigest()
+        }
+
+
+def _references(reference):
+    # the references of the @SQs, and the reference if there is only one
+    if isinstance(reference, (list, tuple)):
+        references = list(reference)
+        reference = references[0] if len(references) == 1 else None
+    elif reference is not None:
+        references = [reference]
+    else:
+        references = []
+    return references, reference
+
+
+def _header(references):
+    header = {
+        'HD': {'VN': '1.4', 'SO': 'unknown'},
+        }
+    if references:
+        header['SQ'] = [_sq(ref) for ref in references]
+    return header
+
+
 def _write(mode, records, path, reference, new_style, header):
+    # reference may also be a list of references (a panel),
+    # each record then goes to the @SQ of its reference_name
+    samfile = None
     try:
         count = 0
 
+        references, reference = _references(reference)
+
         if header is None:
-            header = {
-                'HD': {'VN': '1.4', 'SO': 'unknown'},
-                }
-            if reference is not None:
-                hasher = md5()
-                hasher.update(
-                    _VALID_CHARS.sub('', str(reference.seq).upper()).encode('ascii')
-                    )
-                header['SQ'] = [{
-                    'SN': reference.name,
-                    'LN': len(reference),
-                    'M5': hasher.hexdigest()
-                    }]
+            header = _header(references)
+
+        # look the tid of each record up by name, rather than search the @SQs
+        tids = dict((sq['SN'], tid) for tid, sq in enumerate(header.get('SQ', ())))
 
         samfile = pysam.Samfile(path, mode, header=header)
 
@@ -181,9 +405,101 @@ def _write(mode, records, path, reference, new_style, header):
                     raise RuntimeError(msg)
 
         for record in iterate(records):
-            if samfile.write(_from_seqrecord(header, record)):
+            if samfile.write(_from_seqrecord(header, record, tids)):
                 count += 1
+    finally:
+        if samfile is not None:
+            samfile.close()
+
+    return count
+
+
+def _sort_key(tid, pos):
+    # by reference, then position, with the unmapped last
+    return (tid < 0, tid, pos)
+
+
+def _spill(run, path, header):
+    # write the sorted run of alignments to a temporary BAM at path, uncompressed
+    samfile = pysam.Samfile(path, 'wbu', header=header)
+    try:
+        for _, _, alignment in run:
+            samfile.write(_from_alignment(alignment))
+    finally:
+        samfile.close()
+
+
+def _unspill(path, i):
+    # the reads of the ith run, each with its key, i and its place in the run,
+    # so that reads at the same position come out in the order they went in
+    samfile = pysam.Samfile(path, 'rb', check_sq=False)
+    try:
+        for j, read in enumerate(samfile.fetch(until_eof=True)):
+            yield _sort_key(read.tid, read.pos), i, j, read
     finally:
         samfile.close()
 
+
+def _sorted(alignments, path, header, buffer_size):
+    # the reads of alignments sorted by _sort_key, keeping at most buffer_size
+    # of them in memory: each sorted run of that many is spilled to a temporary BAM
+    # next to path, and the runs are merged as the reads are written
+    tmpdir = None
+    try:
+        runs = []
+        run = []
+        for n, alignment in enumerate(alignments):
+            _, tid, pos, _, _, _ = alignment
+            run.append((_sort_key(tid, pos), n, alignment))
+            if len(run) >= buffer_size:
+                if tmpdir is None:
+                    tmpdir = mkdtemp(prefix='sort', dir=os.path.dirname(os.path.abspath(path)))
+                run.sort()
+                runs.append(os.path.join(tmpdir, '{0:d}.bam'.format(len(runs))))
+                _spill(run, runs[-1], header)
+                run = []
+        run.sort()
+        last = (
+            (key, len(runs), j, _from_alignment(alignment))
+            for j, (key, _, alignment) in enumerate(run)
+            )
+        for _, _, _, read in merge(*([_unspill(run_, i) for i, run_ in enumerate(runs)] + [last])):
+            yield read
+    finally:
+        if tmpdir is not None:
+            rmtree(tmpdir)
+
+
+def _write_alignments(mode, alignments, path, reference, header, sort=False, buffer_size=None):
+    # alignments are the tuples _from_alignment takes, their tids those
+    # of the @SQs of reference (or of its references, in order) or of header.
+    # with sort, they are written sorted by coordinate in the same pass,
+    # keeping at most buffer_size of them in memory at once
+    samfile = None
+    reads = None
+    try:
+        count = 0
+
+        if header is None:
+            header = _header(_references(reference)[0])
+
+        if sort:
+            header = dict(header)
+            header['HD'] = dict(header.get('HD', {'VN': '1.4'}), SO='coordinate')
+            reads = _sorted(alignments, path, header, buffer_size or _SORT_BUFFER)
+        else:
+            reads = (_from_alignment(alignment) for alignment in alignments)
+
+        samfile = pysam.Samfile(path, mode, header=header)
+
+        for read in reads:
+            if samfile.write(read):
+                count += 1
+    finally:
+        # the temporary BAMs of a sort go as soon as it is done
+        if reads is not None:
+            reads.close()
+        if samfile is not None:
+            samfile.close()
+
     return count
@@ -0,0 +1,230 @@
+"""
+Test writing alignments straight to BAM, sorted or not, and parsing them lazily.
+"""
+
+from __future__ import division, print_function
+
+import os
+import random
+
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from BioExt.align import Aligner
+from BioExt.io import BamIO
+from BioExt.io._SamBamIO import _LazyRecord
+from BioExt.misc import clip, gapful
+from BioExt.references import hxb2
+from BioExt.scorematrices import DNA80
+
+import numpy as np
+import pysam
+
+import nose
+
+
+def alignments():
+    # pieces of HXB2 env, with a deletion and an insertion, aligned to it,
+    # both as the tuples of write_alignments and as annotated SeqRecords
+    ref = hxb2.env.load()
+    seq = str(ref.seq).replace('-', '')
+    aln = Aligner(DNA80.load(), False, 2.5, do_codon=False)
+    queries = [
+        seq[100:400],
+        seq[500:600] + seq[603:800],
+        seq[900:1000] + 'ACG' + seq[1000:1200]
+        ]
+    tuples, records = [], []
+    for i, query in enumerate(queries):
+        _, cigar, position, edit_distance = aln.cigar(seq, query)
+        name = 'read{0:d}'.format(i)
+        tuples.append((name, 0, position, cigar, query.encode('ascii'), edit_distance))
+        record = SeqRecord(Seq(query), id=name, name=name, description=name)
+        record.annotations['CIGAR'] = ''.join('{0:d}{1:s}'.format(num, 'MID'[op]) for op, num in cigar)
+        record.annotations['position'] = position
+        record.annotations['edit_distance'] = edit_distance
+        record.annotations['reference_name'] = ref.name
+        records.append(record)
+    return ref, tuples, records
+
+
+class StrictRecord(_LazyRecord):
+    # a lazy record which fails if its annotations or its Seq are ever built
+    __slots__ = ()
+
+    @property
+    def annotations(self):
+        raise AssertionError('the annotations of a lazy record were built')
+
+    @property
+    def seq(self):
+        raise AssertionError('the Seq of a lazy record was built')
+
+
+def reads(path):
+    samfile = pysam.Samfile(path, 'rb')
+    try:
+        return str(samfile.header), [read.tostring() for read in samfile.fetch(until_eof=True)]
+    finally:
+        samfile.close()
+
+
+###############################################################################
+
+def test_write_alignments():
+    ref, tuples, records = alignments()
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'tuples.bam')
+        path_ = os.path.join(tmpdir, 'records.bam')
+        nose.tools.assert_equal(BamIO.write_alignments(tuples, path, ref), len(tuples))
+        BamIO.write(records, path_, ref)
+        # the same BAM as from the SeqRecords
+        nose.tools.assert_equal(reads(path), reads(path_))
+    finally:
+        rmtree(tmpdir)
+
+
+def test_lazy():
+    ref, tuples, records = alignments()
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'tuples.bam')
+        BamIO.write_alignments(tuples, path, ref)
+        records_ = list(BamIO.parse(path, lazy=True))
+        nose.tools.assert_equal(len(records_), len(records))
+        for record, record_, (_, _, position, cigar, seq, _) in zip(records, records_, tuples):
+            nose.tools.assert_equal(record_.name, record.name)
+            nose.tools.assert_equal(record_.reference_name, ref.name)
+            nose.tools.assert_equal(record_.position, position)
+            nose.tools.assert_equal([tuple(op) for op in record_.cigar], cigar)
+            nose.tools.assert_equal(record_.sequence, seq.decode('ascii'))
+            nose.tools.assert_equal(len(record_), len(seq))
+            nose.tools.assert_true(record_.qualities is None)
+            # the annotations are those of a SeqRecord, and changes to them stick
+            nose.tools.assert_equal(record_.annotations['CIGAR'], record.annotations['CIGAR'])
+            record_.annotations['position'] += 1
+            nose.tools.assert_equal(record_.position, position + 1)
+    finally:
+        rmtree(tmpdir)
+
+
+def test_gapful_clip():
+    # gapful and clip take lazy records as they do SeqRecords, building neither
+    ref, tuples, records = alignments()
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'tuples.bam')
+        BamIO.write_alignments(tuples, path, ref)
+        samfile = pysam.Samfile(path, 'rb')
+        try:
+            records_ = [StrictRecord(read, samfile.references) for read in samfile.fetch(until_eof=True)]
+        finally:
+            samfile.close()
+        for record, record_ in zip(records, records_):
+            for insertions in (True, False):
+                expected = gapful(record, insertions=insertions)
+                nose.tools.assert_equal(str(gapful(record_, insertions=insertions).seq), str(expected.seq))
+            for start, end, span in ((0, 1200, False), (450, 550, False), (150, 350, True), (0, 1200, True)):
+                expected = clip(record, start, end, span=span)
+                clipped = clip(record_, start, end, span=span)
+                if expected is None:
+                    nose.tools.assert_true(clipped is None)
+                    continue
+                nose.tools.assert_equal(str(clipped.seq), str(expected.seq))
+                for annotation in ('CIGAR', 'position', 'reference_name'):
+                    nose.tools.assert_equal(clipped.annotations[annotation], expected.annotations[annotation])
+    finally:
+        rmtree(tmpdir)
+
+
+def test_qualities():
+    ref, tuples, _ = alignments()
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'qualities.bam')
+        BamIO.write_alignments(tuples[:1], path, ref)
+        samfile = pysam.Samfile(path, 'rb')
+        try:
+            read = next(samfile.fetch(until_eof=True))
+        finally:
+            samfile.close()
+        qual = ('I5+' * len(tuples[0][4]))[:len(tuples[0][4])]
+        read.qual = qual
+        record = _LazyRecord(read, (ref.name,))
+        qualities = record.qualities
+        nose.tools.assert_true(isinstance(qualities, np.ndarray))
+        # as _to_seqrecord decodes them
+        nose.tools.assert_equal(list(qualities), [ord(q) - 33 for q in qual])
+        nose.tools.assert_true(record.letter_annotations['phred_quality'] is not None)
+    finally:
+        rmtree(tmpdir)
+
+
+def test_index():
+    ref, tuples, _ = alignments()
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'tuples.bam')
+        BamIO.write_alignments(tuples, path, ref)
+        nose.tools.assert_true(BamIO.index(path))
+        # a current index is kept
+        nose.tools.assert_true(not BamIO.index(path))
+        list(BamIO.parse(path, lazy=True))
+        nose.tools.assert_true(not BamIO.index(path))
+        # and a stale one rebuilt
+        BamIO.write_alignments(tuples[:2], path, ref)
+        nose.tools.assert_true(BamIO.index(path))
+        nose.tools.assert_equal(len(list(BamIO.parse(path, lazy=True))), 2)
+    finally:
+        rmtree(tmpdir)
+
+
+def test_region():
+    ref, tuples, _ = alignments()
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'tuples.bam')
+        BamIO.write_alignments(tuples, path, ref)
+        for start, end in ((0, 450), (450, 650), (550, 950), (1150, None)):
+            expected = [
+                name for name, _, position, cigar, _, _ in tuples
+                if position < (end if end is not None else len(ref)) and
+                position + sum(num for op, num in cigar if op != 1) > start
+                ]
+            records = BamIO.parse(path, lazy=True, region=(ref.name, start, end))
+            nose.tools.assert_equal([record.name for record in records], expected)
+    finally:
+        rmtree(tmpdir)
+
+
+def test_sorted():
+    ref, _, _ = alignments()
+    rng = random.Random(1)
+    # reads at random positions, several at each, in no order
+    tuples = []
+    for i in range(200):
+        pos = rng.randrange(0, 100)
+        seq = ''.join(rng.choice('ACGT') for _ in range(30))
+        tuples.append(('read{0:d}'.format(i), 0, pos, [(0, 30)], seq.encode('ascii'), 0))
+    # sorted by position, and otherwise in the order they came
+    expected = [name for _, name in sorted((pos, i) for i, (_, _, pos, _, _, _) in enumerate(tuples))]
+    expected = ['read{0:d}'.format(i) for i in expected]
+    tmpdir = mkdtemp()
+    try:
+        for buffer_size in (16, 1000):
+            path = os.path.join(tmpdir, 'sorted.bam')
+            nose.tools.assert_equal(
+                BamIO.write_alignments(tuples, path, ref, sort=True, buffer_size=buffer_size),
+                len(tuples)
+                )
+            header, reads_ = reads(path)
+            nose.tools.assert_true('SO:coordinate' in header)
+            nose.tools.assert_equal([read.split('\t')[0] for read in reads_], expected)
+            # the runs spilled are gone
+            nose.tools.assert_equal(os.listdir(tmpdir), ['sorted.bam'])
+    finally:
+        rmtree(tmpdir)
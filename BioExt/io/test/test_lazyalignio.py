@@ -0,0 +1,97 @@
+"""
+Test the random access of LazyAlignIO through its byte-offset index.
+"""
+
+from __future__ import division, print_function
+
+import os
+
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from Bio import SeqIO
+
+from BioExt.io import LazyAlignIO
+from BioExt.references import hxb2
+
+import nose
+
+
+def msa(path, width=60):
+    # windows of HXB2 env as an MSA, wrapped at width, but for one record
+    # on a single line and another wrapped unevenly, which aren't read by line
+    seq = str(hxb2.env.load().seq).replace('-', '')
+    with open(path, 'w') as handle:
+        for i in range(12):
+            row = seq[i * 10:i * 10 + 150]
+            handle.write('>seq{0:d}\n'.format(i))
+            if i == 3:
+                handle.write(row + '\n')
+            elif i == 7:
+                handle.write(row[:20] + '\n' + row[20:] + '\n')
+            else:
+                handle.write(''.join(row[j:j + width] + '\n' for j in range(0, len(row), width)))
+    with open(path) as handle:
+        return list(SeqIO.parse(handle, 'fasta'))
+
+
+###############################################################################
+
+def test_getitem():
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'msa.fa')
+        records = msa(path)
+        with open(path) as handle:
+            aln = LazyAlignIO.read(handle, 'fasta')
+        nose.tools.assert_equal(len(aln), len(records))
+        nose.tools.assert_equal(aln.get_alignment_length(), 150)
+        for i in (0, 3, 7, 11, -1, -12):
+            nose.tools.assert_equal(aln[i].id, records[i].id)
+            nose.tools.assert_equal(str(aln[i].seq), str(records[i].seq))
+        nose.tools.assert_raises(IndexError, lambda: aln[12])
+        nose.tools.assert_raises(IndexError, lambda: aln[-13])
+        nose.tools.assert_equal([record.id for record in aln[2:9:3]], [record.id for record in records[2:9:3]])
+        nose.tools.assert_equal([record.id for record in aln[::-4]], [record.id for record in records[::-4]])
+        nose.tools.assert_equal(str(aln[5, 10:20].seq), str(records[5].seq[10:20]))
+    finally:
+        rmtree(tmpdir)
+
+
+def test_columns():
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'msa.fa')
+        records = msa(path)
+        with open(path) as handle:
+            aln = LazyAlignIO.read(handle, 'fasta')
+        for column in (0, 59, 60, 61, 119, 120, 149, -1):
+            expected = ''.join(str(record.seq[column]) for record in records)
+            nose.tools.assert_equal(aln.get_column(column), expected)
+            nose.tools.assert_equal(aln[:, column], expected)
+            nose.tools.assert_equal(aln[1:10:2, column], expected[1:10:2])
+        nose.tools.assert_equal(aln[7, 25], str(records[7].seq[25]))
+        nose.tools.assert_raises(IndexError, aln.get_column, 150)
+    finally:
+        rmtree(tmpdir)
+
+
+def test_persist():
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'msa.fa')
+        records = msa(path)
+        with open(path) as handle:
+            LazyAlignIO.read(handle, 'fasta', persist=True)
+        nose.tools.assert_true(os.path.exists(path + '.idx.npz'))
+        with open(path) as handle:
+            aln = LazyAlignIO.read(handle, 'fasta', persist=True)
+        nose.tools.assert_equal(aln.get_column(100), ''.join(str(record.seq[100]) for record in records))
+        # as long again, but wrapped otherwise: a stale index is built again
+        records = msa(path, width=50)
+        os.utime(path, (0, 0))
+        with open(path) as handle:
+            aln = LazyAlignIO.read(handle, 'fasta', persist=True)
+        nose.tools.assert_equal(aln.get_column(100), ''.join(str(record.seq[100]) for record in records))
+    finally:
+        rmtree(tmpdir)
@@ -17,6 +17,10 @@ try:
     import cPickle as pickle
 except:
     import pickle
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 # Obtain possible configuration from the environment, assuming 1 (on)
 # by default, upon 0 set to None. Should instructively fail if some non
@@ -151,6 +155,10 @@ class CallBack(object):
         self.parallel.print_progress(self.index)
         if self.parallel._iterable:
             self.parallel.dispatch_next()
+        # only once the next job is dispatched, so that a retrieval
+        # that empties the running jobs really is the last
+        if self.parallel._done is not None:
+            self.parallel._done.put(self.index)
 
 
 ###############################################################################
@@ -174,6 +182,16 @@ class Parallel(Logger):
             The amount of jobs to be pre-dispatched. Default is 'all',
             but it may be memory consuming, for instance if each job
             involves a lot of a data.
+        ordered: boolean, optional
+            If True (the default), the results are returned in the order
+            of the jobs. Otherwise, when computing in parallel, each result
+            is returned as soon as its job is done.
+        reorder_buffer: integer, optional
+            When the results are ordered, at most reorder_buffer jobs
+            (beyond those pre-dispatched) are dispatched ahead of the
+            oldest job still running, whose results are held until it is
+            done. Default is None, which dispatches a new job whenever
+            one is done, however far ahead of the oldest one.
 
         Notes
         -----
@@ -291,10 +309,13 @@ class Parallel(Logger):
          [Parallel(n_jobs=2)]: Done   5 out of   6 | elapsed:    0.0s remaining:    0.0s
          [Parallel(n_jobs=2)]: Done   6 out of   6 | elapsed:    0.0s finished
     '''
-    def __init__(self, n_jobs=1, verbose=0, pre_dispatch='all', initializer=None, initargs=[]):
+    def __init__(self, n_jobs=1, verbose=0, pre_dispatch='all', initializer=None, initargs=[],
+                 ordered=True, reorder_buffer=None):
         self.verbose = verbose
         self.n_jobs = n_jobs
         self.pre_dispatch = pre_dispatch
+        self.ordered = ordered
+        self.reorder_buffer = reorder_buffer
         self._pool = None
         self._initializer = initializer
         self._initargs = initargs
@@ -305,6 +326,12 @@ class Parallel(Logger):
         # A flag used to abort the dispatching of jobs in case an
         # exception is found
         self._aborting = False
+        # The indices of the jobs done, when the results are unordered
+        self._done = None
+        # The number of results retrieved, and of jobs held back
+        # because the reorder buffer is full
+        self._n_retrieved = 0
+        self._n_held = 0
 
     def dispatch(self, func, args, kwargs):
         """ Queue the function for computing, with or without multiprocessing
@@ -327,7 +354,10 @@ class Parallel(Logger):
                 self._lock.acquire()
                 job = self._pool.apply_async(SafeFunction(func), args,
                             kwargs, callback=CallBack(self.n_dispatched, self))
-                self._jobs.append(job)
+                if self._done is None:
+                    self._jobs.append(job)
+                else:
+                    self._jobs[self.n_dispatched] = job
                 self.n_dispatched += 1
             except AssertionError:
                 print('[Parallel] Pool seems closed')
@@ -337,6 +367,17 @@ class Parallel(Logger):
     def dispatch_next(self):
         """ Dispatch more data for parallel processing
         """
+        if self.reorder_buffer is not None and self._done is None:
+            self._lock.acquire()
+            try:
+                if (self.n_dispatched - self._n_retrieved >=
+                        self._pre_dispatch_amount + self.reorder_buffer):
+                    # The reorder buffer is full: hold this dispatch back
+                    # until the oldest job is retrieved
+                    self._n_held += 1
+                    return
+            finally:
+                self._lock.release()
         self._dispatch_amount += 1
         while self._dispatch_amount:
             try:
@@ -406,15 +447,57 @@ class Parallel(Logger):
                          short_format_time(remaining_time),
                         ))
 
+    def _next_done(self):
+        """ When the results are unordered, the next job done, or None
+            if none is done yet
+        """
+        try:
+            index = self._done.get(timeout=0.1)
+        except queue.Empty:
+            # Jobs that fail never call back, so look for them
+            self._lock.acquire()
+            try:
+                for index, job in self._jobs.items():
+                    if job.ready() and not job.successful():
+                        return self._jobs.pop(index)
+            finally:
+                self._lock.release()
+            return None
+        self._lock.acquire()
+        try:
+            return self._jobs.pop(index)
+        finally:
+            self._lock.release()
+
+    def _retrieved(self):
+        """ Dispatch the jobs held back while the reorder buffer was full
+        """
+        if self.reorder_buffer is None or self._pool is None:
+            return
+        self._lock.acquire()
+        try:
+            self._n_retrieved += 1
+            n_held, self._n_held = self._n_held, 0
+        finally:
+            self._lock.release()
+        for _ in range(n_held):
+            if self._iterable:
+                self.dispatch_next()
+
     def _retrieve(self):
         while self._jobs:
             # We need to be careful: the job queue can be filling up as
             # we empty it
-            if hasattr(self, '_lock'):
-                self._lock.acquire()
-            job = self._jobs.pop(0)
-            if hasattr(self, '_lock'):
-                self._lock.release()
+            if self._done is not None:
+                job = self._next_done()
+                if job is None:
+                    continue
+            else:
+                if hasattr(self, '_lock'):
+                    self._lock.acquire()
+                job = self._jobs.pop(0)
+                if hasattr(self, '_lock'):
+                    self._lock.release()
             try:
                 yield job.get()
             except tuple(self.exceptions) as exception:
@@ -451,6 +534,7 @@ class Parallel(Logger):
                     raise exception
                 finally:
                     self._lock.release()
+            self._retrieved()
 
     def retrieve(self):
         self._output = list(self._retrieve())
@@ -499,6 +583,9 @@ class Parallel(Logger):
             # We are using multiprocessing, we also want to capture
             # KeyboardInterrupts
             self.exceptions.extend([KeyboardInterrupt, WorkerInterrupt])
+            if not self.ordered:
+                self._jobs = dict()
+                self._done = queue.Queue()
 
         pre_dispatch = self.pre_dispatch
         if isinstance(iterable, list):
@@ -518,6 +605,8 @@ class Parallel(Logger):
 
         self._start_time = time.time()
         self.n_dispatched = 0
+        self._n_retrieved = 0
+        self._n_held = 0
         try:
             for function, args, kwargs in iterable:
                 self.dispatch(function, args, kwargs)
@@ -540,6 +629,7 @@ class Parallel(Logger):
                 self._pool.join()
                 os.environ.pop('__JOBLIB_SPAWNED_PARALLEL__', 0)
             self._jobs = list()
+            self._done = None
 
     def __call__(self, iterable):
         self._output = None  # preserve prior semantics
@@ -237,6 +237,70 @@ def test_exception_dispatch():
             )
 
 
+def slow_consumer(queue, item):
+    if item == 0:
+        time.sleep(.5)
+    queue.append('Consumed %s' % item)
+    return item
+
+
+def waiting_consumer(queue, event, item, last):
+    # the first job waits for the last one, which one worker only gets to
+    # once it is done with all the others, while the first holds the other
+    if item == 0:
+        event.wait(60)
+    elif item == last:
+        event.set()
+    queue.append('Consumed %s' % item)
+    return item
+
+
+def test_unordered():
+    """ Check that unordered results come back as their jobs are done,
+        and that their exceptions are still captured.
+    """
+    if multiprocessing is None:
+        return
+    manager = multiprocessing.Manager()
+    queue = manager.list()
+    event = manager.Event()
+    out = Parallel(n_jobs=2, pre_dispatch=4, ordered=False)(
+            delayed(waiting_consumer)(queue, event, i, 7) for i in range(8))
+    nose.tools.assert_equal(sorted(out), list(range(8)))
+    nose.tools.assert_true(event.is_set())
+    nose.tools.assert_true(0 in out[-2:])
+    nose.tools.assert_raises(
+            ValueError,
+            Parallel(n_jobs=2, pre_dispatch=4, ordered=False),
+                    (delayed(exception_raiser)(i) for i in range(30)),
+            )
+
+
+def test_reorder_buffer():
+    """ Check that no more than pre_dispatch + reorder_buffer jobs are
+        dispatched while the oldest one is running, and that the results
+        stay in order.
+    """
+    if multiprocessing is None:
+        return
+    manager = multiprocessing.Manager()
+    queue = manager.list()
+
+    def producer():
+        for i in range(12):
+            queue.append('Produced %i' % i)
+            yield i
+
+    out = Parallel(n_jobs=2, pre_dispatch=2, reorder_buffer=2)(
+            delayed(slow_consumer)(queue, i) for i in producer())
+    nose.tools.assert_equal(out, list(range(12)))
+    queue = list(queue)
+    produced = [item for item in queue[:queue.index('Consumed 0')]
+                if item.startswith('Produced')]
+    nose.tools.assert_true(len(produced) <= 4)
+    nose.tools.assert_equal(len(queue), 24)
+
+
 def _reload_joblib():
     # Retrieve the path of the parallel module in a robust way
     joblib_path = Parallel.__module__.split(os.sep)
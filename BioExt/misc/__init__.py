@@ -12,6 +12,7 @@ from itertools import groupby, product
 from random import randint, random
 from re import compile as re_compile
 
+from Bio.Alphabet import single_letter_alphabet
 from Bio.Seq import Seq, translate as _translate
 from Bio.SeqRecord import SeqRecord
 from Bio.SeqFeature import FeatureLocation, SeqFeature
@@ -346,29 +347,57 @@ def gapless(seq):
 
 _cigar_regexp = re_compile(r'([0-9]+)([M=XID])')
 
+# the SAM operations, by their code in a pysam read
+_CIGAR_MODES = 'MIDNSHP=X'
+
+
+def _alignment(record):
+    # the position, the CIGAR (as (length, mode) pairs, of the modes M, =, X, I and D),
+    # the sequence, its alphabet and the annotations of the aligned record:
+    # those of a lazy record (see BamIO.parse) come straight from its read,
+    # annotated only with its reference name, position and CIGAR,
+    # so that neither its annotations nor its Seq are ever built
+    if hasattr(record, 'cigar') and hasattr(record, 'sequence'):
+        cigar = [
+            (num, _CIGAR_MODES[mode])
+            for mode, num in record.cigar
+            if _CIGAR_MODES[mode] in 'M=XID'
+            ]
+        annotations = {
+            'reference_name': record.reference_name,
+            'position': record.position,
+            'CIGAR': ''.join('{0:d}{1:s}'.format(num, mode) for num, mode in cigar)
+            }
+        return record.position, cigar, record.sequence, single_letter_alphabet, annotations
+    return (
+        record.annotations['position'],
+        [(int(m.group(1)), m.group(2)) for m in _cigar_regexp.finditer(record.annotations['CIGAR'])],
+        record.seq,
+        record.seq.alphabet,
+        copy(record.annotations)
+        )
+
 
 def gapful(record, insertions=True):
     p = 0
     modes = 'M=XI' if insertions else 'M=X'
-    cigparts = []
-    seqparts = ['-' * (record.annotations['position'])]
-    for m in _cigar_regexp.finditer(record.annotations['CIGAR']):
-        num, mode = int(m.group(1)), m.group(2)
+    position, cigar, seq, alphabet, annotations = _alignment(record)
+    seqparts = ['-' * position]
+    for num, mode in cigar:
         if mode in modes:
-            cigparts.append(m.group(0))
-            seqparts.append(str(record.seq[p:(p + num)]))
+            seqparts.append(str(seq[p:(p + num)]))
         elif mode == 'D':
             seqparts.append('-' * num)
         if mode != 'D':
             p += num
     return SeqRecord(
-        Seq(''.join(seqparts), record.seq.alphabet),
+        Seq(''.join(seqparts), alphabet),
         id=record.id,
         name=record.name,
         dbxrefs=copy(record.dbxrefs),
         # features = seq.features,
         description=record.description,
-        annotations=copy(record.annotations),
+        annotations=annotations,
         # letter_annotations=record.letter_annotations
         )
 
@@ -384,17 +413,18 @@ def rle_encode(iterable):
 
 
 def clip(record, start, end, insertions=True, span=False):
-    if span and record.annotations['position'] > start:
+    position, cigar, seq, alphabet, annotations = _alignment(record)
+
+    if span and position > start:
         return None
 
     bases = []
     poses = []
     modes = []
 
-    pos = record.annotations['position']
-    seq = iter(record.seq)
-    for m in _cigar_regexp.finditer(record.annotations['CIGAR']):
-        num, mode = int(m.group(1)), m.group(2).upper()
+    pos = position
+    seq = iter(seq)
+    for num, mode in cigar:
         if not insertions and mode == 'I':
             # if we're skipping insertions, consume those bases
             for _ in range(num):
@@ -415,12 +445,11 @@ def clip(record, start, end, insertions=True, span=False):
     if span and (min(poses) > start or max(poses) < (end - 1)):
         return None
 
-    annotations = copy(record.annotations)
     annotations['CIGAR'] = rle_encode(modes)
     annotations['position'] = min(poses)
 
     return SeqRecord(
-        Seq(''.join(base for base in bases if base), record.seq.alphabet),
+        Seq(''.join(base for base in bases if base), alphabet),
         id=record.id,
         name=record.name,
         dbxrefs=copy(record.dbxrefs),
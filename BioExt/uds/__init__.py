@@ -3,10 +3,13 @@ from __future__ import division, print_function
 
 import os
 
-from ctypes import c_char
-from multiprocessing import Array
+from collections import OrderedDict, defaultdict, deque
+from hashlib import sha1
+from itertools import islice
 from operator import itemgetter
 from sys import stderr
+from threading import Lock
+from time import time
 
 from Bio.Align import MultipleSeqAlignment
 
@@ -15,7 +18,7 @@ from Bio.SeqRecord import SeqRecord
 
 from BioExt.align import Aligner
 from BioExt.joblib import Parallel, delayed
-from BioExt.misc import compute_cigar, gapful, gapless
+from BioExt.misc import gapful, gapless
 
 
 __all__ = [
@@ -23,6 +26,16 @@ __all__ = [
     ]
 
 
+# chunks of reads are sized automatically so that each task
+# takes about _CHUNK_SECONDS, and holds at most _CHUNK_MAX reads
+_CHUNK_SECONDS = 0.1
+_CHUNK_MAX = 1024
+
+# the results of at most _DISTINCT_MAX distinct reads no read waits on
+# are kept to fan out to identical reads still to come
+_DISTINCT_MAX = 2 ** 16
+
+
 def _rc(record):
     if isinstance(record, str):
         return rc(record)
@@ -41,17 +54,168 @@ def _rc(record):
             )
 
 
-# aln, ref, ref_name, and do_revcomp are set by set_globals below
+def _cigar_record(record, cigar, position, edit_distance, reference_name):
+    # record, ungapped and uppercase, annotated as compute_cigar would
+    record = gapless(record)
+    record_ = SeqRecord(
+        Seq(str(record.seq).upper(), record.seq.alphabet),
+        id=record.id,
+        name=record.name,
+        description=record.description,
+        dbxrefs=record.dbxrefs,
+        annotations=record.annotations
+        )
+    record_.annotations['CIGAR'] = ''.join('{0:d}{1:s}'.format(num, 'MID'[op]) for op, num in cigar)
+    record_.annotations['edit_distance'] = edit_distance
+    record_.annotations['position'] = position
+    record_.annotations['length'] = sum(num for _, num in cigar)
+    record_.annotations['reference_name'] = reference_name
+    return record_
+
+
+def _cigar_tuple(record, cigar, position, edit_distance, tid):
+    # the alignment of record, as the tuple BamIO.write_alignments takes
+    if isinstance(record, SeqRecord):
+        name, seq = record.name, str(record.seq)
+    else:
+        name, seq = None, str(record)
+    seq = seq.replace('-', '').upper().encode('ascii')
+    return name, tid, position, cigar, seq, edit_distance
+
+
+def _tuple_record(alignment, record):
+    # the read record of alignment, to discard: record itself, with its id and description,
+    # or its reverse complement if that is the strand which was aligned
+    seq = alignment[4].decode('ascii')
+    if not isinstance(record, SeqRecord):
+        return SeqRecord(Seq(seq))
+    if str(record.seq).replace('-', '').upper() != seq:
+        return _rc(record)
+    return record
+
+
+# aln, ref, ref_name, panel, panel_names, panel_hits, do_revcomp, prescreen, seed
+# and tuples are set by set_globals below: ref and ref_name are None in panel mode,
+# panel and panel_names are otherwise
+def _window(ref_, record):
+    # the window of the reference ref_ the k-mer seeds of record place it in,
+    # and the offset of the window, or the whole reference if it has no seeds
+    if seed:
+        window = ref_.seed(record)
+        if window is not None:
+            start, end = window
+            return ref_.window(start, end), start
+    return ref_, 0
+
+
+def _cigar(ref_, record, window, offset, min_score=None):
+    # the alignment of record to window, and the offset of window in the reference ref_,
+    # or the alignment to the whole reference if it runs into an edge of the window
+    # which is not an edge of the reference, as the window then cuts it short.
+    # min_score, the score of record from the prescreen, widens a band which misses it
+    result = aln.cigar(window, record, min_score=min_score)
+    if window is not ref_:
+        _, cigar, position, _ = result
+        span = sum(num for op, num in cigar if op != 1)
+        if ((offset > 0 and position == 0) or
+                (offset + len(window) < len(ref_) and position + span >= len(window))):
+            return aln.cigar(ref_, record, min_score=min_score), 0
+    return result, offset
+
+
+def _strands(record, strand):
+    # record, its reverse complement, or both, for strand 1, -1 or 0
+    if strand > 0:
+        return (record,)
+    elif strand < 0:
+        return (_rc(record),)
+    return (record, _rc(record))
+
+
+def _candidates(record):
+    # the references to align record to, each with its name, its tid
+    # (its index in the panel) and the strands of record to align to it
+    if panel is None:
+        # align both strands only when shared k-mers can't tell which one the read is on
+        return [(ref, ref_name, 0, _strands(record, ref.orientation(record) if do_revcomp else 1))]
+    # in panel mode, the screen tells the strand on each reference apart as well
+    return [
+        (panel[i], panel_names[i], i, _strands(record, strand))
+        for i, strand in panel.screen(record, panel_hits, do_revcomp)
+        ]
+
+
 def _align(record):
-    records = (record, _rc(record)) if do_revcomp else (record,)
-    score, ref_, record = max(
-        (aln(ref.value.decode('utf-8'), record) for record in records),
-        key=itemgetter(0)
+    records = [
+        (r, ref_, (name, tid)) + _window(ref_, r)
+        for ref_, name, tid, records_ in _candidates(record)
+        for r in records_
+        ]
+    min_score = None
+    if prescreen:
+        # score without a backtrack first, and only align
+        # the best orientation and reference, if it is good enough to keep
+        score, record_ = max(
+            ((aln.score(window, r), (r, ref_, name, window, offset)) for r, ref_, name, window, offset in records),
+            key=itemgetter(0)
+            )
+        if not aln.expected(score):
+            return score, record
+        records = (record_,)
+        min_score = score
+    # the alignment comes straight from the backtrack as a CIGAR,
+    # without building the aligned strings
+    (score, cigar, position, edit_distance), offset, record, (name, tid) = max(
+        (_cigar(ref_, r, window, offset, min_score) + (r, name) for r, ref_, name, window, offset in records),
+        key=lambda quad: quad[0][0]
         )
-    record_ = compute_cigar(ref_, record, ref_name)
+    # leading deletions are never part of the alignment,
+    # so the position in the window is offset to the reference
+    if tuples:
+        return score, _cigar_tuple(record, cigar, position + offset, edit_distance, tid)
+    record_ = _cigar_record(record, cigar, position + offset, edit_distance, name)
     return score, record_
 
 
+def _align_chunk(keys, records):
+    # align each of records in a single task, timing them all,
+    # and return keys with the results, to tell them apart unordered,
+    # and the counters of the chunk if aln collects them, by worker
+    start = time()
+    results = [_align(record) for record in records]
+    stats = aln.stats.pop() if aln.stats is not None else None
+    # the matrices grown for the largest reads are cut back
+    # between chunks, while the worker would otherwise hold them idle
+    if aln.buffer_cells is not None:
+        aln.release_buffers()
+    return keys, time() - start, results, (os.getpid(), stats)
+
+
+def _key(record):
+    # identical reads, once gapless and uppercase, share a key
+    if isinstance(record, SeqRecord):
+        record = record.seq
+    return sha1(str(record).replace('-', '').upper().encode('utf-8')).digest()
+
+
+def _fanout(record, record_):
+    # the result record_ of aligning another read identical to record, as record's
+    if not isinstance(record, SeqRecord):
+        return record_
+    if isinstance(record_, tuple):
+        return (record.name,) + record_[1:]
+    if not isinstance(record_, SeqRecord):
+        return record_
+    return SeqRecord(
+        record_.seq,
+        id=record.id,
+        name=record.name,
+        description=record.description,
+        dbxrefs=record.dbxrefs,
+        annotations=dict(record_.annotations)
+        )
+
+
 def _set_globals(*args):
     for key, value in args:
         globals()[key] = value
@@ -69,8 +233,28 @@ def _align_par(
 	    globalStartingPoint,
         extendGapPenalty,
         quiet=True,
+        band_width=None,
+        prescreen=False,
+        buffer_cells=None,
+        seed=False,
+        chunk_size=None,
+        ordered=True,
+        reorder_buffer=None,
+        precision='f64',
+        x_drop=None,
+        stats=None,
+        panel_hits=None,
+        cache=None,
+        tuples=False
         ):
 
+    # stats, if given, is an AlignStats the counters of every worker are merged into,
+    # and cache, if given, an AlignCache the workers share.
+    # with tuples, output gets each alignment as the (qname, tid, pos, cigar, seq, NM)
+    # tuple BamIO.write_alignments takes, rather than as a SeqRecord,
+    # where tid is the index of its reference in the panel (0 without one)
+    start = time()
+
     try:
         n_jobs = int(os.environ.get('NCPU', -1))
     except ValueError:
@@ -79,68 +263,231 @@ def _align_par(
     if n_jobs == 0:
         n_jobs = 1
 
+    # each task aligns a chunk of chunk_size reads,
+    # sized automatically if it is 0
+    if chunk_size is None:
+        try:
+            chunk_size = int(os.environ.get('NCHUNK', 0))
+        except ValueError:
+            chunk_size = 0
+
+    if chunk_size < 0:
+        chunk_size = 0
+
     aln = Aligner(
         score_matrix,
         globalStartingPoint,
         extendGapPenalty,
         do_codon=do_codon,
-        expected_identity=expected_identity
+        expected_identity=expected_identity,
+        band_width=band_width,
+        buffer_cells=buffer_cells,
+        precision=precision,
+        x_drop=x_drop,
+        stats=stats is not None,
+        cache=cache
         )
 
-    if isinstance(reference, str):
-        refstr = reference
-    elif isinstance(reference, Seq):
-        refstr = str(reference)
-    elif isinstance(reference, SeqRecord):
-        refstr = str(reference.seq)
-    else:   
-        raise ValueError(
-            'reference must be one of str, Bio.Seq, Bio.SeqRecord'
-            )
-    
+    def refstr(reference):
+        if isinstance(reference, str):
+            return reference
+        elif isinstance(reference, Seq):
+            return str(reference)
+        elif isinstance(reference, SeqRecord):
+            return str(reference.seq)
+        else:
+            raise ValueError(
+                'reference must be one of str, Bio.Seq, Bio.SeqRecord'
+                )
 
-    reference_ = Array(c_char, refstr.encode('utf-8'))
+    # a list of references is a panel: each read is only aligned to the
+    # panel_hits references it shares the most k-mers with, and the best of
+    # those alignments is kept, under the name of its reference
+    if isinstance(reference, (list, tuple)):
+        names = [r.name for r in reference]
+        if len(set(names)) != len(names):
+            raise ValueError('the references of a panel must have distinct names')
+        panel = aln.prepare_panel([refstr(r) for r in reference])
+        reference_, ref_name = None, None
+    else:
+        # encode the reference once, rather than for every record
+        reference_ = aln.prepare_reference(refstr(reference))
+        ref_name = reference.name
+        panel, names = None, None
 
-    def keep(score, record):
+    def keep(score, record, record_):
+        # record is the result for the read record_
         if aln.expected(score):
             return True
         elif discard:
-            discard(record)
+            discard(_tuple_record(record, record_) if isinstance(record, tuple) else record)
         print("keep(score, record) returned false")
         return False
         
 
+    # identical reads are aligned once, only the first of each is dispatched:
+    # in order, every read is queued in pending, flagged if it is the first of its kind,
+    # and the others are fanned back out from it as its result comes back;
+    # unordered, a read waits in waiting, behind the first of its kind, for its result,
+    # or is queued in pending, ready, if that is already in.
+    # live holds the result, or None until it is in, of every key a read still
+    # waits on, refs how many reads wait on it; once none does, the result moves
+    # to done, which keeps only the _DISTINCT_MAX most recently seen, so that a
+    # read identical to one long evicted is aligned again
+    pending = deque()
+    waiting = defaultdict(list)
+    live = {}
+    refs = defaultdict(int)
+    done = OrderedDict()
+    counts = [0, 0]
+    lock = Lock()
+
+    def distinct(records):
+        for record in records:
+            key = _key(record)
+            with lock:
+                counts[0] += 1
+                if key in done:
+                    live[key] = done.pop(key)
+                first = key not in live
+                if first:
+                    live[key] = None
+                    counts[1] += 1
+                refs[key] += 1
+                if ordered:
+                    pending.append((record, key, first))
+                elif first or live[key] is None:
+                    waiting[key].append(record)
+                else:
+                    pending.append((record, key, False))
+            if first:
+                yield key, record
+
+    def result(key, result_=None):
+        # the result of key, once for each read waiting on it,
+        # setting it first if it is given
+        with lock:
+            if result_ is not None:
+                live[key] = result_
+            result_ = live[key]
+            refs[key] -= 1
+            if not refs[key]:
+                del refs[key]
+                done[key] = live.pop(key)
+                while len(done) > _DISTINCT_MAX:
+                    done.popitem(last=False)
+        return result_
+
+    def fanout(aligned):
+        # each score and result, with the read it is the result for
+        for key, (score, record_) in aligned:
+            if ordered:
+                while True:
+                    record, key_, first = pending.popleft()
+                    if first:
+                        result(key_, (score, record_))
+                        yield score, record_, record
+                        break
+                    score_, record__ = result(key_)
+                    yield score_, _fanout(record, record__), record
+                continue
+            with lock:
+                live[key] = score, record_
+                records_ = waiting.pop(key)
+            result(key)
+            yield score, record_, records_[0]
+            for record in records_[1:]:
+                result(key)
+                yield score, _fanout(record, record_), record
+            while pending:
+                record, key_, _ = pending.popleft()
+                score_, record__ = result(key_)
+                yield score_, _fanout(record, record__), record
+        while pending:
+            record, key_, _ = pending.popleft()
+            score_, record__ = result(key_)
+            yield score_, _fanout(record, record__), record
+
+    # the mean time to align a read, in the chunks aligned so far
+    timing = [0.0, 0]
+
+    def chunks(records):
+        records = iter(records)
+        while True:
+            size = chunk_size
+            if not size:
+                elapsed, n = timing
+                if n:
+                    size = int(_CHUNK_SECONDS * n / elapsed) if elapsed > 0 else _CHUNK_MAX
+                    size = max(1, min(size, _CHUNK_MAX))
+                else:
+                    size = 1
+            chunk = list(islice(records, size))
+            if not chunk:
+                return
+            yield zip(*chunk)
+
+    def unchunk(results):
+        for keys, elapsed, aligned, (worker, stats_) in results:
+            timing[0] += elapsed
+            timing[1] += len(aligned)
+            if stats is not None:
+                stats.merge(stats_, worker)
+            for pair in zip(keys, aligned):
+                yield pair
+
+    def collapse():
+        return '{0:9d} reads, {1:9d} distinct ({2:.2f}x)'.format(
+            counts[0],
+            counts[1],
+            counts[0] / counts[1] if counts[1] else 1.0
+            )
+
     if quiet:
         def delayed_(i, fn):
             return delayed(fn)
     else:
         def delayed_(i, fn):
-            print('\rdispatched: {0:9d} reads'.format(i), end='', file=stderr)
+            print('\rdispatched: ' + collapse(), end='', file=stderr)
             stderr.flush()
             return delayed(fn)
 
     rv = output(
         record
-        for score, record in Parallel(
+        for score, record, record_ in fanout(unchunk(Parallel(
             n_jobs=n_jobs,
             verbose=0,
             pre_dispatch='3 * n_jobs',  # triple-buffering
+            ordered=ordered,
+            reorder_buffer=reorder_buffer,
             initializer=_set_globals,
             initargs=[
                 ('aln', aln),
                 ('ref', reference_),
-                ('ref_name', reference.name),
-                ('do_revcomp', reverse_complement)
+                ('ref_name', ref_name),
+                ('panel', panel),
+                ('panel_names', names),
+                ('panel_hits', panel_hits),
+                ('do_revcomp', reverse_complement),
+                ('prescreen', prescreen and expected_identity is not None),
+                # a window of the reference only gives the same alignment
+                # when the ends of the reference are free to leave unaligned
+                ('seed', seed and not globalStartingPoint),
+                ('tuples', tuples)
                 ]
             ).lazy(
-                delayed_(i, _align)(record)
-                for i, record in enumerate(records, start=1)
-                )
-        if keep(score, record)
+                delayed_(i, _align_chunk)(keys, chunk)
+                for i, (keys, chunk) in enumerate(chunks(distinct(records)), start=1)
+                )))
+        if keep(score, record, record_)
         )
 
     if not quiet:
-        print('', file=stderr)
+        print('\rprocessed:  ' + collapse(), file=stderr)
+
+    if stats is not None:
+        stats.reads = counts[0]
+        stats.elapsed = time() - start
 
     return rv
 
@@ -0,0 +1,69 @@
+"""
+Test that discarded reads keep the headers they were read with.
+"""
+
+from __future__ import division, print_function
+
+import random
+
+from Bio.Seq import Seq, reverse_complement
+from Bio.SeqRecord import SeqRecord
+
+from BioExt.references import hxb2
+from BioExt.scorematrices import DNA80
+from BioExt.uds import _align_par
+
+import nose
+
+
+def reads():
+    # two copies of a random read, unlike anything in HXB2 env, and a piece of env,
+    # reverse complemented, with a few miscalls, each with a description in its header
+    rng = random.Random(0)
+    seq = str(hxb2.env.load().seq).replace('-', '')
+    junk = ''.join(rng.choice('ACGT') for _ in range(300))
+    read = list(seq[300:600])
+    for i in (50, 150, 250):
+        read[i] = 'A' if read[i] != 'A' else 'C'
+    return [
+        SeqRecord(Seq(junk), id='r1', name='r1', description='r1 sample=X first copy'),
+        SeqRecord(Seq(reverse_complement(''.join(read))), id='r2', name='r2', description='r2 sample=X reversed'),
+        SeqRecord(Seq(junk), id='r3', name='r3', description='r3 sample=Y second copy')
+        ]
+
+
+def check_discard(ordered, tuples):
+    reads_ = reads()
+    discarded = []
+    kept = []
+    _align_par(
+        hxb2.env.load(),
+        reads_,
+        DNA80.load(),
+        False,
+        True,
+        0.999,
+        discarded.append,
+        kept.extend,
+        False,
+        2.5,
+        ordered=ordered,
+        tuples=tuples
+        )
+    nose.tools.assert_equal(kept, [])
+    discarded = dict((record.id, record) for record in discarded)
+    nose.tools.assert_equal(sorted(discarded), ['r1', 'r2', 'r3'])
+    for read in reads_:
+        record = discarded[read.id]
+        nose.tools.assert_equal(record.description, read.description)
+    # the reads are discarded as they were aligned, on the strand of the reference
+    nose.tools.assert_equal(str(discarded['r1'].seq).upper(), str(reads_[0].seq))
+    nose.tools.assert_equal(str(discarded['r2'].seq).upper(), reverse_complement(str(reads_[1].seq)))
+
+
+###############################################################################
+
+def test_discard():
+    for ordered in (True, False):
+        for tuples in (True, False):
+            check_discard(ordered, tuples)
@@ -4,6 +4,7 @@ import sys
 
 from Bio import SeqIO
 
+from BioExt.align import AlignCache
 from BioExt.args import (
     add_alphabet,
     add_reference,
@@ -49,7 +50,8 @@ def main(
         globalStartingPoint,
         threshold,
         insertGroups,
-        keepGaps
+        keepGaps,
+        cache=None
         ):
 
     retcode1 = bealign.main(
@@ -65,7 +67,8 @@ def main(
                 quiet,
                 codonMatrix,
                 globalStartingPoint,
-                extendGapPenalty
+                extendGapPenalty,
+                cache=cache
                 )
     retcode2 = retcode3 = 0
     
@@ -85,7 +88,8 @@ def main(
                 quiet,
                 codonMatrix,
                 globalStartingPoint,
-                extendGapPenalty
+                extendGapPenalty,
+                cache=cache
                 )
 
     return retcode1+retcode2+retcode3
@@ -198,6 +202,28 @@ if __name__ == '__main__':
         action='store_true',
         help='Print consensus with gaps. (Default is to gap-strip).'
         )
+    parser.add_argument(
+        '-C', '--cache',
+        metavar='CACHE',
+        nargs='?',
+        const='',
+        default=None,
+        help=(
+            'reuse the alignments of sequences already aligned to the same reference '
+            'with the same options, keeping them in the database CACHE '
+            '[the default is alignments.sqlite in the BioExt cache directory]'
+            )
+        )
+    parser.add_argument(
+        '--cache-size',
+        metavar='ALIGNMENTS',
+        type=int,
+        default=None,
+        help=(
+            'keep at most ALIGNMENTS alignments in the cache, '
+            'evicting those least recently used [default=1048576]'
+            )
+        )
 
     args = None
     retcode = -1
@@ -225,7 +251,8 @@ if __name__ == '__main__':
             args.globalStartingPoint, 
             args.threshold,
             args.insertGroups,
-            args.keepGaps
+            args.keepGaps,
+            AlignCache(args.cache or None, args.cache_size) if args.cache is not None else None
         )
     finally:
         if args is not None:
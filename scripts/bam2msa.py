@@ -4,7 +4,8 @@ import signal
 import argparse
 
 from Bio import SeqIO
-from BioExt.io._SamBamIO import _to_seqrecord
+from BioExt.io import BamIO
+from BioExt.io._SamBamIO import _LazyRecord
 from BioExt.misc import gapful
 
 import pysam
@@ -36,8 +37,8 @@ def main(bam_file, out_handle, start=None, end=None):
         pass
 
     try:
-        # Index bam file in order to samfile.fetch
-        pysam.index(bam_file)
+        # Index bam file in order to samfile.fetch, unless its index is current
+        BamIO.index(bam_file)
         samfile = pysam.Samfile(bam_file, 'rb')
         length = samfile.header['SQ'][0]['LN']
         fetch_args = []
@@ -49,7 +50,7 @@ def main(bam_file, out_handle, start=None, end=None):
             (
                 (seq + ('-' * (length - len(seq))))[start:end]
                 for seq in (
-                    gapful(_to_seqrecord(samfile, record), insertions=False)
+                    gapful(_LazyRecord(record, samfile.references), insertions=False)
                     for record in samfile.fetch(*fetch_args)
                     )
                 ),
@@ -6,13 +6,15 @@ import sys
 
 from Bio import SeqIO
 
+from BioExt.align import AlignCache, AlignStats
 from BioExt.args import (
     add_alphabet,
+    add_panel,
     add_reference,
     add_scorematrix
     )
 from BioExt.io import BamIO
-from BioExt.misc import compute_cigar, gapless
+from BioExt.misc import gapless
 from BioExt.scorematrices import (
     DNAScoreMatrix,
     FrequenciesError,
@@ -33,7 +35,21 @@ def main(
         do_sort,
         quiet,
         globalStartingPoint, 
-	    extendGapPenalty
+	    extendGapPenalty,
+        band_width=None,
+        prescreen=False,
+        buffer_cells=None,
+        seed=False,
+        chunk_size=None,
+        ordered=True,
+        reorder_buffer=None,
+        precision='f64',
+        x_drop=None,
+        stats=False,
+        stats_handle=None,
+        panel_hits=None,
+        cache=None,
+        sort_buffer=None
         ):
 
     try:
@@ -50,13 +66,29 @@ def main(
 
     do_codon = alphabet == 'codon'
 
+    # the positions of a panel are in its gapless references
+    if isinstance(reference, list):
+        reference = [gapless(ref) for ref in reference]
+        if do_codon:
+            dropped = [ref.name for ref in reference if len(ref) % 3]
+            if dropped:
+                print(
+                    'dropping the references which are not a whole number of codons from the panel:',
+                    ', '.join(dropped),
+                    file=sys.stderr
+                    )
+                reference = [ref for ref in reference if len(ref) % 3 == 0]
+
     records = SeqIO.parse(input_handle, 'fasta')
 
     # grab the first, make it gapless once and for all
+    # the alignments are written straight from the (qname, tid, pos, cigar, seq, NM)
+    # tuples of the workers, without a SeqRecord for each
     if reference is None:
         reference = gapless(next(records))
         def allseqs(records):
-            yield compute_cigar(reference, reference)
+            seq = str(reference.seq).upper()
+            yield reference.name, 0, 0, [(0, len(seq))], seq.encode('ascii'), 0
             for record in records:
                 yield record
     else:
@@ -70,13 +102,18 @@ def main(
     else:
         discard = None
 
+    # the BAM is sorted as it is written, in the same pass as the alignment
     def output(records):
-        BamIO.write(
+        BamIO.write_alignments(
             allseqs(records),
             output_handle,
-            reference
+            reference,
+            sort=do_sort,
+            buffer_size=sort_buffer
             )
 
+    stats_ = AlignStats() if stats or stats_handle else None
+
     retcode = -1
     try:
         _align_par(
@@ -90,10 +127,25 @@ def main(
             output,
             globalStartingPoint,
             extendGapPenalty,
-            quiet
+            quiet,
+            band_width,
+            prescreen,
+            buffer_cells,
+            seed,
+            chunk_size,
+            ordered,
+            reorder_buffer,
+            precision,
+            x_drop,
+            stats_,
+            panel_hits,
+            cache,
+            True
             )
-        if do_sort:
-            BamIO.sort(output_handle)
+        if stats:
+            print(stats_, file=sys.stderr)
+        if stats_handle:
+            stats_.dump(stats_handle)
         retcode = 0
     except FrequenciesError:
         print(
@@ -142,7 +194,9 @@ if __name__ == '__main__':
         type=argparse.FileType('wb'),
         help='send BAM to OUTPUT'
         )
-    add_reference(parser, '-r', '--reference')
+    references = parser.add_mutually_exclusive_group()
+    add_reference(references, '-r', '--reference')
+    add_panel(references, '-p', '--panel')
     parser.add_argument(
         '-e', '--expected-identity',
         type=probability,
@@ -171,6 +225,16 @@ if __name__ == '__main__':
         action='store_false',
         help='do NOT sort the resulting BAM file [the default is to sort]'
         )
+    parser.add_argument(
+        '--sort-buffer',
+        metavar='READS',
+        type=int,
+        default=None,
+        help=(
+            'sort the BAM file in runs of at most READS sequences in memory, '
+            'spilling each run to a temporary BAM file to merge [default=262144]'
+            )
+        )
     parser.add_argument(
         '-q', '--quiet',
         action='store_true',
@@ -194,16 +258,166 @@ if __name__ == '__main__':
         help='set the extend gap penalty to this percentage of the range of the scoring matrix [default=2.5]' 
         )
 
+    parser.add_argument(
+        '-b', '--band-width',
+        metavar='BAND_WIDTH',
+        type=int,
+        default=None,
+        help=(
+            'only compute the alignment within BAND_WIDTH positions of the diagonal '
+            'the k-mer seeds of each sequence place it on, widening the band automatically '
+            'when the alignment reaches its edge, or scores below --prescreen, '
+            'and aligning the sequences without seeds in full '
+            '[the default is to compute the full alignment]'
+            )
+        )
+    parser.add_argument(
+        '-P', '--prescreen',
+        action='store_true',
+        help=(
+            'score each sequence without building its alignment first, '
+            'and only align those that pass --expected-identity'
+            )
+        )
+    parser.add_argument(
+        '-B', '--buffer-cells',
+        metavar='CELLS',
+        type=int,
+        default=None,
+        help=(
+            'release alignment buffers larger than CELLS cells between chunks of sequences, '
+            'so that the memory each worker holds while idle stays bounded '
+            '[the default is to keep them for the next chunk]'
+            )
+        )
+    parser.add_argument(
+        '-s', '--seed',
+        action='store_true',
+        help=(
+            'only align each sequence to the window of the reference '
+            'its shared k-mers place it in, aligning those without any '
+            'to the whole reference (ignored with --globalStartingPoint)'
+            )
+        )
+    parser.add_argument(
+        '-c', '--chunk-size',
+        metavar='CHUNK_SIZE',
+        type=int,
+        default=None,
+        help=(
+            'send CHUNK_SIZE sequences to each worker at a time, '
+            'or size the chunks automatically if it is 0 '
+            '[the default is the NCHUNK environment variable, or 0]'
+            )
+        )
+    parser.add_argument(
+        '-u', '--unordered',
+        dest='ordered',
+        action='store_false',
+        help=(
+            'write each sequence as soon as it is aligned, '
+            'rather than in the order of INPUT'
+            )
+        )
+    parser.add_argument(
+        '--reorder-buffer',
+        metavar='CHUNKS',
+        type=int,
+        default=None,
+        help=(
+            'keep at most CHUNKS chunks aligned ahead of the oldest one still '
+            'being aligned, waiting to be written in order '
+            '[the default is no limit]'
+            )
+        )
+    parser.add_argument(
+        '--precision',
+        choices=('f64', 'f32', 'i32-scaled'),
+        default='f64',
+        help=(
+            'the numeric type of the alignment matrices: f32 halves their memory, '
+            'but unless every score is exact in a float (as in DNA80) its scores '
+            'are rounded, by a few parts in 10^7 with the default score matrix, '
+            'which can change the alignment, or which reads -e keeps, near the threshold; '
+            'i32-scaled scales the scores to integers when they allow it, '
+            'and aligns as f64 otherwise [default=f64]'
+            )
+        )
+    parser.add_argument(
+        '-X', '--x-drop',
+        metavar='X',
+        type=float,
+        default=None,
+        help=(
+            'stop extending the alignment where its score falls more than X '
+            'below the best score of the same part of the sequence, '
+            'leaving the rest of the sequence unaligned '
+            '[the default is to compute the full alignment]'
+            )
+        )
+    parser.add_argument(
+        '--panel-hits',
+        metavar='HITS',
+        type=int,
+        default=None,
+        help=(
+            'with --panel, only align each sequence to the HITS references '
+            'it shares the most k-mers with, keeping the best alignment [default=2]'
+            )
+        )
+    parser.add_argument(
+        '-C', '--cache',
+        metavar='CACHE',
+        nargs='?',
+        const='',
+        default=None,
+        help=(
+            'reuse the alignments of sequences already aligned to the same reference '
+            'with the same options, keeping them in the database CACHE '
+            '[the default is alignments.sqlite in the BioExt cache directory]'
+            )
+        )
+    parser.add_argument(
+        '--cache-size',
+        metavar='ALIGNMENTS',
+        type=int,
+        default=None,
+        help=(
+            'keep at most ALIGNMENTS alignments in the cache, '
+            'evicting those least recently used [default=1048576]'
+            )
+        )
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help=(
+            'print the cells computed, the buffer resizes, the traceback steps '
+            'and the frameshifts of the alignments, and the rates of the run'
+            )
+        )
+    parser.add_argument(
+        '--stats-json',
+        metavar='STATS',
+        type=argparse.FileType('w'),
+        default=None,
+        help='dump the same counters, for the whole run and for each worker, as JSON to STATS'
+        )
+
     args = None
     retcode = -1
     try:
         args = parser.parse_args()
         output_file = args.output.name
         args.output.close()
+        if args.panel:
+            # the references of the panel, in the order given
+            reference = [ref for refs in args.panel for ref in refs]
+        else:
+            reference = args.reference
         retcode = main(
             args.input,
             output_file,
-            args.reference,
+            reference,
             args.expected_identity,
             args.alphabet,
             args.reverse_complement,
@@ -212,13 +426,29 @@ if __name__ == '__main__':
             args.sort,
             args.quiet,
             args.globalStartingPoint,
-            args.extendGapPenalty
+            args.extendGapPenalty,
+            args.band_width,
+            args.prescreen,
+            args.buffer_cells,
+            args.seed,
+            args.chunk_size,
+            args.ordered,
+            args.reorder_buffer,
+            args.precision,
+            args.x_drop,
+            args.stats,
+            args.stats_json,
+            args.panel_hits,
+            AlignCache(args.cache or None, args.cache_size) if args.cache is not None else None,
+            args.sort_buffer
         )
     finally:
         if args is not None:
             # close input file handle
             if args.input and args.input != sys.stdin:
                 args.input.close()
+            if args.stats_json:
+                args.stats_json.close()
             if args.discard and args.discard != sys.stdout:
                 args.discard.close()
                 try:
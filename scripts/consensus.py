@@ -11,7 +11,8 @@ from Bio.Alphabet import single_letter_alphabet
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
-from BioExt.io._SamBamIO import _to_seqrecord
+from BioExt.io import BamIO
+from BioExt.io._SamBamIO import _LazyRecord
 from BioExt.joblib import Parallel, delayed
 from BioExt.misc import clip
 from BioExt.quiver import NoQVsModelParams, extractFeatures, refineConsensus
@@ -100,7 +101,7 @@ def main(
 
     samfile = None
     try:
-        pysam.index(bam_handle)
+        BamIO.index(bam_handle)
         samfile = pysam.Samfile(bam_handle, 'rb')
         reference = samfile.header['SQ'][0]['SN']
         alignment_length = samfile.header['SQ'][0]['LN']
@@ -127,7 +128,7 @@ def main(
                 reads = [
                     str(read_.seq)
                     for read_ in (
-                        clip(_to_seqrecord(samfile, read), start, end, span=True)
+                        clip(_LazyRecord(read, samfile.references), start, end, span=True)
                         for read in samfile.fetch(reference, start, end)
                         )
                     if read_
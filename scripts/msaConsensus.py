@@ -6,6 +6,7 @@ import argparse
 from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
 from Bio.Seq import Seq
+from BioExt.io import BamIO
 from BioExt.io._SamBamIO import _to_seqrecord
 from BioExt.misc import gapful
 
@@ -50,8 +51,8 @@ def main(bam_file, out_handle, threshold, insertGroups, keepGaps):
 
 
     try:
-        # Index bam file in order to samfile.fetch
-        pysam.index(bam_file)
+        # Index bam file in order to samfile.fetch, unless its index is current
+        BamIO.index(bam_file)
         samfile = pysam.Samfile(bam_file, 'rb')
         print("Reading file: " + samfile.filename.decode('ascii'))
 
@@ -20,7 +20,10 @@ ext_modules = [
         'BioExt.align._align',
         sources=[
             os.path.join('BioExt', 'align', '_align.c'),
-            os.path.join('BioExt', 'align', 'alignment.c')
+            os.path.join('BioExt', 'align', 'alignment.c'),
+            os.path.join('BioExt', 'align', 'alignment_f32.c'),
+            os.path.join('BioExt', 'align', 'alignment_i32.c'),
+            os.path.join('BioExt', 'align', 'simd.c')
             ],
         include_dirs=np_inc,
         libraries=['m'],
@@ -62,6 +65,7 @@ setup(
     packages=[
         'BioExt',
         'BioExt.align',
+        'BioExt.align.test',
         'BioExt.args',
         'BioExt.collections',
         'BioExt.errorize',
@@ -72,6 +76,7 @@ setup(
         'BioExt.io.BamIO',
         'BioExt.io.LazyAlignIO',
         'BioExt.io.SamIO',
+        'BioExt.io.test',
         'BioExt.joblib',
         'BioExt.joblib.test',
         'BioExt.merge',
@@ -86,11 +91,13 @@ setup(
         'BioExt.scorematrices',
         'BioExt.stats',
         'BioExt.uds',
+        'BioExt.uds.test',
         'BioExt.untranslate'
         ],
     package_dir={
         'BioExt': 'BioExt',
         'BioExt.align': 'BioExt/align',
+        'BioExt.align.test': 'BioExt/align/test',
         'BioExt.args': 'BioExt/args',
         'BioExt.collections': 'BioExt/collections',
         'BioExt.errorize': 'BioExt/errorize',
@@ -101,6 +108,7 @@ setup(
         'BioExt.io.BamIO': 'BioExt/io/BamIO',
         'BioExt.io.LazyAlignIO': 'BioExt/io/LazyAlignIO',
         'BioExt.io.SamIO': 'BioExt/io/SamIO',
+        'BioExt.io.test': 'BioExt/io/test',
         'BioExt.joblib': 'BioExt/joblib',
         'BioExt.joblib.test': 'BioExt/joblib/test',
         'BioExt.merge': 'BioExt/merge',
@@ -115,6 +123,7 @@ setup(
         'BioExt.scorematrices': 'BioExt/scorematrices',
         'BioExt.stats': 'BioExt/stats',
         'BioExt.uds': 'BioExt/uds',
+        'BioExt.uds.test': 'BioExt/uds/test',
         'BioExt.untranslate': 'BioExt/untranslate'
         },
     package_data={